@@ -1,14 +1,25 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy import func, case, update, event, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from functools import wraps
 import os
+import re
+import time
+import json
+import base64
 import hashlib
+import threading
+import atexit
+from collections import OrderedDict, namedtuple
 import random
 import string
+import uuid
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sua-chave-secreta-super-segura-123'
@@ -42,45 +53,318 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(db_path, 'caixa.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# ==================== POOL DE CONEXÕES ====================
+
+# DB_POOLER=transaction quando o DATABASE_URL aponta para um PgBouncer (ou similar) em modo transação
+DB_POOLER = os.environ.get('DB_POOLER', '').strip().lower()
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+def opcoes_engine(url):
+    """Opções do engine SQLAlchemy para o banco configurado, ajustáveis por variáveis de ambiente.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE e
+    DB_POOL_PRE_PING controlam o pool; DB_STATEMENT_TIMEOUT_MS limita cada
+    comando e DB_PREPARE_THRESHOLD repassa o prepare_threshold do psycopg.
+    Com DB_POOLER=transaction o pool local é desligado (quem reaproveita as
+    conexões é o pooler), prepared statements ficam desativados e o timeout
+    é aplicado por transação.
+    """
+    opcoes = {'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0'}
+    if not url.startswith('postgresql'):
+        return opcoes
+
+    connect_args = {}
+    if DB_POOLER == 'transaction':
+        from sqlalchemy.pool import NullPool
+        opcoes['poolclass'] = NullPool
+        # O pooler pode entregar outra conexão do servidor a cada transação
+        connect_args['prepare_threshold'] = None
+    else:
+        # Render derruba conexões ociosas; reciclar antes disso evita reconexão no meio da requisição
+        opcoes.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 280)),
+        )
+        if os.environ.get('DB_PREPARE_THRESHOLD'):
+            limite = os.environ['DB_PREPARE_THRESHOLD'].strip().lower()
+            connect_args['prepare_threshold'] = None if limite in ('', 'none', 'off') else int(limite)
+        if DB_STATEMENT_TIMEOUT_MS:
+            connect_args['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if connect_args:
+        opcoes['connect_args'] = connect_args
+    return opcoes
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+
+if DB_POOLER == 'transaction' and DB_STATEMENT_TIMEOUT_MS:
+    @event.listens_for(Engine, 'begin')
+    def _statement_timeout_transacao(conn):
+        """Em modo pooler, parâmetros de sessão não persistem; usa SET LOCAL a cada transação"""
+        if conn.dialect.name == 'postgresql':
+            conn.exec_driver_sql(f'SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}')
+
 db = SQLAlchemy(app)
 
-# ==================== DB INIT (AUTO) ====================
+# ==================== MIGRAÇÕES DO BANCO ====================
+#
+# O schema é atualizado por executar_migracoes(), rodado uma vez antes de subir
+# o servidor (python migracoes.py no Procfile/render.yaml). Importar o app não
+# executa DDL. Para mudar o schema, acrescente uma entrada nova em MIGRACOES
+# (nunca altere uma já publicada).
+
+def _adicionar_coluna(tabela, coluna, definicao):
+    """ALTER TABLE ADD COLUMN se a coluna ainda não existir"""
+    from sqlalchemy import inspect, text
+    if coluna in {c['name'] for c in inspect(db.engine).get_columns(tabela)}:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}'))
+
+def _migracao_acesso_relatorios():
+    _adicionar_coluna('usuario', 'acesso_relatorios', 'BOOLEAN DEFAULT FALSE')
+
+def _migracao_classificacao_formas():
+    _adicionar_coluna('forma_pagamento', 'classificacao', 'VARCHAR(20)')
+
+def _migracao_snapshot_totais():
+    _adicionar_coluna('caixa', 'totais_snapshot', 'TEXT')
+    _adicionar_coluna('caixa', 'totais_snapshot_hash', 'VARCHAR(64)')
+    _adicionar_coluna('caixa', 'totais_snapshot_versao', 'INTEGER')
+
+def _migracao_chave_idempotencia():
+    _adicionar_coluna('venda', 'chave_idempotencia', 'VARCHAR(64)')
+    _adicionar_coluna('delivery', 'chave_idempotencia', 'VARCHAR(64)')
+    criar_indices('ux_venda_chave_idempotencia', 'ux_delivery_chave_idempotencia')
+
+def _migracao_ordem_caixas():
+    """Preenche hora_abertura dos caixas antigos (meia-noite do dia) e indexa a ordem da paginação"""
+    from sqlalchemy import bindparam, text
+    caixa = db.metadata.tables['caixa']
+    with db.engine.begin() as conn:
+        sem_hora = conn.execute(db.select(caixa.c.id, caixa.c.data).where(caixa.c.hora_abertura.is_(None))).all()
+        if sem_hora:
+            conn.execute(
+                caixa.update().where(caixa.c.id == bindparam('caixa_id')).values(hora_abertura=bindparam('hora')),
+                [{'caixa_id': caixa_id, 'hora': datetime.combine(data, datetime.min.time())} for caixa_id, data in sem_hora])
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text('ALTER TABLE caixa ALTER COLUMN hora_abertura SET NOT NULL'))
+    criar_indices('ix_caixa_data_hora_abertura')
+
+# Índices da migração 5; os declarados depois dela entram pela migração que os introduziu
+INDICES_CONSULTAS_PDV = (
+    'ix_caixa_data_turno_status',
+    'ix_venda_caixa_data_hora',
+    'ix_pagamento_venda_venda_id',
+    'ix_delivery_caixa_data_hora',
+    'ix_pagamento_delivery_delivery_id',
+    'ix_despesa_caixa_data_hora',
+    'ix_sangria_caixa_data_hora',
+    'ix_suprimento_caixa_data_hora',
+    'ix_resumo_diario_data',
+    'ix_movimentacao_estoque_produto_data_hora',
+)
+
+def criar_indices(*nomes):
+    """Cria os índices declarados nos modelos que faltam no banco (SQLite e PostgreSQL).
 
-def _ensure_db_ready():
+    db.create_all() só cria índices junto com tabelas novas; em tabelas que já
+    existem os índices são conferidos e criados um a um. Sem nomes, confere todos
+    os declarados nas tabelas existentes. Um erro interrompe (a migração não é
+    registrada como aplicada). Retorna os nomes criados.
+    """
+    from sqlalchemy import inspect
+    inspetor = inspect(db.engine)
+    declarados = {indice.name: indice for tabela in db.metadata.sorted_tables for indice in tabela.indexes}
+    if not nomes:
+        tabelas = set(inspetor.get_table_names())
+        nomes = [nome for nome, indice in declarados.items() if indice.table.name in tabelas]
+    existentes = {}
+    criados = []
+    for nome in nomes:
+        indice = declarados[nome]
+        tabela = indice.table.name
+        if tabela not in existentes:
+            existentes[tabela] = {i['name'] for i in inspetor.get_indexes(tabela)}
+        if nome in existentes[tabela]:
+            continue
+        indice.create(bind=db.engine)
+        criados.append(nome)
+    return criados
+
+def migrar_fks_cascata():
+    """Recria como ON DELETE CASCADE as FKs dos modelos que estão sem cascata no banco.
+
+    Só no PostgreSQL: o SQLite não altera constraints de tabelas existentes, e a
+    exclusão em massa (excluir_caixas) apaga os filhos explicitamente. Retorna
+    os nomes das constraints recriadas.
+    """
+    from sqlalchemy import inspect, text
+    if db.engine.dialect.name != 'postgresql':
+        return []
+    inspetor = inspect(db.engine)
+    recriadas = []
+    for tabela in db.metadata.sorted_tables:
+        esperadas = {
+            (fk.parent.name, fk.column.table.name): fk
+            for fk in tabela.foreign_keys if (fk.ondelete or '').upper() == 'CASCADE'
+        }
+        if not esperadas:
+            continue
+        for existente in inspetor.get_foreign_keys(tabela.name):
+            chave = (existente['constrained_columns'][0], existente['referred_table'])
+            if chave not in esperadas or (existente['options'].get('ondelete') or '').upper() == 'CASCADE':
+                continue
+            nome = existente['name']
+            coluna, referida = chave
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f'ALTER TABLE {tabela.name} DROP CONSTRAINT {nome}, '
+                    f'ADD CONSTRAINT {nome} FOREIGN KEY ({coluna}) REFERENCES {referida} (id) ON DELETE CASCADE'))
+            recriadas.append(nome)
+    return recriadas
+
+# (versão, descrição, função) - em ordem; cada função precisa tolerar bancos
+# antigos em que a mudança já foi feita pelo código anterior ao controle de versão
+MIGRACOES = [
+    (1, 'Tabelas dos modelos', lambda: db.create_all()),
+    (2, 'usuario.acesso_relatorios', _migracao_acesso_relatorios),
+    (3, 'forma_pagamento.classificacao', _migracao_classificacao_formas),
+    (4, 'Snapshot de totais do fechamento em caixa', _migracao_snapshot_totais),
+    (5, 'Índices das consultas do PDV, login e dashboard', lambda: criar_indices(*INDICES_CONSULTAS_PDV)),
+    (6, 'Chaves estrangeiras com ON DELETE CASCADE', migrar_fks_cascata),
+    (7, 'Chave de idempotência em venda e delivery', _migracao_chave_idempotencia),
+    (8, 'caixa.hora_abertura obrigatória e índice da paginação', _migracao_ordem_caixas),
+]
+
+def _sem_statement_timeout(conn):
+    """SET LOCAL: vale só para a transação, a conexão volta ao pool com o limite normal"""
+    conn.exec_driver_sql('SET LOCAL statement_timeout = 0')
+
+def executar_migracoes():
+    """Aplica as migrações pendentes e registra cada uma em schema_version.
+
+    Depois das migrações garante os registros padrão (init_db) e a
+    classificação das formas de pagamento. Retorna as versões aplicadas.
+    """
+    from sqlalchemy import text
     with app.app_context():
-        db.create_all()
-        # Correção automática: Adicionar coluna acesso_relatorios se não existir
-        try:
-            from sqlalchemy import text
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE usuario ADD COLUMN acesso_relatorios BOOLEAN DEFAULT 0'))
-                conn.commit()
-        except Exception:
-            pass
-        # Criar registros padrão (inclui ADMIN MASTER e ADMIN)
+        postgres = db.engine.dialect.name == 'postgresql'
+        if postgres:
+            # DDL em tabela grande (CREATE INDEX, ALTER TABLE) e a espera pela trava podem passar
+            # de DB_STATEMENT_TIMEOUT_MS: toda transação aberta durante as migrações fica sem limite
+            event.listen(db.engine, 'begin', _sem_statement_timeout)
         try:
-            init_db()
-        except Exception:
-            pass
-
-# Executar no startup para evitar erro de tabela inexistente no primeiro request
-try:
-    _ensure_db_ready()
-except Exception:
-    pass
-
-_db_initialized = False
+            SchemaVersion.__table__.create(db.engine, checkfirst=True)
+            with db.engine.connect() as trava:
+                if postgres:
+                    # Dois deploys simultâneos não aplicam a mesma migração duas vezes
+                    trava.execute(text('SELECT pg_advisory_lock(20260218)'))
+                try:
+                    aplicadas = {versao for (versao,) in db.session.query(SchemaVersion.versao)}
+                    db.session.commit()
+                    novas = []
+                    for versao, descricao, migracao in MIGRACOES:
+                        if versao in aplicadas:
+                            continue
+                        print(f"Migração {versao}: {descricao}")
+                        migracao()
+                        db.session.add(SchemaVersion(versao=versao, descricao=descricao))
+                        db.session.commit()
+                        novas.append(versao)
+                    init_db()
+                    _preencher_classificacao_formas()
+                finally:
+                    if postgres:
+                        trava.execute(text('SELECT pg_advisory_unlock(20260218)'))
+        finally:
+            if postgres:
+                event.remove(db.engine, 'begin', _sem_statement_timeout)
+        return novas
+
+# ==================== INSTRUMENTAÇÃO SQL ====================
+
+# Quantas vezes o mesmo SELECT pode se repetir numa requisição antes do aviso de N+1
+SQL_LIMITE_REPETICOES = int(os.environ.get('SQL_LIMITE_REPETICOES', 10))
+SQL_INSTRUMENTACAO = os.environ.get('SQL_INSTRUMENTACAO', '1') != '0'
+
+_sql_por_rota = {}   # endpoint -> {requisicoes, consultas, tempo_db_ms, max_consultas}
+_sql_por_rota_lock = threading.Lock()
+_RE_LISTA_PARAMETROS = re.compile(r'\((?:\s*(?:\?|%\([^)]*\)s|:\w+)\s*,)+\s*(?:\?|%\([^)]*\)s|:\w+)\s*\)')
+_RE_ESPACOS = re.compile(r'\s+')
+
+def _forma_consulta(sql):
+    """Normaliza o SQL para agrupar consultas iguais (espaços e listas de parâmetros do IN)"""
+    return _RE_LISTA_PARAMETROS.sub('(?)', _RE_ESPACOS.sub(' ', sql).strip())
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_antes(conn, cursor, statement, parameters, context, executemany):
+    if SQL_INSTRUMENTACAO and has_request_context():
+        conn.info.setdefault('_sql_inicio', []).append((id(context), time.perf_counter()))
+
+@event.listens_for(Engine, 'handle_error')
+def _sql_erro(contexto):
+    # Comando que falhou não passa por after_cursor_execute; descarta o início que ele empilhou
+    conn = contexto.connection
+    inicios = conn.info.get('_sql_inicio') if conn is not None else None
+    if inicios and inicios[-1][0] == id(contexto.execution_context):
+        inicios.pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_depois(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('_sql_inicio')
+    if not inicios or not has_request_context():
+        return
+    duracao = time.perf_counter() - inicios.pop()[1]
+    medicao = g.get('_sql')
+    if medicao is None:
+        return
+    medicao['consultas'] += 1
+    medicao['tempo'] += duracao
+    if statement.lstrip()[:6].upper() == 'SELECT':
+        forma = _forma_consulta(statement)
+        medicao['formas'][forma] = medicao['formas'].get(forma, 0) + 1
 
 @app.before_request
-def ensure_db_initialized():
-    global _db_initialized
-    if _db_initialized:
-        return
-    try:
-        _ensure_db_ready()
-        _db_initialized = True
-    except Exception:
-        pass
+def iniciar_medicao_sql():
+    if SQL_INSTRUMENTACAO:
+        g._sql = {'consultas': 0, 'tempo': 0.0, 'formas': {}, 'inicio': time.perf_counter()}
+
+@app.after_request
+def registrar_medicao_sql(response):
+    medicao = g.pop('_sql', None)
+    if medicao is None:
+        return response
+    # URLs sem rota (404, varreduras) ficam numa chave só, para o dicionário não crescer sem limite
+    rota = request.endpoint or '<sem rota>'
+    tempo_db_ms = medicao['tempo'] * 1000
+    
+    repetidas = [(vezes, forma) for forma, vezes in medicao['formas'].items() if vezes > SQL_LIMITE_REPETICOES]
+    for vezes, forma in sorted(repetidas, reverse=True):
+        app.logger.warning('Possível N+1 em %s: %d execuções de %s', rota, vezes, forma[:300])
+    
+    with _sql_por_rota_lock:
+        estatistica = _sql_por_rota.setdefault(
+            rota, {'requisicoes': 0, 'consultas': 0, 'tempo_db_ms': 0.0, 'max_consultas': 0, 'alertas_n_mais_1': 0})
+        estatistica['requisicoes'] += 1
+        estatistica['consultas'] += medicao['consultas']
+        estatistica['tempo_db_ms'] += tempo_db_ms
+        estatistica['max_consultas'] = max(estatistica['max_consultas'], medicao['consultas'])
+        estatistica['alertas_n_mais_1'] += len(repetidas)
+    
+    # Server-Timing só para administradores (visível no DevTools do navegador)
+    if 'user_id' in session:
+        usuario = permissoes_usuario()
+        if usuario and usuario.perfil in ['ADMIN', 'MASTER']:
+            total_ms = (time.perf_counter() - medicao['inicio']) * 1000
+            maior_repeticao = max(medicao['formas'].values(), default=0)
+            response.headers['Server-Timing'] = (
+                f'db;dur={tempo_db_ms:.1f};desc="{medicao["consultas"]} consultas", '
+                f'repeticao;desc="SELECT repetido {maior_repeticao}x", '
+                f'app;dur={total_ms:.1f}'
+            )
+    return response
 
 # ==================== CONTEXT PROCESSORS ====================
 
@@ -88,8 +372,7 @@ def ensure_db_initialized():
 def inject_user():
     """Injeta informações do usuário em todos os templates"""
     if 'user_id' in session:
-        usuario = db.session.get(Usuario, session['user_id'])
-        return dict(usuario_logado=usuario)
+        return dict(usuario_logado=permissoes_usuario())
     return dict(usuario_logado=None)
 
 @app.context_processor
@@ -107,10 +390,13 @@ def utility_processor():
         return datetime.utcnow()
     def format_currency(value):
         return formatar_moeda(value)
+    def nova_chave_idempotencia():
+        return uuid.uuid4().hex
     return dict(
         calcular_totais_caixa=calcular_totais_caixa_template, 
         now=now,
-        format_currency=format_currency
+        format_currency=format_currency,
+        nova_chave_idempotencia=nova_chave_idempotencia
     )
 
 
@@ -156,6 +442,12 @@ class Usuario(db.Model):
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Caixa(db.Model):
+    __table_args__ = (
+        # Login busca por (data, turno, status); dashboard e relatórios varrem faixas de data
+        db.Index('ix_caixa_data_turno_status', 'data', 'turno', 'status'),
+        # Paginação por chave de relatórios e admin_caixas (ver paginar_caixas)
+        db.Index('ix_caixa_data_hora_abertura', 'data', 'hora_abertura', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column(db.Date, nullable=False)
     turno = db.Column(db.String(20), nullable=False)
@@ -163,13 +455,38 @@ class Caixa(db.Model):
     saldo_inicial = db.Column(db.Float, default=0)
     saldo_final = db.Column(db.Float, default=0)
     status = db.Column(db.String(20), default='ABERTO')
-    hora_abertura = db.Column(db.DateTime, default=datetime.utcnow)
+    hora_abertura = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     hora_fechamento = db.Column(db.DateTime)
+    # Totais congelados no fechamento (ver _congelar_totais_caixa)
+    totais_snapshot = db.Column(db.Text)
+    totais_snapshot_hash = db.Column(db.String(64))
+    totais_snapshot_versao = db.Column(db.Integer)
     operador = db.relationship('Usuario', backref='caixas')
 
+# Classificação usada nos totais (dinheiro, crédito, ...) - definida no cadastro da forma
+CLASSIFICACOES_FORMA_PAGAMENTO = [
+    ('DINHEIRO', 'Dinheiro'),
+    ('CREDITO', 'Crédito'),
+    ('DEBITO', 'Débito'),
+    ('PIX', 'PIX'),
+    ('ONLINE', 'PG Online'),
+    ('CONTA_ASSINADA', 'Conta Assinada'),
+    ('OUTROS', 'Outros'),
+]
+
+# Classificação -> chave do dicionário de totais do caixa
+CHAVE_TOTAIS_CLASSIFICACAO = {
+    'DINHEIRO': 'dinheiro',
+    'CREDITO': 'credito',
+    'DEBITO': 'debito',
+    'PIX': 'pix',
+    'ONLINE': 'online',
+}
+
 class FormaPagamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(50), nullable=False, unique=True)
+    classificacao = db.Column(db.String(20))  # DINHEIRO, CREDITO, DEBITO, PIX, ONLINE, CONTA_ASSINADA, OUTROS
     ativo = db.Column(db.Boolean, default=True)
 
 class BandeiraCartao(db.Model):
@@ -190,30 +507,39 @@ class Motoboy(db.Model):
     ativo = db.Column(db.Boolean, default=True)
 
 class Venda(db.Model):
+    __table_args__ = (
+        db.Index('ix_venda_caixa_data_hora', 'caixa_id', 'data_hora'),
+        db.Index('ux_venda_chave_idempotencia', 'chave_idempotencia', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id'))
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'))
     tipo = db.Column(db.String(20), nullable=False)  # MESA, BALCAO
     numero = db.Column(db.Integer)
     total = db.Column(db.Float, nullable=False)
     emitiu_nota = db.Column(db.Boolean, default=False)
     observacao = db.Column(db.Text)
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    caixa = db.relationship('Caixa', backref='vendas')
+    chave_idempotencia = db.Column(db.String(64))  # gerada no formulário; repetições do envio não duplicam
+    caixa = db.relationship('Caixa', backref=db.backref('vendas', cascade='all, delete-orphan'))
 
 class PagamentoVenda(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    venda_id = db.Column(db.Integer, db.ForeignKey('venda.id'))
+    venda_id = db.Column(db.Integer, db.ForeignKey('venda.id', ondelete='CASCADE'), index=True)
     forma_pagamento_id = db.Column(db.Integer, db.ForeignKey('forma_pagamento.id'))
     bandeira_id = db.Column(db.Integer, db.ForeignKey('bandeira_cartao.id'))
     valor = db.Column(db.Float, nullable=False)
     observacao = db.Column(db.String(200))
-    venda = db.relationship('Venda', backref='pagamentos')
+    venda = db.relationship('Venda', backref=db.backref('pagamentos', cascade='all, delete-orphan'))
     forma_pagamento = db.relationship('FormaPagamento')
     bandeira = db.relationship('BandeiraCartao')
 
 class Delivery(db.Model):
+    __table_args__ = (
+        db.Index('ix_delivery_caixa_data_hora', 'caixa_id', 'data_hora'),
+        db.Index('ux_delivery_chave_idempotencia', 'chave_idempotencia', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id'))
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'))
     cliente = db.Column(db.String(100), nullable=False)
     total = db.Column(db.Float, nullable=False)
     taxa_entrega = db.Column(db.Float, default=0)
@@ -221,23 +547,25 @@ class Delivery(db.Model):
     emitiu_nota = db.Column(db.Boolean, default=False)
     observacao = db.Column(db.Text)
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    caixa = db.relationship('Caixa', backref='deliveries')
+    chave_idempotencia = db.Column(db.String(64))
+    caixa = db.relationship('Caixa', backref=db.backref('deliveries', cascade='all, delete-orphan'))
     motoboy = db.relationship('Motoboy')
 
 class PagamentoDelivery(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    delivery_id = db.Column(db.Integer, db.ForeignKey('delivery.id'))
+    delivery_id = db.Column(db.Integer, db.ForeignKey('delivery.id', ondelete='CASCADE'), index=True)
     forma_pagamento_id = db.Column(db.Integer, db.ForeignKey('forma_pagamento.id'))
     bandeira_id = db.Column(db.Integer, db.ForeignKey('bandeira_cartao.id'))
     valor = db.Column(db.Float, nullable=False)
     observacao = db.Column(db.String(200))
-    delivery = db.relationship('Delivery', backref='pagamentos')
+    delivery = db.relationship('Delivery', backref=db.backref('pagamentos', cascade='all, delete-orphan'))
     forma_pagamento = db.relationship('FormaPagamento')
     bandeira = db.relationship('BandeiraCartao')
 
 class Despesa(db.Model):
+    __table_args__ = (db.Index('ix_despesa_caixa_data_hora', 'caixa_id', 'data_hora'),)
     id = db.Column(db.Integer, primary_key=True)
-    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id'))
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'))
     tipo = db.Column(db.String(20), nullable=False)  # FIXA, VARIAVEL, SAIDA
     categoria_id = db.Column(db.Integer, db.ForeignKey('categoria_despesa.id'))
     descricao = db.Column(db.String(200), nullable=False)
@@ -247,30 +575,115 @@ class Despesa(db.Model):
     status = db.Column(db.String(20), default='PAGO')
     observacao = db.Column(db.Text)
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    caixa = db.relationship('Caixa', backref='despesas')
+    caixa = db.relationship('Caixa', backref=db.backref('despesas', cascade='all, delete-orphan'))
     categoria = db.relationship('CategoriaDespesa')
     forma_pagamento = db.relationship('FormaPagamento')
 
 class Sangria(db.Model):
+    __table_args__ = (db.Index('ix_sangria_caixa_data_hora', 'caixa_id', 'data_hora'),)
     id = db.Column(db.Integer, primary_key=True)
-    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id'))
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'))
     valor = db.Column(db.Float, nullable=False)
     motivo = db.Column(db.String(100), nullable=False)
     observacao = db.Column(db.String(200))
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    caixa = db.relationship('Caixa', backref='sangrias')
+    caixa = db.relationship('Caixa', backref=db.backref('sangrias', cascade='all, delete-orphan'))
 
 # ==================== MODELO SUPRIMENTO (v3.0) ====================
 class Suprimento(db.Model):
     """Suprimentos - Entradas de dinheiro no caixa"""
     __tablename__ = 'suprimento'
+    __table_args__ = (db.Index('ix_suprimento_caixa_data_hora', 'caixa_id', 'data_hora'),)
     id = db.Column(db.Integer, primary_key=True)
-    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id'))
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'))
     valor = db.Column(db.Float, nullable=False)
     motivo = db.Column(db.String(100), nullable=False)
     observacao = db.Column(db.String(200))
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
-    caixa = db.relationship('Caixa', backref='suprimentos')
+    caixa = db.relationship('Caixa', backref=db.backref('suprimentos', cascade='all, delete-orphan'))
+
+# ==================== TOTAIS ACUMULADOS DO CAIXA ====================
+
+CAMPOS_TOTAIS_CAIXA = (
+    'vendas_loja', 'vendas_delivery', 'dinheiro', 'credito', 'debito',
+    'pix', 'online', 'notas_fiscais', 'despesas', 'sangrias'
+)
+
+class CaixaTotais(db.Model):
+    """Totais correntes do caixa, atualizados na mesma transação de cada movimento"""
+    __tablename__ = 'caixa_totais'
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'), primary_key=True)
+    vendas_loja = db.Column(db.Float, nullable=False, default=0)
+    vendas_delivery = db.Column(db.Float, nullable=False, default=0)
+    dinheiro = db.Column(db.Float, nullable=False, default=0)
+    credito = db.Column(db.Float, nullable=False, default=0)
+    debito = db.Column(db.Float, nullable=False, default=0)
+    pix = db.Column(db.Float, nullable=False, default=0)
+    online = db.Column(db.Float, nullable=False, default=0)
+    notas_fiscais = db.Column(db.Float, nullable=False, default=0)
+    despesas = db.Column(db.Float, nullable=False, default=0)
+    sangrias = db.Column(db.Float, nullable=False, default=0)
+
+# ==================== RESUMO DIÁRIO (CAIXAS FECHADOS) ====================
+
+class ResumoDiario(db.Model):
+    """Resumo consolidado de um caixa fechado (um turno de um dia).
+
+    Gravado no fechamento e regravado quando o admin edita o caixa fechado;
+    dashboard e relatórios leem daqui em vez de agregar os movimentos.
+    Os dicionários JSON usam os ids (forma, categoria, motoboy) como chave.
+    """
+    __tablename__ = 'resumo_diario'
+    id = db.Column(db.Integer, primary_key=True)
+    caixa_id = db.Column(db.Integer, db.ForeignKey('caixa.id', ondelete='CASCADE'), nullable=False, unique=True)
+    data = db.Column(db.Date, nullable=False, index=True)
+    turno = db.Column(db.String(20), nullable=False)
+    # Receitas
+    vendas_loja = db.Column(db.Float, nullable=False, default=0)
+    vendas_delivery = db.Column(db.Float, nullable=False, default=0)
+    vendas_count = db.Column(db.Integer, nullable=False, default=0)
+    delivery_count = db.Column(db.Integer, nullable=False, default=0)
+    notas_fiscais = db.Column(db.Float, nullable=False, default=0)
+    taxas_entrega = db.Column(db.Float, nullable=False, default=0)
+    # Pagamentos por classificação
+    dinheiro = db.Column(db.Float, nullable=False, default=0)
+    credito = db.Column(db.Float, nullable=False, default=0)
+    debito = db.Column(db.Float, nullable=False, default=0)
+    pix = db.Column(db.Float, nullable=False, default=0)
+    online = db.Column(db.Float, nullable=False, default=0)
+    contas_assinadas = db.Column(db.Float, nullable=False, default=0)
+    # Saídas
+    despesas = db.Column(db.Float, nullable=False, default=0)
+    despesas_fixas = db.Column(db.Float, nullable=False, default=0)
+    despesas_variaveis = db.Column(db.Float, nullable=False, default=0)
+    despesas_saidas = db.Column(db.Float, nullable=False, default=0)
+    sangrias = db.Column(db.Float, nullable=False, default=0)
+    # Detalhamentos
+    vendas_tipo = db.Column(db.JSON)          # tipo -> [total, quantidade]
+    formas_pagamento = db.Column(db.JSON)     # forma_pagamento_id -> valor
+    despesas_tipo = db.Column(db.JSON)        # tipo -> valor
+    despesas_categoria = db.Column(db.JSON)   # categoria_id -> valor
+    motoboys = db.Column(db.JSON)             # motoboy_id -> [taxas, quantidade]
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaVersion(db.Model):
+    """Migrações já aplicadas no banco (ver MIGRACOES / executar_migracoes)"""
+    __tablename__ = 'schema_version'
+    versao = db.Column(db.Integer, primary_key=True)
+    descricao = db.Column(db.String(200))
+    aplicada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VersaoCache(db.Model):
+    """Versões compartilhadas entre workers dos caches em memória (ex.: 'cadastros')"""
+    __tablename__ = 'versao_cache'
+    nome = db.Column(db.String(50), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+class GeracaoData(db.Model):
+    """Contador de alterações por data de caixa (invalida o cache do dashboard entre workers)"""
+    __tablename__ = 'geracao_data'
+    data = db.Column(db.Date, primary_key=True)
+    geracao = db.Column(db.Integer, nullable=False, default=0)
 
 class Produto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -287,6 +700,7 @@ class Produto(db.Model):
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
 class MovimentacaoEstoque(db.Model):
+    __table_args__ = (db.Index('ix_movimentacao_estoque_produto_data_hora', 'produto_id', 'data_hora'),)
     id = db.Column(db.Integer, primary_key=True)
     produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'))
     tipo = db.Column(db.String(20), nullable=False)  # ENTRADA, SAIDA, AJUSTE
@@ -334,6 +748,50 @@ class Backup(db.Model):
     observacao = db.Column(db.Text)
     usuario = db.relationship('Usuario')
 
+# ==================== USUÁRIO DA REQUISIÇÃO ====================
+
+# Permissões copiadas para a sessão (cookie assinado) e revalidadas no banco depois deste prazo
+PERMISSOES_TTL_SEGUNDOS = int(os.environ.get('PERMISSOES_TTL_SEGUNDOS', 300))
+
+UsuarioSessao = namedtuple(
+    'UsuarioSessao', 'id nome perfil acesso_dashboard acesso_configuracoes acesso_relatorios ativo')
+
+def _gravar_permissoes_sessao(usuario):
+    """Copia nome, perfil e acessos do usuário para a sessão"""
+    dados = {campo: getattr(usuario, campo) for campo in UsuarioSessao._fields}
+    dados['validado_em'] = time.time()
+    session['permissoes'] = dados
+
+def usuario_atual():
+    """Usuário logado carregado do banco, no máximo uma vez por requisição"""
+    if 'user_id' not in session:
+        return None
+    if '_usuario_atual' not in g:
+        usuario = db.session.get(Usuario, session['user_id'])
+        if usuario:
+            _gravar_permissoes_sessao(usuario)
+        g._usuario_atual = usuario
+    return g._usuario_atual
+
+def permissoes_usuario():
+    """Perfil e acessos do usuário logado, lidos da sessão enquanto estiverem válidos.
+
+    A cópia na sessão é revalidada no banco depois de PERMISSOES_TTL_SEGUNDOS;
+    rotas de administração sempre usam usuario_atual(), então uma permissão
+    retirada vale para elas na hora e para as demais telas após o prazo.
+    """
+    if 'user_id' not in session:
+        return None
+    dados = session.get('permissoes')
+    valido = (dados and dados.get('id') == session['user_id']
+              and time.time() - dados.get('validado_em', 0) < PERMISSOES_TTL_SEGUNDOS)
+    if not valido or '_usuario_atual' in g:
+        usuario = usuario_atual()
+        if not usuario:
+            return None
+        dados = session['permissoes']
+    return UsuarioSessao(**{campo: dados[campo] for campo in UsuarioSessao._fields})
+
 # ==================== DECORATORS ====================
 
 def login_required(f):
@@ -350,7 +808,7 @@ def dashboard_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        usuario = db.session.get(Usuario, session['user_id'])
+        usuario = permissoes_usuario()
         if not usuario or (usuario.perfil != 'MASTER' and not usuario.acesso_dashboard):
             flash('Acesso negado. Você não tem permissão para acessar o dashboard.', 'danger')
             return redirect(url_for('vendas'))
@@ -363,7 +821,6 @@ def estoque_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        usuario = db.session.get(Usuario, session['user_id'])
         return f(*args, **kwargs)
     return decorated_function
 
@@ -372,7 +829,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        usuario = db.session.get(Usuario, session['user_id'])
+        usuario = usuario_atual()
         if not usuario or usuario.perfil not in ['ADMIN', 'MASTER']:
             flash('Acesso negado. Voce nao tem permissao para acessar esta area.', 'danger')
             return redirect(url_for('index'))
@@ -385,7 +842,7 @@ def admin_master_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        usuario = db.session.get(Usuario, session['user_id'])
+        usuario = usuario_atual()
         if not usuario or usuario.perfil != 'MASTER':
             flash('Acesso negado. Apenas o ADMIN MASTER pode acessar esta area.', 'danger')
             return redirect(url_for('vendas'))
@@ -429,6 +886,7 @@ def login():
                 # Restaurar sessão com TODAS as informações
                 session['user_id'] = usuario.id
                 session['user_nome'] = usuario.nome
+                _gravar_permissoes_sessao(usuario)
                 session['caixa_id'] = caixa.id
                 session['turno'] = caixa.turno
                 session['data'] = caixa.data.strftime('%Y-%m-%d')
@@ -461,6 +919,8 @@ def login():
                     elif caixa_fechado:
                         caixa_fechado.status = 'ABERTO'
                         caixa_fechado.hora_fechamento = None
+                        _descongelar_totais_caixa(caixa_fechado)
+                        _remover_resumo_caixa(caixa_fechado.id)
                         db.session.commit()
                         caixa_para_usar = caixa_fechado
                         flash(f'Caixa FECHADO reaberto pelo Admin', 'warning')
@@ -470,11 +930,15 @@ def login():
                             saldo_inicial=saldo_inicial, status='ABERTO'
                         )
                         db.session.add(caixa_para_usar)
+                        db.session.flush()
+                        db.session.add(CaixaTotais(caixa_id=caixa_para_usar.id))
+                        _incrementar_geracao_data(caixa_para_usar.data)
                         db.session.commit()
                         flash('✅ Novo caixa aberto com sucesso!', 'success')
                     
                     session['user_id'] = usuario.id
                     session['user_nome'] = usuario.nome
+                    _gravar_permissoes_sessao(usuario)
                     session['caixa_id'] = caixa_para_usar.id
                     session['turno'] = turno
                     session['data'] = data
@@ -486,6 +950,7 @@ def login():
                         # Operador pode ENTRAR no caixa aberto
                         session['user_id'] = usuario.id
                         session['user_nome'] = usuario.nome
+                        _gravar_permissoes_sessao(usuario)
                         session['caixa_id'] = caixa_aberto.id
                         session['turno'] = caixa_aberto.turno
                         session['data'] = caixa_aberto.data.strftime('%Y-%m-%d')
@@ -499,6 +964,7 @@ def login():
                         # Permitir operador acessar caixa fechado para visualização
                         session['user_id'] = usuario.id
                         session['user_nome'] = usuario.nome
+                        _gravar_permissoes_sessao(usuario)
                         session['caixa_id'] = caixa_fechado.id
                         session['turno'] = caixa_fechado.turno
                         session['data'] = caixa_fechado.data.strftime('%Y-%m-%d')
@@ -513,10 +979,14 @@ def login():
                         saldo_inicial=saldo_inicial, status='ABERTO'
                     )
                     db.session.add(novo_caixa)
+                    db.session.flush()
+                    db.session.add(CaixaTotais(caixa_id=novo_caixa.id))
+                    _incrementar_geracao_data(novo_caixa.data)
                     db.session.commit()
                     
                     session['user_id'] = usuario.id
                     session['user_nome'] = usuario.nome
+                    _gravar_permissoes_sessao(usuario)
                     session['caixa_id'] = novo_caixa.id
                     session['turno'] = turno
                     session['data'] = data
@@ -527,12 +997,7 @@ def login():
         else:
             flash('❌ Credenciais inválidas!', 'danger')
     
-    try:
-        usuarios = Usuario.query.filter_by(ativo=True).order_by(Usuario.nome).all()
-    except ProgrammingError:
-        db.session.rollback()
-        _ensure_db_ready()
-        usuarios = Usuario.query.filter_by(ativo=True).order_by(Usuario.nome).all()
+    usuarios = Usuario.query.filter_by(ativo=True).order_by(Usuario.nome).all()
     hoje = datetime.now().date()
     caixas_abertos_hoje = Caixa.query.filter_by(data=hoje, status='ABERTO').order_by(Caixa.turno).all()
     
@@ -555,6 +1020,75 @@ def _device_fingerprint():
     raw = f"{ip}|{ua}"
     return hashlib.md5(raw.encode('utf-8')).hexdigest(), ip, ua
 
+# ==================== ÚLTIMO ACESSO DOS DISPOSITIVOS ====================
+#
+# O heartbeat da tela de licenciamento só anota o acesso em memória; uma thread
+# de cada worker grava os acessos acumulados num único UPDATE a cada
+# DISPOSITIVOS_GRAVACAO_SEGUNDOS (e ao encerrar o worker), sem pesar em nenhuma
+# requisição. O buffer é por worker: o último acesso lido é o do buffer do
+# próprio worker ou o gravado no banco, então um heartbeat atendido por outro
+# worker só aparece depois da próxima gravação dele (até um intervalo de atraso).
+
+DISPOSITIVOS_GRAVACAO_SEGUNDOS = int(os.environ.get('DISPOSITIVOS_GRAVACAO_SEGUNDOS', 60))
+
+_acessos_pendentes = {}   # Dispositivo.id -> último acesso ainda não gravado
+_acessos_lock = threading.Lock()
+_acessos_thread = None
+
+def registrar_acesso_dispositivo(dispositivo_id):
+    """Anota o acesso do dispositivo no buffer (sem escrever no banco)"""
+    global _acessos_thread
+    with _acessos_lock:
+        _acessos_pendentes[dispositivo_id] = datetime.utcnow()
+        # Sobe no primeiro acesso, já dentro do worker (threads não sobrevivem ao fork do gunicorn)
+        if _acessos_thread is None or not _acessos_thread.is_alive():
+            _acessos_thread = threading.Thread(target=_gravar_acessos_periodicamente,
+                                               name='gravar-acessos-dispositivos', daemon=True)
+            _acessos_thread.start()
+
+def ultimo_acesso_dispositivo(dispositivo):
+    """Último acesso do dispositivo: o buffer deste worker, senão o valor gravado"""
+    with _acessos_lock:
+        pendente = _acessos_pendentes.get(dispositivo.id)
+    return pendente or dispositivo.ultimo_acesso
+
+def gravar_acessos_dispositivos():
+    """Grava os acessos do buffer em um UPDATE.
+
+    Usa uma conexão própria, fora da sessão de qualquer requisição. Os acessos
+    saem do buffer só depois de gravados. Retorna quantos dispositivos foram atualizados.
+    """
+    with _acessos_lock:
+        if not _acessos_pendentes:
+            return 0
+        pendentes = dict(_acessos_pendentes)
+    
+    tabela = Dispositivo.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(tabela).where(tabela.c.id.in_(pendentes))
+                         .values(ultimo_acesso=case(pendentes, value=tabela.c.id)))
+    except Exception as e:
+        app.logger.warning('Não foi possível gravar o último acesso dos dispositivos: %s', e)
+        return 0
+    with _acessos_lock:
+        for dispositivo_id, quando in pendentes.items():
+            # Um acesso mais novo que chegou durante a gravação fica para a próxima
+            if _acessos_pendentes.get(dispositivo_id) == quando:
+                del _acessos_pendentes[dispositivo_id]
+    return len(pendentes)
+
+def _gravar_acessos_periodicamente():
+    while True:
+        time.sleep(DISPOSITIVOS_GRAVACAO_SEGUNDOS)
+        with app.app_context():
+            gravar_acessos_dispositivos()
+
+@atexit.register
+def _gravar_acessos_ao_encerrar():
+    with app.app_context():
+        gravar_acessos_dispositivos()
+
 @app.route('/ativacao', methods=['GET', 'POST'])
 def ativacao():
     if request.method == 'POST':
@@ -603,15 +1137,17 @@ def licenciamento():
                 status='ATIVO'
             )
             db.session.add(dispositivo)
-        dispositivo.ultimo_acesso = datetime.utcnow()
-        db.session.commit()
+            db.session.commit()
+        else:
+            registrar_acesso_dispositivo(dispositivo.id)
 
     return render_template(
         'licenciamento.html',
         licenca=licenca,
         dispositivos=dispositivos,
         backups=backups,
-        dispositivo_id=dispositivo_id
+        dispositivo_id=dispositivo_id,
+        ultimo_acesso=ultimo_acesso_dispositivo
     )
 
 @app.route('/licenca/registrar-dispositivo', methods=['POST'])
@@ -637,9 +1173,9 @@ def registrar_dispositivo():
             status='ATIVO'
         )
         db.session.add(dispositivo)
-
-    dispositivo.ultimo_acesso = datetime.utcnow()
-    db.session.commit()
+        db.session.commit()
+    else:
+        registrar_acesso_dispositivo(dispositivo.id)
     return jsonify({'status': 'ok'})
 
 @app.route('/licenca/gerar-nova-chave', methods=['POST'])
@@ -757,6 +1293,61 @@ def excluir_backup(backup_id):
         flash('Backup excluído.', 'success')
     return redirect(url_for('licenciamento'))
 
+# ==================== IDEMPOTÊNCIA ====================
+#
+# Os formulários de venda e delivery (e os itens de /api/vendas/lote) levam uma
+# chave gerada no cliente. O índice único em chave_idempotencia impede a linha
+# duplicada; o cache em memória responde às repetições recentes sem consultar
+# as tabelas. Cada worker tem o seu cache, o índice vale para todos.
+
+IDEMPOTENCIA_TTL_SEGUNDOS = int(os.environ.get('IDEMPOTENCIA_TTL_SEGUNDOS', 900))
+IDEMPOTENCIA_MAX_ITENS = int(os.environ.get('IDEMPOTENCIA_MAX_ITENS', 5000))
+
+_idempotencia_cache = OrderedDict()   # (tabela, chave) -> (expira_em, id do registro)
+_idempotencia_lock = threading.Lock()
+
+def ler_chave_idempotencia(valor):
+    """Chave enviada pelo cliente, ou None se ausente/inválida (o envio segue sem deduplicação)"""
+    if not isinstance(valor, str):
+        return None
+    valor = valor.strip()
+    if not valor or len(valor) > 64:
+        return None
+    return valor
+
+def lembrar_idempotencia(modelo, chave, registro_id):
+    """Guarda no cache o registro gravado com a chave; chamar só depois do commit"""
+    agora = time.time()
+    with _idempotencia_lock:
+        _idempotencia_cache[(modelo.__tablename__, chave)] = (agora + IDEMPOTENCIA_TTL_SEGUNDOS, registro_id)
+        _idempotencia_cache.move_to_end((modelo.__tablename__, chave))
+        # TTL fixo: as entradas mais antigas do OrderedDict são as primeiras a vencer
+        while _idempotencia_cache and (len(_idempotencia_cache) > IDEMPOTENCIA_MAX_ITENS
+                                       or next(iter(_idempotencia_cache.values()))[0] <= agora):
+            _idempotencia_cache.popitem(last=False)
+
+def esquecer_idempotencia(modelo, chave):
+    """Tira a chave do cache (registro excluído: um reenvio com ela deve gravar de novo)"""
+    if not chave:
+        return
+    with _idempotencia_lock:
+        _idempotencia_cache.pop((modelo.__tablename__, chave), None)
+
+def registro_idempotente(modelo, chave):
+    """Registro já gravado com a chave (cache, depois o índice único), ou None"""
+    with _idempotencia_lock:
+        entrada = _idempotencia_cache.get((modelo.__tablename__, chave))
+    if entrada and entrada[0] > time.time():
+        registro = db.session.get(modelo, entrada[1])
+        if registro is not None:
+            return registro
+        # Excluído depois de gravado (por outro worker ou pela limpeza de caixas)
+        esquecer_idempotencia(modelo, chave)
+    registro = modelo.query.filter_by(chave_idempotencia=chave).first()
+    if registro is not None:
+        lembrar_idempotencia(modelo, chave, registro.id)
+    return registro
+
 # ==================== ROUTES - VENDAS ====================
 
 @app.route('/vendas')
@@ -768,15 +1359,16 @@ def vendas():
         flash('Caixa não encontrado. Por favor, faça login novamente.', 'warning')
         return redirect(url_for('login'))
 
-    vendas = Venda.query.filter_by(caixa_id=session['caixa_id']).order_by(Venda.data_hora.desc()).all()
-    formas_pagamento = FormaPagamento.query.filter_by(ativo=True).all()
-    bandeiras = BandeiraCartao.query.filter_by(ativo=True).all()
+    pagina = pagina_movimentos('vendas', caixa.id)
+    formas_pagamento = cadastros()['formas_ativas']
+    bandeiras = cadastros()['bandeiras_ativas']
     
     # Calcular totais
     totais = calcular_totais_caixa(caixa)
     
     return render_template('vendas.html', 
-                         vendas=vendas, 
+                         vendas=pagina.items, 
+                         proxima=pagina.proxima,
                          formas_pagamento=formas_pagamento,
                          bandeiras=bandeiras,
                          totais=totais,
@@ -785,6 +1377,11 @@ def vendas():
 @app.route('/vendas/nova', methods=['POST'])
 @login_required
 def nova_venda():
+    chave = ler_chave_idempotencia(request.form.get('chave_idempotencia'))
+    registro = registro_idempotente(Venda, chave) if chave else None
+    if registro:
+        # Duplo clique ou reenvio do navegador: a venda já foi gravada
+        return resposta_movimento('vendas', registro, 'Venda registrada com sucesso!')
     try:
         tipo = request.form.get('tipo')
         numero = int(request.form.get('numero', 1))
@@ -799,7 +1396,8 @@ def nova_venda():
             numero=numero,
             total=total,
             emitiu_nota=emitiu_nota,
-            observacao=observacao
+            observacao=observacao,
+            chave_idempotencia=chave
         )
         db.session.add(venda)
         db.session.flush()
@@ -811,6 +1409,7 @@ def nova_venda():
         obs_pagamentos = request.form.getlist('obs_pagamento[]')
         
         total_pago = 0
+        pagamentos = []
         for i, forma_id in enumerate(formas):
             if forma_id and valores[i]:
                 valor = parse_moeda(valores[i])
@@ -823,21 +1422,35 @@ def nova_venda():
                         observacao=obs_pagamentos[i] if i < len(obs_pagamentos) else ''
                     )
                     db.session.add(pagamento)
+                    pagamentos.append(pagamento)
                     total_pago += valor
         
         if abs(total_pago - total) > 0.01:
             db.session.rollback()
-            flash('O total dos pagamentos não corresponde ao valor da venda!', 'danger')
-            return redirect(url_for('vendas'))
+            return erro_movimento('vendas', 'O total dos pagamentos não corresponde ao valor da venda!')
         
+        _aplicar_delta_totais(
+            venda.caixa_id,
+            vendas_loja=total,
+            notas_fiscais=total if emitiu_nota else 0,
+            **_deltas_pagamentos(pagamentos)
+        )
+        _marcar_caixa_alterado(venda.caixa_id)
         db.session.commit()
-        flash('Venda registrada com sucesso!', 'success')
+        if chave:
+            lembrar_idempotencia(Venda, chave, venda.id)
+        return resposta_movimento('vendas', venda, 'Venda registrada com sucesso!')
         
+    except IntegrityError:
+        # Envio simultâneo com a mesma chave (outro worker gravou primeiro)
+        db.session.rollback()
+        registro = registro_idempotente(Venda, chave) if chave else None
+        if registro:
+            return resposta_movimento('vendas', registro, 'Venda registrada com sucesso!')
+        return erro_movimento('vendas', 'Erro ao registrar venda: dados inválidos')
     except Exception as e:
         db.session.rollback()
-        flash(f'Erro ao registrar venda: {str(e)}', 'danger')
-    
-    return redirect(url_for('vendas'))
+        return erro_movimento('vendas', f'Erro ao registrar venda: {str(e)}')
 
 # ==================== ROUTES - DELIVERY ====================
 
@@ -850,16 +1463,17 @@ def delivery():
         flash('Caixa não encontrado. Por favor, faça login novamente.', 'warning')
         return redirect(url_for('login'))
 
-    deliveries = Delivery.query.filter_by(caixa_id=session['caixa_id']).order_by(Delivery.data_hora.desc()).all()
-    formas_pagamento = FormaPagamento.query.filter_by(ativo=True).all()
-    motoboys = Motoboy.query.filter_by(ativo=True).all()
+    pagina = pagina_movimentos('delivery', caixa.id)
+    formas_pagamento = cadastros()['formas_ativas']
+    motoboys = cadastros()['motoboys_ativos']
     
     totais = calcular_totais_caixa(caixa)
     totais_delivery = calcular_totais_delivery(caixa)
     
-    bandeiras = BandeiraCartao.query.filter_by(ativo=True).all()
+    bandeiras = cadastros()['bandeiras_ativas']
     return render_template('delivery.html', bandeiras=bandeiras,
-                         deliveries=deliveries,
+                         deliveries=pagina.items,
+                         proxima=pagina.proxima,
                          formas_pagamento=formas_pagamento,
                          motoboys=motoboys,
                          totais=totais,
@@ -869,6 +1483,10 @@ def delivery():
 @app.route('/delivery/novo', methods=['POST'])
 @login_required
 def novo_delivery():
+    chave = ler_chave_idempotencia(request.form.get('chave_idempotencia'))
+    registro = registro_idempotente(Delivery, chave) if chave else None
+    if registro:
+        return resposta_movimento('delivery', registro, 'Delivery registrado com sucesso!')
     try:
         cliente = request.form.get('cliente')
         total = parse_moeda(request.form.get('total'))
@@ -884,7 +1502,8 @@ def novo_delivery():
             taxa_entrega=taxa_entrega,
             motoboy_id=int(motoboy_id) if motoboy_id else None,
             emitiu_nota=emitiu_nota,
-            observacao=observacao
+            observacao=observacao,
+            chave_idempotencia=chave
         )
         db.session.add(delivery)
         db.session.flush()
@@ -896,6 +1515,7 @@ def novo_delivery():
         
         total_com_taxa = total + taxa_entrega
         total_pago = 0
+        pagamentos = []
         
         for i, forma_id in enumerate(formas):
             if forma_id and valores[i]:
@@ -908,21 +1528,234 @@ def novo_delivery():
                         observacao=obs_pagamentos[i] if i < len(obs_pagamentos) else ''
                     )
                     db.session.add(pagamento)
+                    pagamentos.append(pagamento)
                     total_pago += valor
         
         if abs(total_pago - total_com_taxa) > 0.01:
             db.session.rollback()
-            flash('O total dos pagamentos não corresponde ao valor total (pedido + taxa)!', 'danger')
-            return redirect(url_for('delivery'))
+            return erro_movimento('delivery', 'O total dos pagamentos não corresponde ao valor total (pedido + taxa)!')
         
+        _aplicar_delta_totais(
+            delivery.caixa_id,
+            vendas_delivery=total_com_taxa,
+            notas_fiscais=total_com_taxa if emitiu_nota else 0,
+            **_deltas_pagamentos(pagamentos)
+        )
+        _marcar_caixa_alterado(delivery.caixa_id)
         db.session.commit()
-        flash('Delivery registrado com sucesso!', 'success')
+        if chave:
+            lembrar_idempotencia(Delivery, chave, delivery.id)
+        return resposta_movimento('delivery', delivery, 'Delivery registrado com sucesso!')
         
+    except IntegrityError:
+        db.session.rollback()
+        registro = registro_idempotente(Delivery, chave) if chave else None
+        if registro:
+            return resposta_movimento('delivery', registro, 'Delivery registrado com sucesso!')
+        return erro_movimento('delivery', 'Erro ao registrar delivery: dados inválidos')
     except Exception as e:
         db.session.rollback()
-        flash(f'Erro ao registrar delivery: {str(e)}', 'danger')
+        return erro_movimento('delivery', f'Erro ao registrar delivery: {str(e)}')
+
+# ==================== ROUTES - VENDAS EM LOTE ====================
+
+# Máximo de itens (vendas + deliveries) aceitos em um envio de /api/vendas/lote
+VENDAS_LOTE_MAX_ITENS = int(os.environ.get('VENDAS_LOTE_MAX_ITENS', 200))
+
+PagamentoLote = namedtuple('PagamentoLote', 'forma_pagamento_id bandeira_id valor observacao')
+
+def _id_lote(valor):
+    """Id vindo do JSON (número ou texto numérico); None se vazio"""
+    if valor in (None, ''):
+        return None
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f'Id inválido: {valor}')
+
+def _validar_pagamentos_lote(item, total_esperado, referencia):
+    """Lê e confere os pagamentos de um item do lote; ValueError com a mensagem do erro"""
+    lista = item.get('pagamentos') or []
+    if not isinstance(lista, list):
+        raise ValueError('Pagamentos inválidos')
+    pagamentos = []
+    for pagamento in lista:
+        if not isinstance(pagamento, dict):
+            raise ValueError('Pagamento inválido')
+        valor = parse_moeda(pagamento.get('valor'))
+        if valor <= 0:
+            continue
+        forma_id = _id_lote(pagamento.get('forma_pagamento_id'))
+        if forma_id not in referencia['nomes_formas']:
+            raise ValueError(f"Forma de pagamento inválida: {pagamento.get('forma_pagamento_id')}")
+        bandeira_id = _id_lote(pagamento.get('bandeira_id'))
+        if bandeira_id is not None and bandeira_id not in referencia['nomes_bandeiras']:
+            raise ValueError(f"Bandeira inválida: {pagamento.get('bandeira_id')}")
+        pagamentos.append(PagamentoLote(forma_id, bandeira_id, valor, pagamento.get('observacao') or ''))
+    # Mesma regra dos formulários: a soma dos pagamentos fecha com o total
+    if abs(sum(p.valor for p in pagamentos) - total_esperado) > 0.01:
+        raise ValueError('O total dos pagamentos não corresponde ao valor total')
+    return pagamentos
+
+def _validar_venda_lote(item, referencia):
+    """(linha da venda, pagamentos, deltas de totais) de um item do lote"""
+    tipo = item.get('tipo')
+    if tipo not in ('MESA', 'BALCAO'):
+        raise ValueError('Tipo de venda inválido')
+    total = parse_moeda(item.get('total'))
+    pagamentos = _validar_pagamentos_lote(item, total, referencia)
+    emitiu_nota = bool(item.get('emitiu_nota'))
+    linha = {
+        'tipo': tipo,
+        'numero': int(item.get('numero') or 1),
+        'total': total,
+        'emitiu_nota': emitiu_nota,
+        'observacao': item.get('observacao') or '',
+    }
+    deltas = dict(vendas_loja=total, notas_fiscais=total if emitiu_nota else 0)
+    return linha, pagamentos, deltas
+
+def _validar_delivery_lote(item, referencia):
+    """(linha do delivery, pagamentos, deltas de totais) de um item do lote"""
+    cliente = str(item.get('cliente') or '').strip()
+    if not cliente:
+        raise ValueError('Informe o cliente')
+    motoboy_id = _id_lote(item.get('motoboy_id'))
+    if motoboy_id is not None and motoboy_id not in referencia['nomes_motoboys']:
+        raise ValueError(f"Motoboy inválido: {item.get('motoboy_id')}")
+    total = parse_moeda(item.get('total'))
+    taxa_entrega = parse_moeda(item.get('taxa_entrega'))
+    pagamentos = _validar_pagamentos_lote(item, total + taxa_entrega, referencia)
+    emitiu_nota = bool(item.get('emitiu_nota'))
+    linha = {
+        'cliente': cliente,
+        'total': total,
+        'taxa_entrega': taxa_entrega,
+        'motoboy_id': motoboy_id,
+        'emitiu_nota': emitiu_nota,
+        'observacao': item.get('observacao') or '',
+    }
+    deltas = dict(vendas_delivery=total + taxa_entrega,
+                  notas_fiscais=total + taxa_entrega if emitiu_nota else 0)
+    return linha, pagamentos, deltas
+
+def registrar_lote_movimentos(caixa_id, vendas, deliveries):
+    """Valida e grava um lote de vendas e deliveries do caixa em uma transação.
+
+    Itens inválidos são recusados individualmente; os válidos entram com um
+    INSERT em lote por tabela (ids via RETURNING) e uma única atualização de
+    caixa_totais. Itens com chave_idempotencia já gravada voltam com o id
+    original e repetido=True. Não faz commit. Retorna a lista de resultados por item.
+    """
+    from sqlalchemy import insert
+    referencia = cadastros()
+    resultados = []
+    deltas_caixa = {}
+    grupos = (
+        ('venda', vendas, _validar_venda_lote, Venda, PagamentoVenda, 'venda_id'),
+        ('delivery', deliveries, _validar_delivery_lote, Delivery, PagamentoDelivery, 'delivery_id'),
+    )
+    for tipo, itens, validar, modelo, modelo_pagamento, coluna_pai in grupos:
+        aceitos = []
+        chaves_lote = set()
+        for indice, item in enumerate(itens):
+            resultado = {'tipo': tipo, 'indice': indice, 'ref': item.get('ref') if isinstance(item, dict) else None}
+            resultados.append(resultado)
+            chave = ler_chave_idempotencia(item.get('chave_idempotencia')) if isinstance(item, dict) else None
+            if chave:
+                resultado['chave_idempotencia'] = chave
+                registro = registro_idempotente(modelo, chave)
+                if registro:
+                    resultado.update(ok=True, id=registro.id, repetido=True)
+                    continue
+                if chave in chaves_lote:
+                    resultado.update(ok=False, erro='Chave de idempotência repetida no lote')
+                    continue
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Item inválido')
+                linha, pagamentos, deltas = validar(item, referencia)
+            except (ValueError, TypeError) as e:
+                resultado.update(ok=False, erro=str(e))
+                continue
+            if chave:
+                chaves_lote.add(chave)
+            linha['caixa_id'] = caixa_id
+            linha['chave_idempotencia'] = chave
+            aceitos.append((resultado, linha, pagamentos))
+            for campo, valor in list(deltas.items()) + list(_deltas_pagamentos(pagamentos).items()):
+                deltas_caixa[campo] = deltas_caixa.get(campo, 0) + valor
+        if not aceitos:
+            continue
+        
+        ids = db.session.execute(
+            insert(modelo).returning(modelo.id, sort_by_parameter_order=True),
+            [linha for _, linha, _ in aceitos]
+        ).scalars().all()
+        linhas_pagamento = []
+        for (resultado, _, pagamentos), novo_id in zip(aceitos, ids):
+            resultado.update(ok=True, id=novo_id)
+            for pagamento in pagamentos:
+                linha_pagamento = {coluna_pai: novo_id, 'forma_pagamento_id': pagamento.forma_pagamento_id,
+                                   'valor': pagamento.valor, 'observacao': pagamento.observacao}
+                if modelo_pagamento is PagamentoVenda:
+                    linha_pagamento['bandeira_id'] = pagamento.bandeira_id
+                linhas_pagamento.append(linha_pagamento)
+        if linhas_pagamento:
+            db.session.execute(insert(modelo_pagamento), linhas_pagamento)
     
-    return redirect(url_for('delivery'))
+    if deltas_caixa:
+        _aplicar_delta_totais(caixa_id, **deltas_caixa)
+        _marcar_caixa_alterado(caixa_id)
+    return resultados
+
+@app.route('/api/vendas/lote', methods=['POST'])
+@login_required
+def api_vendas_lote():
+    """Registra um lote de vendas e deliveries enviado pelo PDV em JSON.
+
+    Corpo: {"vendas": [...], "deliveries": [...]}, cada item com os campos do
+    formulário correspondente, a lista "pagamentos" e, opcionalmente,
+    "chave_idempotencia". A resposta traz um resultado por item (ok/id ou
+    erro); os itens válidos são gravados juntos. Reenviar o lote é seguro.
+    """
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return jsonify({'erro': 'JSON inválido'}), 400
+    vendas = dados.get('vendas') or []
+    deliveries = dados.get('deliveries') or []
+    if not isinstance(vendas, list) or not isinstance(deliveries, list):
+        return jsonify({'erro': 'vendas e deliveries devem ser listas'}), 400
+    if len(vendas) + len(deliveries) > VENDAS_LOTE_MAX_ITENS:
+        return jsonify({'erro': f'Máximo de {VENDAS_LOTE_MAX_ITENS} itens por lote'}), 413
+    caixa = db.session.get(Caixa, session.get('caixa_id'))
+    if not caixa:
+        return jsonify({'erro': 'Caixa não encontrado'}), 400
+    
+    try:
+        try:
+            resultados = registrar_lote_movimentos(caixa.id, vendas, deliveries)
+            db.session.commit()
+        except IntegrityError:
+            # Outro envio gravou as mesmas chaves ao mesmo tempo; na segunda passada elas são reconhecidas
+            db.session.rollback()
+            resultados = registrar_lote_movimentos(caixa.id, vendas, deliveries)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Erro ao registrar lote: {str(e)}'}), 500
+    
+    for resultado in resultados:
+        if resultado['ok'] and resultado.get('chave_idempotencia') and not resultado.get('repetido'):
+            lembrar_idempotencia(Venda if resultado['tipo'] == 'venda' else Delivery,
+                                 resultado['chave_idempotencia'], resultado['id'])
+    gravados = sum(1 for resultado in resultados if resultado['ok'] and not resultado.get('repetido'))
+    return jsonify({
+        'resultados': resultados,
+        'gravados': gravados,
+        'repetidos': sum(1 for resultado in resultados if resultado.get('repetido')),
+        'recusados': sum(1 for resultado in resultados if not resultado['ok']),
+    })
 
 # ==================== ROUTES - DESPESAS ====================
 
@@ -935,14 +1768,15 @@ def despesas():
         flash('Caixa não encontrado. Por favor, faça login novamente.', 'warning')
         return redirect(url_for('login'))
 
-    despesas_list = Despesa.query.filter_by(caixa_id=session['caixa_id']).order_by(Despesa.data_hora.desc()).all()
-    categorias = CategoriaDespesa.query.filter_by(ativo=True).all()
-    formas_pagamento = FormaPagamento.query.filter_by(ativo=True).all()
+    pagina = pagina_movimentos('despesas', caixa.id)
+    categorias = cadastros()['categorias_ativas']
+    formas_pagamento = cadastros()['formas_ativas']
     
     totais = calcular_totais_caixa(caixa)
     
     return render_template('despesas.html',
-                         despesas=despesas_list,
+                         despesas=pagina.items,
+                         proxima=pagina.proxima,
                          categorias=categorias,
                          formas_pagamento=formas_pagamento,
                          totais=totais,
@@ -971,15 +1805,15 @@ def nova_despesa():
             observacao=observacao
         )
         db.session.add(despesa)
+        _aplicar_delta_totais(despesa.caixa_id, despesas=valor)
+        _marcar_caixa_alterado(despesa.caixa_id)
         db.session.commit()
         
-        flash('Despesa registrada com sucesso!', 'success')
+        return resposta_movimento('despesas', despesa, 'Despesa registrada com sucesso!')
         
     except Exception as e:
         db.session.rollback()
-        flash(f'Erro ao registrar despesa: {str(e)}', 'danger')
-    
-    return redirect(url_for('despesas'))
+        return erro_movimento('despesas', f'Erro ao registrar despesa: {str(e)}')
 
 # ==================== ROUTES - SANGRIA ====================
 
@@ -992,12 +1826,13 @@ def sangria():
         flash('Caixa não encontrado. Por favor, faça login novamente.', 'warning')
         return redirect(url_for('login'))
 
-    sangrias_list = Sangria.query.filter_by(caixa_id=session['caixa_id']).order_by(Sangria.data_hora.desc()).all()
+    pagina = pagina_movimentos('sangrias', caixa.id)
     
     totais = calcular_totais_caixa(caixa)
     
     return render_template('sangria.html',
-                         sangrias=sangrias_list,
+                         sangrias=pagina.items,
+                         proxima=pagina.proxima,
                          totais=totais,
                          caixa=caixa)
 
@@ -1016,15 +1851,15 @@ def nova_sangria():
             observacao=observacao
         )
         db.session.add(sangria_obj)
+        _aplicar_delta_totais(sangria_obj.caixa_id, sangrias=valor)
+        _marcar_caixa_alterado(sangria_obj.caixa_id)
         db.session.commit()
         
-        flash('Sangria registrada com sucesso!', 'success')
+        return resposta_movimento('sangrias', sangria_obj, 'Sangria registrada com sucesso!')
         
     except Exception as e:
         db.session.rollback()
-        flash(f'Erro ao registrar sangria: {str(e)}', 'danger')
-    
-    return redirect(url_for('sangria'))
+        return erro_movimento('sangrias', f'Erro ao registrar sangria: {str(e)}')
 
 # ==================== ROUTES - ESTOQUE ====================
 
@@ -1095,6 +1930,61 @@ def novo_produto():
     
     return redirect(url_for('estoque'))
 
+TIPOS_MOVIMENTACAO_ESTOQUE = ('ENTRADA', 'SAIDA', 'AJUSTE')
+
+# Máximo de itens aceitos em /api/estoque/movimentacoes/lote (uma nota de fornecedor)
+ESTOQUE_LOTE_MAX_ITENS = int(os.environ.get('ESTOQUE_LOTE_MAX_ITENS', 500))
+
+def _atualizar_quantidade_produto(produto_id, tipo, quantidade):
+    """Aplica a movimentação na quantidade do produto com um UPDATE condicional.
+
+    ENTRADA soma, SAIDA subtrai só se houver saldo (WHERE quantidade >= n) e
+    AJUSTE define o valor. A conta é feita pelo banco, então movimentações
+    simultâneas do mesmo produto não se sobrescrevem. Retorna a quantidade
+    nova; ValueError se o produto não existe ou o saldo não basta.
+    """
+    if tipo not in TIPOS_MOVIMENTACAO_ESTOQUE:
+        raise ValueError(f'Tipo de movimentação inválido: {tipo}')
+    if quantidade < 0 or (quantidade == 0 and tipo != 'AJUSTE'):
+        raise ValueError('Quantidade inválida')
+    
+    atual = func.coalesce(Produto.quantidade, 0)
+    comando = update(Produto).where(Produto.id == produto_id)
+    if tipo == 'ENTRADA':
+        comando = comando.values(quantidade=atual + quantidade)
+    elif tipo == 'SAIDA':
+        comando = comando.where(atual >= quantidade).values(quantidade=atual - quantidade)
+    else:
+        comando = comando.values(quantidade=quantidade)
+    nova = db.session.execute(
+        comando.returning(Produto.quantidade).execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    if nova is not None:
+        return nova
+    
+    disponivel = db.session.query(Produto.quantidade).filter(Produto.id == produto_id).first()
+    if disponivel is None:
+        raise ValueError('Produto não encontrado!')
+    raise ValueError(f'Quantidade insuficiente! Disponível: {disponivel[0] or 0}')
+
+def movimentar_estoque(produto_id, tipo, quantidade, valor_unitario=0, motivo=None, observacao='', usuario_id=None):
+    """Movimenta o estoque do produto e registra a movimentação na mesma transação.
+
+    Não faz commit. Retorna a quantidade do produto depois da movimentação.
+    """
+    nova = _atualizar_quantidade_produto(produto_id, tipo, quantidade)
+    db.session.add(MovimentacaoEstoque(
+        produto_id=produto_id,
+        tipo=tipo,
+        quantidade=quantidade,
+        valor_unitario=valor_unitario,
+        valor_total=valor_unitario * quantidade,
+        motivo=motivo,
+        observacao=observacao,
+        usuario_id=usuario_id
+    ))
+    return nova
+
 @app.route('/estoque/movimentacao/nova', methods=['POST'])
 @login_required
 def nova_movimentacao():
@@ -1106,36 +1996,13 @@ def nova_movimentacao():
         motivo = request.form.get('motivo')
         observacao = request.form.get('observacao', '')
         
-        produto = db.session.get(Produto, produto_id)
-        if not produto:
-            flash('Produto não encontrado!', 'danger')
-            return redirect(url_for('estoque'))
-        
-        # Verificar estoque para saídas
-        if tipo == 'SAIDA' and quantidade > produto.quantidade:
-            flash(f'Quantidade insuficiente! Disponível: {produto.quantidade}', 'danger')
+        try:
+            movimentar_estoque(produto_id, tipo, quantidade, valor_unitario, motivo, observacao,
+                               usuario_id=session['user_id'])
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
             return redirect(url_for('estoque'))
-        
-        # Atualizar quantidade
-        if tipo == 'ENTRADA':
-            produto.quantidade += quantidade
-        elif tipo == 'SAIDA':
-            produto.quantidade -= quantidade
-        elif tipo == 'AJUSTE':
-            produto.quantidade = quantidade
-        
-        # Criar movimentação
-        movimentacao = MovimentacaoEstoque(
-            produto_id=produto_id,
-            tipo=tipo,
-            quantidade=quantidade,
-            valor_unitario=valor_unitario,
-            valor_total=valor_unitario * quantidade,
-            motivo=motivo,
-            observacao=observacao,
-            usuario_id=session['user_id']
-        )
-        db.session.add(movimentacao)
         db.session.commit()
         
         flash('Movimentação registrada com sucesso!', 'success')
@@ -1146,17 +2013,87 @@ def nova_movimentacao():
     
     return redirect(url_for('estoque'))
 
+@app.route('/api/estoque/movimentacoes/lote', methods=['POST'])
+@login_required
+def api_movimentacoes_lote():
+    """Registra várias movimentações de estoque de uma vez (ex.: entrada de uma nota de fornecedor).
+
+    Corpo: {"movimentacoes": [{"produto_id" ou "codigo", "tipo", "quantidade",
+    "valor_unitario", "motivo", "observacao"}], "motivo", "observacao"}; motivo
+    e observação do corpo valem para os itens que não trazem os seus. O lote é
+    tudo ou nada: se um item falhar, nada é gravado e a resposta traz o erro de
+    cada item.
+    """
+    from sqlalchemy import insert
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict) or not isinstance(dados.get('movimentacoes'), list):
+        return jsonify({'erro': 'JSON inválido'}), 400
+    itens = dados['movimentacoes']
+    if not itens:
+        return jsonify({'erro': 'Nenhuma movimentação informada'}), 400
+    if len(itens) > ESTOQUE_LOTE_MAX_ITENS:
+        return jsonify({'erro': f'Máximo de {ESTOQUE_LOTE_MAX_ITENS} itens por lote'}), 413
+    
+    codigos = {item.get('codigo') for item in itens if isinstance(item, dict) and item.get('codigo')}
+    ids_por_codigo = dict(db.session.query(Produto.codigo, Produto.id).filter(Produto.codigo.in_(codigos))) if codigos else {}
+    
+    resultados = []
+    linhas = []
+    try:
+        for indice, item in enumerate(itens):
+            resultado = {'indice': indice}
+            resultados.append(resultado)
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Item inválido')
+                if item.get('codigo'):
+                    produto_id = ids_por_codigo.get(item['codigo'])
+                    if produto_id is None:
+                        raise ValueError(f"Produto não encontrado: {item['codigo']}")
+                else:
+                    produto_id = _id_lote(item.get('produto_id'))
+                tipo = item.get('tipo') or 'ENTRADA'
+                quantidade = int(item.get('quantidade') or 0)
+                valor_unitario = parse_moeda(item.get('valor_unitario'))
+                resultado['quantidade_atual'] = _atualizar_quantidade_produto(produto_id, tipo, quantidade)
+            except (ValueError, TypeError) as e:
+                resultado.update(ok=False, erro=str(e))
+                continue
+            resultado.update(ok=True, produto_id=produto_id)
+            linhas.append({
+                'produto_id': produto_id,
+                'tipo': tipo,
+                'quantidade': quantidade,
+                'valor_unitario': valor_unitario,
+                'valor_total': valor_unitario * quantidade,
+                'motivo': item.get('motivo') or dados.get('motivo'),
+                'observacao': item.get('observacao') or dados.get('observacao') or '',
+                'usuario_id': session['user_id'],
+                'data_hora': datetime.utcnow(),
+            })
+        
+        recusados = [resultado for resultado in resultados if not resultado['ok']]
+        if recusados:
+            db.session.rollback()
+            for resultado in resultados:
+                resultado.pop('quantidade_atual', None)
+            return jsonify({'erro': 'Nenhuma movimentação gravada', 'resultados': resultados}), 409
+        db.session.execute(insert(MovimentacaoEstoque), linhas)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Erro ao registrar movimentações: {str(e)}'}), 500
+    
+    return jsonify({'resultados': resultados, 'gravados': len(linhas)})
+
 # ==================== ROUTES - DASHBOARD ====================
 
-@app.route('/dashboard')
-@login_required
-@dashboard_required 
-def dashboard():
-    # Pegar filtros
-    periodo = request.args.get('periodo', 'month')
-    data_inicio = request.args.get('data_inicio')
-    data_fim = request.args.get('data_fim')
-    turno = request.args.get('turno', 'all')
+def _filtros_dashboard(args):
+    """Lê os filtros do dashboard: (periodo, data_inicio, data_fim, turno)"""
+    periodo = args.get('periodo', 'month')
+    data_inicio = args.get('data_inicio')
+    data_fim = args.get('data_fim')
+    turno = args.get('turno', 'all')
     
     # Definir datas
     hoje = datetime.now().date()
@@ -1175,8 +2112,11 @@ def dashboard():
         if data_fim:
             data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date()
     
-    # Buscar caixas no período
-    caixas_query = Caixa.query.filter(
+    return periodo, data_inicio, data_fim, turno
+
+def _caixas_dashboard(data_inicio, data_fim, turno):
+    """Caixas do período (e turno) filtrado no dashboard"""
+    caixas_query = Caixa.query.options(*opcoes_carregamento_caixa('totals_only')).filter(
         Caixa.data >= data_inicio,
         Caixa.data <= data_fim
     )
@@ -1184,37 +2124,189 @@ def dashboard():
     if turno and turno != 'all':
         caixas_query = caixas_query.filter(Caixa.turno == turno)
 
-    caixas = caixas_query.all()
+    return caixas_query.all()
+
+# ==================== CACHE DAS MÉTRICAS DO DASHBOARD ====================
+
+_cache_dashboard = OrderedDict()   # (data_inicio, data_fim, turno) -> (geracao, tamanho, metricas)
+_cache_dashboard_lock = threading.Lock()
+_cache_dashboard_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+CACHE_DASHBOARD_MAX_ITENS = int(os.environ.get('DASHBOARD_CACHE_MAX_ITENS', 64))
+CACHE_DASHBOARD_MAX_BYTES = int(os.environ.get('DASHBOARD_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+
+def _incrementar_contador(modelo, chave, valor_chave, contador):
+    """Soma 1 ao contador da linha (criando-a com 1 se não existir) em um único upsert"""
+    tabela = modelo.__table__
+    coluna_chave, coluna_contador = tabela.c[chave], tabela.c[contador]
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        resultado = db.session.execute(
+            update(tabela).where(coluna_chave == valor_chave).values({coluna_contador: coluna_contador + 1}))
+        if not resultado.rowcount:
+            db.session.execute(tabela.insert().values({chave: valor_chave, contador: 1}))
+        return
+    comando = insert(tabela).values({chave: valor_chave, contador: 1})
+    db.session.execute(comando.on_conflict_do_update(
+        index_elements=[coluna_chave], set_={contador: coluna_contador + 1}))
+
+def _incrementar_geracao_data(data):
+    """Incrementa o contador da data (upsert); entra na mesma transação da rota"""
+    _incrementar_contador(GeracaoData, 'data', data, 'geracao')
+
+def _marcar_caixa_alterado(caixa_id):
+    """Invalida as métricas em cache que incluem a data deste caixa"""
+    caixa = db.session.get(Caixa, caixa_id)
+    if caixa:
+        _incrementar_geracao_data(caixa.data)
+
+def _geracao_periodo(data_inicio, data_fim):
+    """Soma dos contadores do período mais a versão dos cadastros; muda a cada escrita"""
+    geracao = db.session.query(func.coalesce(func.sum(GeracaoData.geracao), 0)).filter(
+        GeracaoData.data.between(data_inicio, data_fim)
+    ).scalar()
+    # Nomes de formas, categorias e motoboys aparecem nas métricas
+    return geracao + _versao_cadastros()
+
+def metricas_dashboard_cache(data_inicio, data_fim, turno, caixas=None):
+    """Métricas do dashboard com cache LRU por (data_inicio, data_fim, turno).
+
+    A entrada guarda a soma das gerações do período no momento do cálculo e só
+    vale enquanto essa soma não mudar. O cache é por processo (cada worker tem
+    o seu), mas a invalidação vem do banco e vale para todos.
+    """
+    if not data_inicio or not data_fim:
+        return calcular_metricas_periodo(caixas if caixas is not None else _caixas_dashboard(data_inicio, data_fim, turno))
+    
+    chave = (data_inicio, data_fim, turno or 'all')
+    geracao = _geracao_periodo(data_inicio, data_fim)
+    with _cache_dashboard_lock:
+        entrada = _cache_dashboard.get(chave)
+        if entrada and entrada[0] == geracao:
+            _cache_dashboard.move_to_end(chave)
+            _cache_dashboard_stats['hits'] += 1
+            return entrada[2]
+        _cache_dashboard_stats['misses'] += 1
+    
+    if caixas is None:
+        caixas = _caixas_dashboard(data_inicio, data_fim, turno)
+    resultado = calcular_metricas_periodo(caixas)
+    tamanho = len(json.dumps(resultado, default=str))
     
-    # Calcular métricas
-    metricas = calcular_metricas_dashboard(caixas)
+    with _cache_dashboard_lock:
+        anterior = _cache_dashboard.pop(chave, None)
+        if anterior:
+            _cache_dashboard_stats['bytes'] -= anterior[1]
+        if tamanho <= CACHE_DASHBOARD_MAX_BYTES:
+            _cache_dashboard[chave] = (geracao, tamanho, resultado)
+            _cache_dashboard_stats['bytes'] += tamanho
+        while _cache_dashboard and (len(_cache_dashboard) > CACHE_DASHBOARD_MAX_ITENS
+                                    or _cache_dashboard_stats['bytes'] > CACHE_DASHBOARD_MAX_BYTES):
+            _, removida = _cache_dashboard.popitem(last=False)
+            _cache_dashboard_stats['bytes'] -= removida[1]
+            _cache_dashboard_stats['evictions'] += 1
+    return resultado
+
+@app.route('/dashboard')
+@login_required
+@dashboard_required 
+def dashboard():
+    periodo, data_inicio, data_fim, turno = _filtros_dashboard(request.args)
+    caixas = _caixas_dashboard(data_inicio, data_fim, turno)
     
-    # Calcular métricas avançadas
-    metricas_avancadas = calcular_metricas_avancadas(caixas)
+    # Métricas e métricas avançadas (uma única passada, com cache por período)
+    metricas, metricas_avancadas = metricas_dashboard_cache(data_inicio, data_fim, turno, caixas)
+    totais_caixas = calcular_totais_caixas(caixas)
     
     return render_template('dashboard.html',
                          metricas=metricas,
                          metricas_avancadas=metricas_avancadas,
                          caixas=caixas,
+                         totais_caixas=totais_caixas,
                          periodo=periodo,
                          data_inicio=data_inicio,
                          data_fim=data_fim,
                          turno=turno)
 
+@app.route('/api/dashboard/metrics')
+@login_required
+@dashboard_required
+def api_dashboard_metrics():
+    """Métricas do dashboard em JSON para a atualização automática da página.
+
+    A resposta leva ETag; se nada mudou desde a última consulta o navegador
+    recebe 304 e mantém os gráficos como estão.
+    """
+    try:
+        periodo, data_inicio, data_fim, turno = _filtros_dashboard(request.args)
+    except ValueError:
+        return jsonify({'erro': 'Data inválida'}), 400
+    metricas, metricas_avancadas = metricas_dashboard_cache(data_inicio, data_fim, turno)
+    
+    resposta = jsonify({'metricas': metricas, 'metricas_avancadas': metricas_avancadas})
+    resposta.add_etag()
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
+
+@app.route('/api/movimentos/<tipo>')
+@login_required
+def api_movimentos(tipo):
+    """Próxima página de uma lista do PDV, com as linhas já renderizadas em HTML"""
+    if tipo not in MOVIMENTOS_PDV:
+        return jsonify({'erro': 'Lista desconhecida'}), 404
+    if not session.get('caixa_id'):
+        return jsonify({'erro': 'Nenhum caixa aberto'}), 400
+    try:
+        pagina = pagina_movimentos(tipo, session['caixa_id'], depois=request.args.get('depois'))
+    except ValueError:
+        return jsonify({'erro': 'Página inválida'}), 400
+    
+    html = render_template('movimentos_linhas.html', tipo=tipo, itens=pagina.items)
+    return jsonify({'html': html, 'proxima': pagina.proxima, 'quantidade': len(pagina.items)})
+
+@app.route('/admin/cache/dashboard')
+@admin_required
+def admin_cache_dashboard():
+    """Estatísticas do cache de métricas do dashboard (deste worker)"""
+    with _cache_dashboard_lock:
+        estatisticas = dict(_cache_dashboard_stats, itens=len(_cache_dashboard))
+    consultas = estatisticas['hits'] + estatisticas['misses']
+    estatisticas['taxa_acerto'] = round(estatisticas['hits'] / consultas, 3) if consultas else 0
+    estatisticas['max_itens'] = CACHE_DASHBOARD_MAX_ITENS
+    estatisticas['max_bytes'] = CACHE_DASHBOARD_MAX_BYTES
+    return jsonify(estatisticas)
+
+@app.route('/admin/sql/estatisticas')
+@admin_required
+def admin_sql_estatisticas():
+    """Consultas SQL por rota desde o início deste worker, das mais pesadas para as mais leves"""
+    with _sql_por_rota_lock:
+        rotas = {rota: dict(dados) for rota, dados in _sql_por_rota.items()}
+    for dados in rotas.values():
+        dados['media_consultas'] = round(dados['consultas'] / dados['requisicoes'], 1)
+        dados['tempo_db_ms'] = round(dados['tempo_db_ms'], 1)
+    ordenadas = sorted(rotas.items(), key=lambda item: item[1]['tempo_db_ms'], reverse=True)
+    return jsonify({'limite_repeticoes': SQL_LIMITE_REPETICOES,
+                    'rotas': [dict(dados, rota=rota) for rota, dados in ordenadas]})
+
 # ==================== ROUTES - CONFIGURAÇÕES ====================
 
 @app.route('/configuracoes')
 @admin_required
 def configuracoes():
     usuarios = Usuario.query.all()
-    formas_pagamento = FormaPagamento.query.all()
-    bandeiras = BandeiraCartao.query.all()
-    categorias = CategoriaDespesa.query.all()
-    motoboys = Motoboy.query.all()
+    formas_pagamento = cadastros()['formas']
+    bandeiras = cadastros()['bandeiras']
+    categorias = cadastros()['categorias']
+    motoboys = cadastros()['motoboys']
     
     return render_template('configuracoes.html',
                          usuarios=usuarios,
                          formas_pagamento=formas_pagamento,
+                         classificacoes_forma=CLASSIFICACOES_FORMA_PAGAMENTO,
                          bandeiras=bandeiras,
                          categorias=categorias,
                          motoboys=motoboys)
@@ -1271,8 +2363,13 @@ def nova_forma_pagamento():
             flash('Esta forma de pagamento já existe!', 'warning')
             return redirect(url_for('configuracoes'))
         
-        forma = FormaPagamento(nome=nome)
+        classificacao = request.form.get('classificacao')
+        if classificacao not in dict(CLASSIFICACOES_FORMA_PAGAMENTO):
+            classificacao = _classificar_forma_pagamento(nome)
+        
+        forma = FormaPagamento(nome=nome, classificacao=classificacao)
         db.session.add(forma)
+        _invalidar_cadastros()
         db.session.commit()
         
         flash(f'Forma de pagamento "{nome}" criada com sucesso!', 'success')
@@ -1301,6 +2398,7 @@ def nova_bandeira():
         
         bandeira = BandeiraCartao(nome=nome)
         db.session.add(bandeira)
+        _invalidar_cadastros()
         db.session.commit()
         
         flash(f'Bandeira "{nome}" criada com sucesso!', 'success')
@@ -1330,6 +2428,7 @@ def nova_categoria():
         
         categoria = CategoriaDespesa(nome=nome, tipo=tipo)
         db.session.add(categoria)
+        _invalidar_cadastros()
         db.session.commit()
         
         flash(f'Categoria "{nome}" ({tipo}) criada com sucesso!', 'success')
@@ -1359,6 +2458,7 @@ def novo_motoboy():
         
         motoboy = Motoboy(nome=nome, taxa_padrao=taxa_padrao)
         db.session.add(motoboy)
+        _invalidar_cadastros()
         db.session.commit()
         
         flash(f'Motoboy "{nome}" cadastrado com sucesso!', 'success')
@@ -1375,28 +2475,38 @@ def novo_motoboy():
 @admin_required
 def admin_caixas():
     """Lista todos os caixas para administração"""
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', 'all')
+    turno_filter = request.args.get('turno', 'all')
+    operador_filter = request.args.get('operador', type=int)
+    depois = request.args.get('depois')
+    antes = request.args.get('antes')
     
-    query = Caixa.query.order_by(Caixa.data.desc(), Caixa.hora_abertura.desc())
+    query = filtrar_caixas(Caixa.query.options(*opcoes_carregamento_caixa('totals_only')),
+                           status=status_filter, turno=turno_filter, operador_id=operador_filter)
     
-    if status_filter != 'all':
-        query = query.filter_by(status=status_filter.upper())
+    try:
+        # Total só na primeira página; nas seguintes a navegação dispensa o COUNT
+        caixas = paginar_caixas(query, depois=depois, antes=antes, por_pagina=20,
+                                contar=not (depois or antes) and request.args.get('contar') != '0')
+    except ValueError:
+        flash('Página inválida, voltando ao início da lista.', 'warning')
+        return redirect(url_for('admin_caixas', status=status_filter, turno=turno_filter, operador=operador_filter))
     
-    caixas = query.paginate(page=page, per_page=20, error_out=False)
+    operadores = Usuario.query.order_by(Usuario.nome).all()
     
-    return render_template('admin_caixas.html', caixas=caixas, status_filter=status_filter)
+    return render_template('admin_caixas.html', caixas=caixas, status_filter=status_filter,
+                           turno_filter=turno_filter, operador_filter=operador_filter, operadores=operadores)
 
 @app.route('/admin/caixa/<int:caixa_id>/visualizar')
 @admin_required
 def admin_visualizar_caixa(caixa_id):
     """Visualizar detalhes de um caixa específico"""
-    caixa = db.session.get(Caixa, caixa_id)
+    caixa = carregar_caixa(caixa_id, 'full_caixa')
     if not caixa:
         flash('Caixa não encontrado!', 'danger')
         return redirect(url_for('admin_caixas'))
     
-    totais = calcular_totais_fechamento(caixa)
+    totais = totais_caixa_fechamento(caixa)
     
     return render_template('admin_visualizar_caixa.html', caixa=caixa, totais=totais)
 
@@ -1413,37 +2523,12 @@ def admin_excluir_caixa_completo(caixa_id):
         # Registrar informações para mensagem
         info_caixa = f"Caixa #{caixa.id} - {caixa.data.strftime('%d/%m/%Y')} - {caixa.turno}"
         
-        # Excluir todos os registros relacionados (em ordem para evitar constraints)
-        
-        # 1. Excluir pagamentos das vendas
-        for venda in caixa.vendas:
-            PagamentoVenda.query.filter_by(venda_id=venda.id).delete()
-        
-        # 2. Excluir pagamentos dos deliveries
-        for delivery in caixa.deliveries:
-            PagamentoDelivery.query.filter_by(delivery_id=delivery.id).delete()
-        
-        # 3. Excluir vendas
-        Venda.query.filter_by(caixa_id=caixa_id).delete()
-        
-        # 4. Excluir deliveries
-        Delivery.query.filter_by(caixa_id=caixa_id).delete()
-        
-        # 5. Excluir despesas
-        Despesa.query.filter_by(caixa_id=caixa_id).delete()
-        
-        # 6. Excluir sangrias
-        Sangria.query.filter_by(caixa_id=caixa_id).delete()
-        
-        # 7. Excluir suprimentos (se existir)
-        if hasattr(caixa, 'suprimentos'):
-            Suprimento.query.filter_by(caixa_id=caixa_id).delete()
-        
-        # 8. Finalmente, excluir o caixa
-        db.session.delete(caixa)
+        # Excluir o caixa e todos os registros relacionados (um DELETE por tabela)
+        contagem = excluir_caixas(Caixa.id == caixa_id)
         db.session.commit()
         
-        flash(f'✅ Caixa {info_caixa} excluído permanentemente com todos os registros!', 'success')
+        flash(f'✅ Caixa {info_caixa} excluído permanentemente com todos os registros! '
+              f'({_resumo_exclusao(contagem)})', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -1451,6 +2536,37 @@ def admin_excluir_caixa_completo(caixa_id):
     
     return redirect(url_for('admin_caixas'))
 
+@app.route('/admin/caixas/excluir-periodo', methods=['POST'])
+@admin_master_required
+def admin_excluir_caixas_periodo():
+    """Excluir todos os caixas de um intervalo de datas com todos os seus registros"""
+    try:
+        data_inicio = datetime.strptime(request.form.get('data_inicio', ''), '%Y-%m-%d').date()
+        data_fim = datetime.strptime(request.form.get('data_fim', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('Informe a data inicial e a data final.', 'warning')
+        return redirect(url_for('admin_caixas'))
+    if data_fim < data_inicio:
+        flash('A data final deve ser igual ou posterior à data inicial.', 'warning')
+        return redirect(url_for('admin_caixas'))
+    if request.form.get('confirmacao') != 'EXCLUIR':
+        flash('Digite EXCLUIR para confirmar a exclusão do período.', 'warning')
+        return redirect(url_for('admin_caixas'))
+    
+    try:
+        contagem = excluir_caixas(Caixa.data >= data_inicio, Caixa.data <= data_fim)
+        db.session.commit()
+        if contagem['caixa']:
+            flash(f"✅ {contagem['caixa']} caixa(s) de {data_inicio.strftime('%d/%m/%Y')} a "
+                  f"{data_fim.strftime('%d/%m/%Y')} excluído(s). Registros: {_resumo_exclusao(contagem)}", 'success')
+        else:
+            flash('Nenhum caixa encontrado no período.', 'info')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'❌ Erro ao excluir caixas: {str(e)}', 'danger')
+    
+    return redirect(url_for('admin_caixas'))
+
 @app.route('/admin/caixa/<int:caixa_id>/gerar-pdf')
 @admin_required
 def admin_gerar_pdf_caixa(caixa_id):
@@ -1458,12 +2574,12 @@ def admin_gerar_pdf_caixa(caixa_id):
     try:
         from flask import make_response
         
-        caixa = db.session.get(Caixa, caixa_id)
+        caixa = carregar_caixa(caixa_id, 'full_caixa')
         if not caixa:
             flash('Caixa não encontrado!', 'danger')
             return redirect(url_for('admin_caixas'))
         
-        totais = calcular_totais_fechamento(caixa)
+        totais = totais_caixa_fechamento(caixa)
         
         # Renderizar HTML do relatório
         html = render_template('relatorio_imprimivel.html', 
@@ -1494,7 +2610,7 @@ def admin_gerar_pdf_caixa(caixa_id):
 @admin_required
 def admin_editar_caixa(caixa_id):
     """Editar um caixa (apenas admin)"""
-    caixa = db.session.get(Caixa, caixa_id)
+    caixa = carregar_caixa(caixa_id, 'totals_only')
     if not caixa:
         flash('Caixa não encontrado!', 'danger')
         return redirect(url_for('admin_caixas'))
@@ -1503,6 +2619,8 @@ def admin_editar_caixa(caixa_id):
         try:
             caixa.saldo_inicial = parse_moeda(request.form.get('saldo_inicial', caixa.saldo_inicial))
             caixa.saldo_final = parse_moeda(request.form.get('saldo_final', caixa.saldo_final))
+            if caixa.status == 'FECHADO':
+                _congelar_totais_caixa(caixa)
             
             db.session.commit()
             flash('Caixa atualizado com sucesso!', 'success')
@@ -1511,7 +2629,7 @@ def admin_editar_caixa(caixa_id):
             db.session.rollback()
             flash(f'Erro ao atualizar caixa: {str(e)}', 'danger')
     
-    totais = calcular_totais_fechamento(caixa)
+    totais = totais_caixa_fechamento(caixa)
     return render_template('admin_editar_caixa.html', caixa=caixa, totais=totais)
 
 @app.route('/admin/venda/<int:venda_id>/editar', methods=['POST'])
@@ -1527,6 +2645,7 @@ def admin_editar_venda(venda_id):
         venda.total = parse_moeda(request.form.get('total', venda.total))
         venda.observacao = request.form.get('observacao', venda.observacao)
         
+        _atualizar_agregados_caixa(venda.caixa_id)
         db.session.commit()
         flash('Venda atualizada com sucesso!', 'success')
     except Exception as e:
@@ -1552,7 +2671,9 @@ def admin_deletar_venda(venda_id):
         
         # Deletar venda
         db.session.delete(venda)
+        _atualizar_agregados_caixa(caixa_id)
         db.session.commit()
+        esquecer_idempotencia(Venda, venda.chave_idempotencia)
         
         flash('Venda removida com sucesso!', 'success')
         return redirect(url_for('admin_visualizar_caixa', caixa_id=caixa_id))
@@ -1574,6 +2695,7 @@ def admin_deletar_despesa(despesa_id):
         caixa_id = despesa.caixa_id
         
         db.session.delete(despesa)
+        _atualizar_agregados_caixa(caixa_id)
         db.session.commit()
         
         flash('Despesa removida com sucesso!', 'success')
@@ -1597,9 +2719,11 @@ def admin_reabrir_caixa(caixa_id):
             flash('Este caixa já está aberto!', 'warning')
             return redirect(url_for('admin_visualizar_caixa', caixa_id=caixa_id))
         
-        # Reabrir caixa
+        # Reabrir caixa (volta a ser calculado ao vivo)
         caixa.status = 'ABERTO'
         caixa.hora_fechamento = None
+        _descongelar_totais_caixa(caixa)
+        _remover_resumo_caixa(caixa.id)
         
         db.session.commit()
         
@@ -1629,6 +2753,8 @@ def admin_fechar_caixa_forcado(caixa_id):
         caixa.saldo_final = totais['saldo_final']
         caixa.status = 'FECHADO'
         caixa.hora_fechamento = datetime.utcnow()
+        _congelar_totais_caixa(caixa, totais)
+        _gravar_resumo_caixa(caixa)
         
         db.session.commit()
         
@@ -1644,12 +2770,12 @@ def admin_fechar_caixa_forcado(caixa_id):
 def admin_gerar_relatorio(caixa_id):
     """Gerar relatório do caixa em formato imprimível"""
     try:
-        caixa = db.session.get(Caixa, caixa_id)
+        caixa = carregar_caixa(caixa_id, 'full_caixa')
         if not caixa:
             flash('Caixa não encontrado!', 'danger')
             return redirect(url_for('admin_caixas'))
         
-        totais = calcular_totais_fechamento(caixa)
+        totais = totais_caixa_fechamento(caixa)
         
         # Renderizar HTML otimizado para impressão
         return render_template('relatorio_imprimivel.html', 
@@ -1674,13 +2800,13 @@ def exportar_excel_real(caixa_id):
         from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
         from openpyxl.utils import get_column_letter
         
-        caixa = db.session.get(Caixa, caixa_id)
+        caixa = carregar_caixa(caixa_id, 'full_caixa')
         if not caixa:
             flash('Caixa não encontrado!', 'danger')
             return redirect(url_for('dashboard'))
         
         # Verificar permissão
-        usuario = db.session.get(Usuario, session['user_id'])
+        usuario = permissoes_usuario()
         if not usuario.acesso_configuracoes and caixa.operador_id != usuario.id:
             flash('Você não tem permissão para exportar este caixa!', 'danger')
             return redirect(url_for('dashboard'))
@@ -1906,7 +3032,7 @@ def exportar_excel_real(caixa_id):
         # ========== ABA 6: RESUMO FINANCEIRO ==========
         ws_resumo = wb.create_sheet("RESUMO")
         
-        totais = calcular_totais_fechamento(caixa)
+        totais = totais_caixa_fechamento(caixa)
         
         resumo_data = [
             ['DESCRIÇÃO', 'VALOR (R$)'],
@@ -2003,6 +3129,7 @@ def admin_editar_venda_detalhes(venda_id):
                     )
                     db.session.add(pagamento)
             
+            _atualizar_agregados_caixa(venda.caixa_id)
             db.session.commit()
             flash('Venda atualizada com sucesso!', 'success')
             return redirect(url_for('admin_visualizar_caixa', caixa_id=venda.caixa_id))
@@ -2010,8 +3137,8 @@ def admin_editar_venda_detalhes(venda_id):
             db.session.rollback()
             flash(f'Erro ao atualizar venda: {str(e)}', 'danger')
     
-    formas_pagamento = FormaPagamento.query.all()
-    bandeiras = BandeiraCartao.query.all()
+    formas_pagamento = cadastros()['formas']
+    bandeiras = cadastros()['bandeiras']
     
     return render_template('admin_editar_venda_detalhes.html', 
                          venda=venda, 
@@ -2055,6 +3182,7 @@ def admin_editar_delivery_detalhes(delivery_id):
                     )
                     db.session.add(pagamento)
             
+            _atualizar_agregados_caixa(delivery.caixa_id)
             db.session.commit()
             flash('Delivery atualizado com sucesso!', 'success')
             return redirect(url_for('admin_visualizar_caixa', caixa_id=delivery.caixa_id))
@@ -2062,8 +3190,8 @@ def admin_editar_delivery_detalhes(delivery_id):
             db.session.rollback()
             flash(f'Erro ao atualizar delivery: {str(e)}', 'danger')
     
-    formas_pagamento = FormaPagamento.query.all()
-    motoboys = Motoboy.query.all()
+    formas_pagamento = cadastros()['formas']
+    motoboys = cadastros()['motoboys']
     
     return render_template('admin_editar_delivery_detalhes.html', 
                          delivery=delivery,
@@ -2087,6 +3215,7 @@ def admin_editar_despesa_detalhes(despesa_id):
             despesa.categoria_id = int(request.form.get('categoria_id')) if request.form.get('categoria_id') else None
             despesa.forma_pagamento_id = int(request.form.get('forma_pagamento_id')) if request.form.get('forma_pagamento_id') else None
             
+            _atualizar_agregados_caixa(despesa.caixa_id)
             db.session.commit()
             flash('Despesa atualizada com sucesso!', 'success')
             return redirect(url_for('admin_visualizar_caixa', caixa_id=despesa.caixa_id))
@@ -2094,8 +3223,8 @@ def admin_editar_despesa_detalhes(despesa_id):
             db.session.rollback()
             flash(f'Erro ao atualizar despesa: {str(e)}', 'danger')
     
-    categorias = CategoriaDespesa.query.all()
-    formas_pagamento = FormaPagamento.query.all()
+    categorias = cadastros()['categorias']
+    formas_pagamento = cadastros()['formas']
     
     return render_template('admin_editar_despesa_detalhes.html',
                          despesa=despesa,
@@ -2119,7 +3248,9 @@ def admin_deletar_delivery(delivery_id):
         
         # Deletar delivery
         db.session.delete(delivery)
+        _atualizar_agregados_caixa(caixa_id)
         db.session.commit()
+        esquecer_idempotencia(Delivery, delivery.chave_idempotencia)
         
         flash('Delivery removido com sucesso!', 'success')
         return redirect(url_for('admin_visualizar_caixa', caixa_id=caixa_id))
@@ -2133,79 +3264,133 @@ def admin_deletar_delivery(delivery_id):
 @app.route('/relatorios')
 @login_required
 def relatorios():
-    usuario = db.session.get(Usuario, session['user_id'])
-    if usuario.perfil in ['ADMIN', 'MASTER']:
-        caixas = Caixa.query.order_by(Caixa.data.desc()).all()
-    else:
-        caixas = Caixa.query.filter_by(
-            operador_id=usuario.id
-        ).order_by(Caixa.data.desc()).all()
+    usuario = permissoes_usuario()
+    status_filter = request.args.get('status', 'all')
+    turno_filter = request.args.get('turno', 'all')
+    depois = request.args.get('depois')
+    antes = request.args.get('antes')
+    
+    # Operador só vê os próprios caixas
+    operador_id = None if usuario.perfil in ['ADMIN', 'MASTER'] else usuario.id
+    query = filtrar_caixas(Caixa.query.options(*opcoes_carregamento_caixa('totals_only')),
+                           status=status_filter, turno=turno_filter, operador_id=operador_id)
+    try:
+        caixas = paginar_caixas(query, depois=depois, antes=antes, por_pagina=20)
+    except ValueError:
+        flash('Página inválida, voltando ao início da lista.', 'warning')
+        return redirect(url_for('relatorios', status=status_filter, turno=turno_filter))
 
     return render_template(
         'relatorios.html',
-        caixas=caixas
+        caixas=caixas,
+        status_filter=status_filter,
+        turno_filter=turno_filter
     )
 
 @app.route('/relatorios/diario', methods=['GET', 'POST'])
 @login_required
 def relatorio_diario():
-    """Relatório consolidado do dia"""
-    if request.method == 'POST':
-        data = request.form.get('data')
-        data_obj = datetime.strptime(data, '%Y-%m-%d').date()
-    else:
-        data_obj = datetime.now().date()
-        data = data_obj.strftime('%Y-%m-%d')
+    """Relatório consolidado do dia ou de um período (semana, mês ou intervalo livre)"""
+    hoje = datetime.now().date()
+    periodo = request.values.get('periodo')
+    data = request.values.get('data')
+    try:
+        if periodo == 'semana':
+            data_inicio, data_fim = hoje - timedelta(days=6), hoje
+        elif periodo == 'mes':
+            data_inicio, data_fim = hoje.replace(day=1), hoje
+        elif data:
+            data_inicio = data_fim = datetime.strptime(data, '%Y-%m-%d').date()
+        else:
+            inicio = request.values.get('data_inicio')
+            fim = request.values.get('data_fim')
+            data_inicio = datetime.strptime(inicio, '%Y-%m-%d').date() if inicio else hoje
+            data_fim = datetime.strptime(fim, '%Y-%m-%d').date() if fim else data_inicio
+    except ValueError:
+        flash('Data inválida!', 'danger')
+        return redirect(url_for('relatorios'))
+    if data_fim < data_inicio:
+        data_inicio, data_fim = data_fim, data_inicio
     
-    # Buscar todos os caixas do dia
-    caixas_dia = Caixa.query.filter_by(data=data_obj).all()
+    # Totais por (data, turno) em consultas agrupadas
+    consolidado = consolidar_periodo_caixas(data_inicio, data_fim)
     
-    # Consolidar dados
     relatorio = {
-        'data': data_obj,
-        'total_caixas': len(caixas_dia),
-        'caixas_abertos': sum(1 for c in caixas_dia if c.status == 'ABERTO'),
-        'caixas_fechados': sum(1 for c in caixas_dia if c.status == 'FECHADO'),
+        'data': data_inicio,
+        'data_inicio': data_inicio,
+        'data_fim': data_fim,
+        'um_dia': data_inicio == data_fim,
+        'total_caixas': 0,
+        'caixas_abertos': 0,
+        'caixas_fechados': 0,
         'total_vendas': 0,
         'total_despesas': 0,
         'total_sangrias': 0,
         'saldo_dia': 0,
-        'caixas': [],  # Lista de caixas com seus totais
-        'turnos': {}
+        'caixas': [],  # Lista de caixas com seus totais (relatório de um dia)
+        'turnos': {},
+        'dias': [],  # Um item por dia com os totais de cada turno
+        'turnos_periodo': {}
     }
     
-    for caixa in caixas_dia:
-        totais = calcular_totais_caixa(caixa)
-        relatorio['total_vendas'] += totais['total_vendas']
-        relatorio['total_despesas'] += totais['despesas']
-        relatorio['total_sangrias'] += sum(s.valor for s in caixa.sangrias)
-        
-        # Adicionar caixa com totais
-        relatorio['caixas'].append({
-            'caixa': caixa,
-            'totais': totais
-        })
-        
-        relatorio['turnos'][caixa.turno] = {
-            'caixa': caixa,
-            'totais': totais,
-            'status': caixa.status
-        }
+    dias = {}
+    for (dia, turno), linha in sorted(consolidado.items()):
+        item = dias.setdefault(dia, {'data': dia, 'turnos': {}, 'caixas': 0,
+                                     'total_vendas': 0, 'total_despesas': 0, 'total_sangrias': 0})
+        item['turnos'][turno] = linha
+        item['caixas'] += linha['caixas']
+        item['total_vendas'] += linha['vendas']
+        item['total_despesas'] += linha['despesas']
+        item['total_sangrias'] += linha['sangrias']
+        
+        acumulado = relatorio['turnos_periodo'].setdefault(
+            turno, {'caixas': 0, 'vendas': 0, 'despesas': 0, 'sangrias': 0})
+        for campo in acumulado:
+            acumulado[campo] += linha[campo]
+        
+        relatorio['total_caixas'] += linha['caixas']
+        relatorio['caixas_abertos'] += linha['abertos']
+        relatorio['caixas_fechados'] += linha['fechados']
+        relatorio['total_vendas'] += linha['vendas']
+        relatorio['total_despesas'] += linha['despesas']
+        relatorio['total_sangrias'] += linha['sangrias']
     
+    for item in dias.values():
+        item['saldo'] = item['total_vendas'] - item['total_despesas'] - item['total_sangrias']
+    relatorio['dias'] = list(dias.values())
     relatorio['saldo_dia'] = relatorio['total_vendas'] - relatorio['total_despesas'] - relatorio['total_sangrias']
     
-    return render_template('relatorio_diario.html', relatorio=relatorio, data=data)
+    # Um único dia: cartões por turno com os dados de cada caixa
+    if relatorio['um_dia']:
+        caixas_dia = Caixa.query.filter_by(data=data_inicio).all()
+        totais_caixas = calcular_totais_caixas(caixas_dia)
+        for caixa in caixas_dia:
+            totais = totais_caixas[caixa.id]
+            relatorio['caixas'].append({
+                'caixa': caixa,
+                'totais': totais
+            })
+            relatorio['turnos'][caixa.turno] = {
+                'caixa': caixa,
+                'totais': totais,
+                'status': caixa.status
+            }
+    
+    return render_template('relatorio_diario.html', relatorio=relatorio,
+                           data=data_inicio.strftime('%Y-%m-%d'),
+                           data_inicio=data_inicio.strftime('%Y-%m-%d'),
+                           data_fim=data_fim.strftime('%Y-%m-%d'))
 
 @app.route('/relatorios/turno/<int:caixa_id>')
 @login_required
 def relatorio_turno(caixa_id):
     """Relatório detalhado de um turno específico"""
-    caixa = db.session.get(Caixa, caixa_id)
+    caixa = carregar_caixa(caixa_id, 'totals_only')
     if not caixa:
         flash('Caixa não encontrado!', 'danger')
         return redirect(url_for('relatorios'))
     
-    totais = calcular_totais_fechamento(caixa)
+    totais = totais_caixa_fechamento(caixa)
     
     return render_template('relatorio_turno.html', caixa=caixa, totais=totais)
 
@@ -2236,6 +3421,8 @@ def confirmar_fechamento():
         caixa.saldo_final = totais['saldo_final']
         caixa.status = 'FECHADO'
         caixa.hora_fechamento = datetime.utcnow()
+        _congelar_totais_caixa(caixa, totais)
+        _gravar_resumo_caixa(caixa)
         
         db.session.commit()
         
@@ -2261,10 +3448,12 @@ def suprimentos():
         flash('Caixa não encontrado!', 'danger')
         return redirect(url_for('login'))
     
-    suprimentos_list = Suprimento.query.filter_by(caixa_id=session['caixa_id']).order_by(Suprimento.data_hora.desc()).all()
+    pagina = pagina_movimentos('suprimentos', caixa.id)
+    total_suprimentos = db.session.query(func.count(Suprimento.id)).filter(Suprimento.caixa_id == caixa.id).scalar()
     totais = calcular_totais_caixa(caixa)
     
-    return render_template('suprimentos.html', suprimentos=suprimentos_list, totais=totais, caixa=caixa)
+    return render_template('suprimentos.html', suprimentos=pagina.items, proxima=pagina.proxima,
+                           total_suprimentos=total_suprimentos, totais=totais, caixa=caixa)
 
 @app.route('/suprimento/novo', methods=['POST'])
 @login_required
@@ -2284,12 +3473,10 @@ def novo_suprimento():
         db.session.add(suprimento)
         db.session.commit()
         
-        flash(f'✅ Suprimento de R$ {valor:.2f} registrado com sucesso!', 'success')
+        return resposta_movimento('suprimentos', suprimento, f'✅ Suprimento de R$ {valor:.2f} registrado com sucesso!')
     except Exception as e:
         db.session.rollback()
-        flash(f'❌ Erro ao registrar suprimento: {str(e)}', 'danger')
-    
-    return redirect(url_for('suprimentos'))
+        return erro_movimento('suprimentos', f'❌ Erro ao registrar suprimento: {str(e)}')
 
 @app.route('/admin/suprimento/<int:suprimento_id>/editar', methods=['GET', 'POST'])
 @admin_required
@@ -2348,6 +3535,7 @@ def admin_editar_sangria(sangria_id):
             sangria.valor = parse_moeda(request.form.get('valor'))
             sangria.motivo = request.form.get('motivo')
             sangria.observacao = request.form.get('observacao', '')
+            _atualizar_agregados_caixa(sangria.caixa_id)
             db.session.commit()
             flash('✅ Sangria atualizada com sucesso!', 'success')
             return redirect(url_for('sangria'))
@@ -2365,6 +3553,7 @@ def admin_deletar_sangria(sangria_id):
         sangria = db.session.get(Sangria, sangria_id)
         if sangria:
             db.session.delete(sangria)
+            _atualizar_agregados_caixa(sangria.caixa_id)
             db.session.commit()
             flash('✅ Sangria removida com sucesso!', 'success')
     except Exception as e:
@@ -2383,7 +3572,9 @@ def admin_deletar_venda_completa(venda_id):
             # Deletar pagamentos primeiro
             PagamentoVenda.query.filter_by(venda_id=venda_id).delete()
             db.session.delete(venda)
+            _atualizar_agregados_caixa(venda.caixa_id)
             db.session.commit()
+            esquecer_idempotencia(Venda, venda.chave_idempotencia)
             flash('✅ Venda removida com sucesso!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -2401,7 +3592,9 @@ def admin_deletar_delivery_completo(delivery_id):
             # Deletar pagamentos primeiro
             PagamentoDelivery.query.filter_by(delivery_id=delivery_id).delete()
             db.session.delete(delivery)
+            _atualizar_agregados_caixa(delivery.caixa_id)
             db.session.commit()
+            esquecer_idempotencia(Delivery, delivery.chave_idempotencia)
             flash('✅ Delivery removido com sucesso!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -2417,6 +3610,7 @@ def admin_deletar_despesa_completa(despesa_id):
         despesa = db.session.get(Despesa, despesa_id)
         if despesa:
             db.session.delete(despesa)
+            _atualizar_agregados_caixa(despesa.caixa_id)
             db.session.commit()
             flash('✅ Despesa removida com sucesso!', 'success')
     except Exception as e:
@@ -2538,6 +3732,7 @@ def admin_toggle_forma_pagamento(forma_id):
     forma = db.session.get(FormaPagamento, forma_id)
     if forma:
         forma.ativo = not forma.ativo
+        _invalidar_cadastros()
         db.session.commit()
         flash(f'Forma de pagamento "{forma.nome}" atualizada!', 'success')
     return redirect(url_for('configuracoes'))
@@ -2549,9 +3744,21 @@ def admin_editar_forma_pagamento(forma_id):
     try:
         forma = db.session.get(FormaPagamento, forma_id)
         if forma:
+            classificacao = request.form.get('classificacao', forma.classificacao)
+            if classificacao not in dict(CLASSIFICACOES_FORMA_PAGAMENTO):
+                classificacao = _classificar_forma_pagamento(request.form.get('nome'))
+            reclassificar = classificacao != forma.classificacao
+            # Os pagamentos já lançados nesses caixas mudam de grupo nos totais
+            afetados = _caixas_com_forma_pagamento(forma.id) if reclassificar else []
             forma.nome = request.form.get('nome')
+            forma.classificacao = classificacao
             forma.ativo = 'ativo' in request.form
+            _invalidar_cadastros()
             db.session.commit()
+            if reclassificar:
+                _recalcular_totais_caixas(afetados)
+                _reclassificar_resumos()
+                db.session.commit()
             flash('Forma de pagamento atualizada!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -2565,7 +3772,12 @@ def admin_deletar_forma_pagamento(forma_id):
     try:
         forma = db.session.get(FormaPagamento, forma_id)
         if forma:
+            afetados = _caixas_com_forma_pagamento(forma.id)
             db.session.delete(forma)
+            _invalidar_cadastros()
+            db.session.commit()
+            _recalcular_totais_caixas(afetados)
+            _reclassificar_resumos()
             db.session.commit()
             flash('Forma de pagamento excluída!', 'success')
     except Exception as e:
@@ -2582,6 +3794,7 @@ def admin_toggle_bandeira(bandeira_id):
     bandeira = db.session.get(BandeiraCartao, bandeira_id)
     if bandeira:
         bandeira.ativo = not bandeira.ativo
+        _invalidar_cadastros()
         db.session.commit()
         flash(f'Bandeira "{bandeira.nome}" atualizada!', 'success')
     return redirect(url_for('configuracoes'))
@@ -2595,6 +3808,7 @@ def admin_editar_bandeira(bandeira_id):
         if bandeira:
             bandeira.nome = request.form.get('nome')
             bandeira.ativo = 'ativo' in request.form
+            _invalidar_cadastros()
             db.session.commit()
             flash('Bandeira atualizada!', 'success')
     except Exception as e:
@@ -2610,6 +3824,7 @@ def admin_deletar_bandeira(bandeira_id):
         bandeira = db.session.get(BandeiraCartao, bandeira_id)
         if bandeira:
             db.session.delete(bandeira)
+            _invalidar_cadastros()
             db.session.commit()
             flash('Bandeira excluída!', 'success')
     except Exception as e:
@@ -2626,6 +3841,7 @@ def admin_toggle_categoria(categoria_id):
     categoria = db.session.get(CategoriaDespesa, categoria_id)
     if categoria:
         categoria.ativo = not categoria.ativo
+        _invalidar_cadastros()
         db.session.commit()
         flash(f'Categoria "{categoria.nome}" atualizada!', 'success')
     return redirect(url_for('configuracoes'))
@@ -2640,6 +3856,7 @@ def admin_editar_categoria(categoria_id):
             categoria.nome = request.form.get('nome')
             categoria.tipo = request.form.get('tipo')
             categoria.ativo = 'ativo' in request.form
+            _invalidar_cadastros()
             db.session.commit()
             flash('Categoria atualizada!', 'success')
     except Exception as e:
@@ -2655,6 +3872,7 @@ def admin_deletar_categoria(categoria_id):
         categoria = db.session.get(CategoriaDespesa, categoria_id)
         if categoria:
             db.session.delete(categoria)
+            _invalidar_cadastros()
             db.session.commit()
             flash('Categoria excluída!', 'success')
     except Exception as e:
@@ -2671,6 +3889,7 @@ def admin_toggle_motoboy(motoboy_id):
     motoboy = db.session.get(Motoboy, motoboy_id)
     if motoboy:
         motoboy.ativo = not motoboy.ativo
+        _invalidar_cadastros()
         db.session.commit()
         flash(f'Motoboy "{motoboy.nome}" atualizado!', 'success')
     return redirect(url_for('configuracoes'))
@@ -2685,6 +3904,7 @@ def admin_editar_motoboy(motoboy_id):
             motoboy.nome = request.form.get('nome')
             motoboy.taxa_padrao = parse_moeda(request.form.get('taxa_padrao', 5.00))
             motoboy.ativo = 'ativo' in request.form
+            _invalidar_cadastros()
             db.session.commit()
             flash('Motoboy atualizado!', 'success')
     except Exception as e:
@@ -2700,6 +3920,7 @@ def admin_deletar_motoboy(motoboy_id):
         motoboy = db.session.get(Motoboy, motoboy_id)
         if motoboy:
             db.session.delete(motoboy)
+            _invalidar_cadastros()
             db.session.commit()
             flash('Motoboy excluído!', 'success')
     except Exception as e:
@@ -2781,10 +4002,12 @@ def exportar_todos_caixas():
     ])
     
     # Buscar todos os caixas
-    caixas = Caixa.query.order_by(Caixa.data.desc(), Caixa.turno).all()
+    caixas = Caixa.query.options(*opcoes_carregamento_caixa('totals_only')).order_by(
+        Caixa.data.desc(), Caixa.turno).all()
+    totais_caixas = calcular_totais_caixas(caixas)
     
     for caixa in caixas:
-        totais = calcular_totais_caixa(caixa)
+        totais = totais_caixas[caixa.id]
         
         writer.writerow([
             caixa.id,
@@ -2820,13 +4043,13 @@ def exportar_excel_caixa(caixa_id):
     from io import StringIO
     from flask import Response
     
-    caixa = db.session.get(Caixa, caixa_id)
+    caixa = carregar_caixa(caixa_id, 'full_caixa')
     if not caixa:
         flash('Caixa não encontrado!', 'danger')
         return redirect(url_for('dashboard'))
     
     # Verificar permissão (operador só pode exportar próprio caixa)
-    usuario = db.session.get(Usuario, session['user_id'])
+    usuario = permissoes_usuario()
     if not usuario.acesso_configuracoes and caixa.operador_id != usuario.id:
         flash('Você não tem permissão para exportar este caixa!', 'danger')
         return redirect(url_for('dashboard'))
@@ -3009,82 +4232,561 @@ def exportar_excel_caixa(caixa_id):
 
 # ==================== HELPER FUNCTIONS ====================
 
-def calcular_totais_caixa(caixa):
-    """Calcula todos os totais do caixa"""
-    totais = {
-        'vendas_loja': 0,
-        'vendas_delivery': 0,
-        'total_vendas': 0,
-        'dinheiro': 0,
-        'credito': 0,
-        'debito': 0,
-        'pix': 0,
-        'online': 0,
-        'notas_fiscais': 0,
-        'despesas': 0,
-        'sangrias': 0,
-        'saldo_atual': caixa.saldo_inicial
+def _classificar_forma_pagamento(nome):
+    """Sugere a classificação de uma forma de pagamento a partir do nome.
+
+    Usada apenas no cadastro (e para formas antigas sem classificação); os
+    totais leem a classificação gravada em FormaPagamento.classificacao.
+    """
+    forma = (nome or '').upper()
+    if 'DINHEIRO' in forma:
+        return 'DINHEIRO'
+    elif 'CRÉDITO' in forma or 'CREDITO' in forma:
+        return 'CREDITO'
+    elif 'DÉBITO' in forma or 'DEBITO' in forma:
+        return 'DEBITO'
+    elif 'PIX' in forma:
+        return 'PIX'
+    elif 'ONLINE' in forma:
+        return 'ONLINE'
+    elif 'ASSINADA' in forma or 'CONTA' in forma:
+        return 'CONTA_ASSINADA'
+    return 'OUTROS'
+
+# ==================== CACHE DE CADASTROS ====================
+
+# Cópias leves (somente leitura) dos cadastros para templates e agregações
+FormaRef = namedtuple('FormaRef', 'id nome ativo classificacao')
+BandeiraRef = namedtuple('BandeiraRef', 'id nome ativo')
+CategoriaRef = namedtuple('CategoriaRef', 'id nome tipo ativo')
+MotoboyRef = namedtuple('MotoboyRef', 'id nome taxa_padrao ativo')
+
+_cadastros_cache = None   # dicionário montado por _carregar_cadastros, com a chave 'versao'
+_cadastros_lock = threading.Lock()
+
+def _versao_cadastros():
+    """Versão atual dos cadastros no banco (lida uma vez por requisição)"""
+    if has_request_context() and '_versao_cadastros' in g:
+        return g._versao_cadastros
+    versao = db.session.query(VersaoCache.versao).filter_by(nome='cadastros').scalar() or 0
+    if has_request_context():
+        g._versao_cadastros = versao
+    return versao
+
+def _carregar_cadastros(versao):
+    """Lê formas, bandeiras, categorias e motoboys do banco e monta listas e mapas"""
+    formas = tuple(FormaRef(f.id, f.nome, f.ativo, f.classificacao or _classificar_forma_pagamento(f.nome))
+                   for f in FormaPagamento.query.order_by(FormaPagamento.id))
+    bandeiras = tuple(BandeiraRef(b.id, b.nome, b.ativo)
+                      for b in BandeiraCartao.query.order_by(BandeiraCartao.id))
+    categorias = tuple(CategoriaRef(c.id, c.nome, c.tipo, c.ativo)
+                       for c in CategoriaDespesa.query.order_by(CategoriaDespesa.id))
+    motoboys = tuple(MotoboyRef(m.id, m.nome, m.taxa_padrao, m.ativo)
+                     for m in Motoboy.query.order_by(Motoboy.id))
+    return {
+        'versao': versao,
+        'formas': formas,
+        'formas_ativas': tuple(f for f in formas if f.ativo),
+        'bandeiras': bandeiras,
+        'bandeiras_ativas': tuple(b for b in bandeiras if b.ativo),
+        'categorias': categorias,
+        'categorias_ativas': tuple(c for c in categorias if c.ativo),
+        'motoboys': motoboys,
+        'motoboys_ativos': tuple(m for m in motoboys if m.ativo),
+        'nomes_formas': {f.id: f.nome for f in formas},
+        'nomes_bandeiras': {b.id: b.nome for b in bandeiras},
+        'nomes_categorias': {c.id: c.nome for c in categorias},
+        'nomes_motoboys': {m.id: m.nome for m in motoboys},
+        'classificacao_formas': {f.id: f.classificacao for f in formas},
+    }
+
+def cadastros():
+    """Cadastros de referência em memória, recarregados quando a versão no banco muda.
+
+    Cada worker mantém a sua cópia; a versão fica em versao_cache e é conferida
+    uma vez por requisição, então uma edição em um worker vale para todos na
+    requisição seguinte. Os itens são somente leitura.
+    """
+    global _cadastros_cache
+    versao = _versao_cadastros()
+    atual = _cadastros_cache
+    if atual is not None and atual['versao'] == versao:
+        return atual
+    dados = _carregar_cadastros(versao)
+    # Alterações ainda não confirmadas nesta requisição não entram no cache do processo
+    if not (has_request_context() and g.get('_cadastros_alterados')):
+        with _cadastros_lock:
+            _cadastros_cache = dados
+    return dados
+
+def _invalidar_cadastros():
+    """Incrementa a versão dos cadastros; chamar antes do commit de qualquer alteração"""
+    _incrementar_contador(VersaoCache, 'nome', 'cadastros', 'versao')
+    if has_request_context():
+        g.pop('_versao_cadastros', None)
+        g._cadastros_alterados = True
+
+def mapa_classificacao_formas():
+    """Retorna {forma_pagamento_id: classificacao} a partir do cache de cadastros"""
+    return cadastros()['classificacao_formas']
+
+def _preencher_classificacao_formas():
+    """Grava a classificação sugerida nas formas de pagamento que ainda não têm uma"""
+    pendentes = FormaPagamento.query.filter(FormaPagamento.classificacao.is_(None)).all()
+    for forma in pendentes:
+        forma.classificacao = _classificar_forma_pagamento(forma.nome)
+    if pendentes:
+        _invalidar_cadastros()
+        db.session.commit()
+
+# ==================== PERFIS DE CARREGAMENTO ====================
+
+def opcoes_carregamento_caixa(perfil):
+    """Opções de carregamento (eager loading) do caixa por perfil de uso.
+
+    full_caixa: o turno inteiro - vendas e deliveries com pagamentos, forma,
+        bandeira e motoboy, despesas com categoria, sangrias e suprimentos.
+        Um número fixo de consultas (uma por coleção), independente do volume.
+    totals_only: só o operador; os totais vêm de caixa_totais ou do snapshot.
+    """
+    if perfil == 'full_caixa':
+        return [
+            joinedload(Caixa.operador),
+            selectinload(Caixa.vendas).selectinload(Venda.pagamentos).options(
+                joinedload(PagamentoVenda.forma_pagamento), joinedload(PagamentoVenda.bandeira)),
+            selectinload(Caixa.deliveries).options(
+                joinedload(Delivery.motoboy),
+                selectinload(Delivery.pagamentos).options(
+                    joinedload(PagamentoDelivery.forma_pagamento), joinedload(PagamentoDelivery.bandeira))),
+            selectinload(Caixa.despesas).options(
+                joinedload(Despesa.categoria), joinedload(Despesa.forma_pagamento)),
+            selectinload(Caixa.sangrias),
+            selectinload(Caixa.suprimentos),
+        ]
+    if perfil == 'totals_only':
+        return [joinedload(Caixa.operador)]
+    raise ValueError(f'Perfil de carregamento desconhecido: {perfil}')
+
+def carregar_caixa(caixa_id, perfil='totals_only'):
+    """Busca o caixa já com os relacionamentos do perfil carregados"""
+    return Caixa.query.options(*opcoes_carregamento_caixa(perfil)).filter_by(id=caixa_id).first()
+
+# ==================== PAGINAÇÃO POR CHAVE (CAIXAS) ====================
+
+PaginaCaixas = namedtuple('PaginaCaixas', 'items proxima anterior total')
+
+def _codificar_cursor(valores):
+    """Token opaco (base64 de JSON) com os valores da chave de ordenação"""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+def _decodificar_cursor(token):
+    """Lista de valores de _codificar_cursor"""
+    return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+def _cursor_caixa(caixa):
+    """Token da posição do caixa na ordem (data, hora_abertura, id)"""
+    return _codificar_cursor([caixa.data.isoformat(), caixa.hora_abertura.isoformat(), caixa.id])
+
+def _ler_cursor_caixa(token):
+    """Decodifica o token de _cursor_caixa; ValueError se for inválido"""
+    try:
+        data, hora, caixa_id = _decodificar_cursor(token)
+        return date.fromisoformat(data), datetime.fromisoformat(hora), int(caixa_id)
+    except Exception as e:
+        raise ValueError('Página inválida') from e
+
+def filtrar_caixas(query, status=None, turno=None, operador_id=None):
+    """Aplica os filtros de listagem (valores vazios ou 'all' são ignorados)"""
+    if status and status != 'all':
+        query = query.filter(Caixa.status == status.upper())
+    if turno and turno != 'all':
+        query = query.filter(Caixa.turno == turno)
+    if operador_id:
+        query = query.filter(Caixa.operador_id == operador_id)
+    return query
+
+def paginar_caixas(query, depois=None, antes=None, por_pagina=20, contar=False):
+    """Página de caixas do mais recente ao mais antigo, sem OFFSET.
+
+    A posição vem do token do último item (depois) ou do primeiro (antes), e a
+    consulta continua a partir dele com uma comparação de tupla, então o custo
+    não cresce com a profundidade. O total só é contado se contar=True.
+    """
+    chave = tuple_(Caixa.data, Caixa.hora_abertura, Caixa.id)
+    total = query.order_by(None).count() if contar else None
+    if antes:
+        # Volta uma página: ordem crescente a partir do primeiro item e depois inverte
+        linhas = query.filter(chave > tuple_(*_ler_cursor_caixa(antes))).order_by(
+            Caixa.data.asc(), Caixa.hora_abertura.asc(), Caixa.id.asc()).limit(por_pagina + 1).all()
+        tem_mais = len(linhas) > por_pagina
+        items = list(reversed(linhas[:por_pagina]))
+        tem_anterior, tem_proxima = tem_mais, True
+    else:
+        if depois:
+            query = query.filter(chave < tuple_(*_ler_cursor_caixa(depois)))
+        linhas = query.order_by(
+            Caixa.data.desc(), Caixa.hora_abertura.desc(), Caixa.id.desc()).limit(por_pagina + 1).all()
+        items = linhas[:por_pagina]
+        tem_anterior, tem_proxima = bool(depois), len(linhas) > por_pagina
+    return PaginaCaixas(
+        items=items,
+        proxima=_cursor_caixa(items[-1]) if items and tem_proxima else None,
+        anterior=_cursor_caixa(items[0]) if items and tem_anterior else None,
+        total=total,
+    )
+
+# ==================== EXCLUSÃO DE CAIXAS ====================
+
+def excluir_caixas(*criterios):
+    """Exclui os caixas que atendem aos critérios e todos os seus registros.
+
+    Um DELETE por tabela, com os ids dos caixas em subconsulta, dentro da
+    transação da rota (não faz commit). Os filhos são apagados explicitamente,
+    então funciona também em bancos sem ON DELETE CASCADE.
+    Retorna {tabela: linhas excluídas}.
+    """
+    ids_caixas = db.select(Caixa.id).where(*criterios)
+    ids_vendas = db.select(Venda.id).where(Venda.caixa_id.in_(ids_caixas))
+    ids_deliveries = db.select(Delivery.id).where(Delivery.caixa_id.in_(ids_caixas))
+    
+    # Dashboard e relatórios em cache precisam saber que essas datas mudaram
+    for (data_caixa,) in db.session.query(Caixa.data).filter(*criterios).distinct():
+        _incrementar_geracao_data(data_caixa)
+    
+    comandos = [
+        (PagamentoVenda, PagamentoVenda.venda_id.in_(ids_vendas)),
+        (PagamentoDelivery, PagamentoDelivery.delivery_id.in_(ids_deliveries)),
+        (Venda, Venda.caixa_id.in_(ids_caixas)),
+        (Delivery, Delivery.caixa_id.in_(ids_caixas)),
+        (Despesa, Despesa.caixa_id.in_(ids_caixas)),
+        (Sangria, Sangria.caixa_id.in_(ids_caixas)),
+        (Suprimento, Suprimento.caixa_id.in_(ids_caixas)),
+        (CaixaTotais, CaixaTotais.caixa_id.in_(ids_caixas)),
+        (ResumoDiario, ResumoDiario.caixa_id.in_(ids_caixas)),
+    ]
+    contagem = {}
+    for modelo, condicao in comandos:
+        resultado = db.session.execute(db.delete(modelo).where(condicao),
+                                       execution_options={'synchronize_session': False})
+        contagem[modelo.__tablename__] = resultado.rowcount
+    resultado = db.session.execute(db.delete(Caixa).where(*criterios),
+                                   execution_options={'synchronize_session': False})
+    contagem[Caixa.__tablename__] = resultado.rowcount
+    return contagem
+
+def _resumo_exclusao(contagem):
+    """Texto 'tabela: n' das tabelas com linhas excluídas"""
+    return ', '.join(f'{tabela}: {linhas}' for tabela, linhas in contagem.items() if linhas)
+
+# ==================== LISTAS DO PDV (MOVIMENTOS DO CAIXA) ====================
+
+# Linhas renderizadas com a página; as anteriores vêm de /api/movimentos conforme a rolagem
+MOVIMENTOS_POR_PAGINA = int(os.environ.get('PDV_LINHAS_POR_PAGINA', 30))
+
+# tipo -> (modelo, relacionamentos usados pela linha da lista)
+MOVIMENTOS_PDV = {
+    'vendas': (Venda, lambda: [
+        selectinload(Venda.pagamentos).joinedload(PagamentoVenda.forma_pagamento)]),
+    'delivery': (Delivery, lambda: [joinedload(Delivery.motoboy)]),
+    'despesas': (Despesa, lambda: [joinedload(Despesa.categoria), joinedload(Despesa.forma_pagamento)]),
+    'sangrias': (Sangria, lambda: []),
+    'suprimentos': (Suprimento, lambda: []),
+}
+
+# tipo -> endpoint da página da lista (destino do redirect dos lançamentos)
+PAGINAS_MOVIMENTOS = {
+    'vendas': 'vendas',
+    'delivery': 'delivery',
+    'despesas': 'despesas',
+    'sangrias': 'sangria',
+    'suprimentos': 'suprimentos',
+}
+
+PaginaMovimentos = namedtuple('PaginaMovimentos', 'items proxima')
+
+def pagina_movimentos(tipo, caixa_id, depois=None, por_pagina=None):
+    """Movimentos do caixa do mais recente ao mais antigo, por (data_hora, id).
+
+    depois é o token do último item da página anterior; ValueError se for inválido.
+    """
+    modelo, opcoes = MOVIMENTOS_PDV[tipo]
+    por_pagina = por_pagina or MOVIMENTOS_POR_PAGINA
+    query = modelo.query.options(*opcoes()).filter(modelo.caixa_id == caixa_id)
+    if depois:
+        try:
+            data_hora, item_id = _decodificar_cursor(depois)
+            posicao = (datetime.fromisoformat(data_hora), int(item_id))
+        except Exception as e:
+            raise ValueError('Página inválida') from e
+        query = query.filter(tuple_(modelo.data_hora, modelo.id) < tuple_(*posicao))
+    linhas = query.order_by(modelo.data_hora.desc(), modelo.id.desc()).limit(por_pagina + 1).all()
+    items = linhas[:por_pagina]
+    proxima = None
+    if len(linhas) > por_pagina:
+        proxima = _codificar_cursor([items[-1].data_hora.isoformat(), items[-1].id])
+    return PaginaMovimentos(items=items, proxima=proxima)
+
+def quer_json():
+    """Envio feito por fetch na página (Accept: application/json), que espera JSON em vez de redirect"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def resposta_movimento(tipo, registro, mensagem):
+    """Resposta de um lançamento do PDV gravado.
+
+    Formulário comum: flash e redirect para a lista. Via fetch: JSON com a
+    linha já renderizada e os totais novos, para a página atualizar a tabela
+    e os cards sem recarregar.
+    """
+    if not quer_json():
+        flash(mensagem, 'success')
+        return redirect(url_for(PAGINAS_MOVIMENTOS[tipo]))
+    caixa = db.session.get(Caixa, registro.caixa_id)
+    dados = {
+        'ok': True,
+        'mensagem': mensagem,
+        'id': registro.id,
+        'html': render_template('movimentos_linhas.html', tipo=tipo, itens=[registro]),
+        'totais': calcular_totais_caixa(caixa),
+        # O formulário continua na tela; o próximo envio precisa de chave nova
+        'chave_idempotencia': uuid.uuid4().hex,
     }
+    if tipo == 'delivery':
+        totais_delivery = calcular_totais_delivery(caixa)
+        quantidade = totais_delivery['quantidade_pedidos']
+        totais_delivery['ticket_medio'] = round(totais_delivery['total_delivery'] / quantidade, 2) if quantidade else 0
+        dados['totais_delivery'] = totais_delivery
+    return jsonify(dados)
+
+def erro_movimento(tipo, mensagem):
+    """Lançamento do PDV recusado: flash e redirect, ou JSON 400 com a mensagem"""
+    if not quer_json():
+        flash(mensagem, 'danger')
+        return redirect(url_for(PAGINAS_MOVIMENTOS[tipo]))
+    return jsonify({'ok': False, 'erro': mensagem}), 400
+
+def _agregar_totais_caixas(caixas):
+    """Calcula os totais de vários caixas com um número fixo de consultas GROUP BY.
+
+    Substitui a navegação caixa.vendas -> venda.pagamentos -> pagamento.forma_pagamento,
+    que gerava uma consulta por venda/pagamento. Retorna {caixa_id: totais}.
+    """
+    resultado = {}
+    for caixa in caixas:
+        resultado[caixa.id] = {
+            'vendas_loja': 0,
+            'vendas_delivery': 0,
+            'total_vendas': 0,
+            'dinheiro': 0,
+            'credito': 0,
+            'debito': 0,
+            'pix': 0,
+            'online': 0,
+            'notas_fiscais': 0,
+            'despesas': 0,
+            'sangrias': 0,
+            'saldo_atual': caixa.saldo_inicial
+        }
+    if not resultado:
+        return resultado
+    caixa_ids = list(resultado.keys())
     
-    # Vendas
-    for venda in caixa.vendas:
-        totais['vendas_loja'] += venda.total
-        if venda.emitiu_nota:
-            totais['notas_fiscais'] += venda.total
-        
-        for pagamento in venda.pagamentos:
-            if not pagamento.forma_pagamento:
-                # Forma de pagamento removida do cadastro
-                continue
-            forma = pagamento.forma_pagamento.nome.upper()
-            if 'DINHEIRO' in forma:
-                totais['dinheiro'] += pagamento.valor
-            elif 'CRÉDITO' in forma or 'CREDITO' in forma:
-                totais['credito'] += pagamento.valor
-            elif 'DÉBITO' in forma or 'DEBITO' in forma:
-                totais['debito'] += pagamento.valor
-            elif 'PIX' in forma:
-                totais['pix'] += pagamento.valor
-            elif 'ONLINE' in forma:
-                totais['online'] += pagamento.valor
-    
-    # Delivery
-    for delivery in caixa.deliveries:
-        totais['vendas_delivery'] += delivery.total + delivery.taxa_entrega
-        if delivery.emitiu_nota:
-            totais['notas_fiscais'] += delivery.total + delivery.taxa_entrega
-        
-        for pagamento in delivery.pagamentos:
-            if not pagamento.forma_pagamento:
-                # Forma de pagamento removida do cadastro
-                continue
-            forma = pagamento.forma_pagamento.nome.upper()
-            if 'DINHEIRO' in forma:
-                totais['dinheiro'] += pagamento.valor
-            elif 'CRÉDITO' in forma or 'CREDITO' in forma:
-                totais['credito'] += pagamento.valor
-            elif 'DÉBITO' in forma or 'DEBITO' in forma:
-                totais['debito'] += pagamento.valor
-            elif 'PIX' in forma:
-                totais['pix'] += pagamento.valor
-            elif 'ONLINE' in forma:
-                totais['online'] += pagamento.valor
+    # Vendas (mesa/balcão)
+    vendas = db.session.query(
+        Venda.caixa_id,
+        func.sum(Venda.total),
+        func.sum(case((Venda.emitiu_nota.is_(True), Venda.total), else_=0))
+    ).filter(Venda.caixa_id.in_(caixa_ids)).group_by(Venda.caixa_id)
+    for caixa_id, total, notas in vendas:
+        resultado[caixa_id]['vendas_loja'] += total or 0
+        resultado[caixa_id]['notas_fiscais'] += notas or 0
+    
+    # Delivery (pedido + taxa de entrega)
+    total_delivery = Delivery.total + func.coalesce(Delivery.taxa_entrega, 0)
+    deliveries = db.session.query(
+        Delivery.caixa_id,
+        func.sum(total_delivery),
+        func.sum(case((Delivery.emitiu_nota.is_(True), total_delivery), else_=0))
+    ).filter(Delivery.caixa_id.in_(caixa_ids)).group_by(Delivery.caixa_id)
+    for caixa_id, total, notas in deliveries:
+        resultado[caixa_id]['vendas_delivery'] += total or 0
+        resultado[caixa_id]['notas_fiscais'] += notas or 0
+    
+    # Pagamentos por forma (formas removidas do cadastro não entram no mapa e são ignoradas)
+    classificacoes = mapa_classificacao_formas()
+    pagamentos_venda = db.session.query(
+        Venda.caixa_id, PagamentoVenda.forma_pagamento_id, func.sum(PagamentoVenda.valor)
+    ).join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id
+    ).filter(Venda.caixa_id.in_(caixa_ids)
+    ).group_by(Venda.caixa_id, PagamentoVenda.forma_pagamento_id)
+    pagamentos_delivery = db.session.query(
+        Delivery.caixa_id, PagamentoDelivery.forma_pagamento_id, func.sum(PagamentoDelivery.valor)
+    ).join(PagamentoDelivery, PagamentoDelivery.delivery_id == Delivery.id
+    ).filter(Delivery.caixa_id.in_(caixa_ids)
+    ).group_by(Delivery.caixa_id, PagamentoDelivery.forma_pagamento_id)
+    for consulta in (pagamentos_venda, pagamentos_delivery):
+        for caixa_id, forma_id, valor in consulta:
+            chave = CHAVE_TOTAIS_CLASSIFICACAO.get(classificacoes.get(forma_id))
+            if chave:
+                resultado[caixa_id][chave] += valor or 0
     
     # Despesas
-    for despesa in caixa.despesas:
-        totais['despesas'] += despesa.valor
+    despesas = db.session.query(Despesa.caixa_id, func.sum(Despesa.valor)
+    ).filter(Despesa.caixa_id.in_(caixa_ids)).group_by(Despesa.caixa_id)
+    for caixa_id, valor in despesas:
+        resultado[caixa_id]['despesas'] += valor or 0
     
     # Sangrias
-    for sangria in caixa.sangrias:
-        totais['sangrias'] += sangria.valor
+    sangrias = db.session.query(Sangria.caixa_id, func.sum(Sangria.valor)
+    ).filter(Sangria.caixa_id.in_(caixa_ids)).group_by(Sangria.caixa_id)
+    for caixa_id, valor in sangrias:
+        resultado[caixa_id]['sangrias'] += valor or 0
     
-    totais['total_vendas'] = totais['vendas_loja'] + totais['vendas_delivery']
-    totais['saldo_atual'] = caixa.saldo_inicial + totais['total_vendas'] + totais.get('suprimentos', 0) - totais['despesas'] - totais['sangrias']
+    for caixa in caixas:
+        totais = resultado[caixa.id]
+        totais['total_vendas'] = totais['vendas_loja'] + totais['vendas_delivery']
+        totais['saldo_atual'] = caixa.saldo_inicial + totais['total_vendas'] + totais.get('suprimentos', 0) - totais['despesas'] - totais['sangrias']
     
+    return resultado
+
+def _totais_de_linha(caixa, linha):
+    """Monta o dicionário de totais a partir da linha de caixa_totais"""
+    totais = {campo: getattr(linha, campo) or 0 for campo in CAMPOS_TOTAIS_CAIXA}
+    totais['total_vendas'] = totais['vendas_loja'] + totais['vendas_delivery']
+    totais['saldo_atual'] = caixa.saldo_inicial + totais['total_vendas'] - totais['despesas'] - totais['sangrias']
+    return totais
+
+def calcular_totais_caixa(caixa):
+    """Calcula todos os totais do caixa.
+
+    Lê a linha de caixa_totais (mantida a cada movimento); caixas antigos sem
+    linha são agregados direto dos registros.
+    """
+    linha = db.session.get(CaixaTotais, caixa.id)
+    if linha is None:
+        return _agregar_totais_caixas([caixa])[caixa.id]
+    return _totais_de_linha(caixa, linha)
+
+def calcular_totais_caixas(caixas):
+    """Totais de vários caixas de uma vez: {caixa_id: totais}.
+
+    Uma consulta em caixa_totais por lote de 500 caixas; os que não têm linha
+    são agregados juntos por _agregar_totais_caixas.
+    """
+    totais = {}
+    for inicio in range(0, len(caixas), 500):
+        lote = caixas[inicio:inicio + 500]
+        linhas = {linha.caixa_id: linha for linha in CaixaTotais.query.filter(
+            CaixaTotais.caixa_id.in_([caixa.id for caixa in lote]))}
+        sem_linha = []
+        for caixa in lote:
+            linha = linhas.get(caixa.id)
+            if linha is None:
+                sem_linha.append(caixa)
+            else:
+                totais[caixa.id] = _totais_de_linha(caixa, linha)
+        if sem_linha:
+            totais.update(_agregar_totais_caixas(sem_linha))
     return totais
 
+def _deltas_pagamentos(pagamentos):
+    """Soma os pagamentos por chave de totais (dinheiro, credito, ...)"""
+    deltas = {}
+    classificacoes = mapa_classificacao_formas()
+    for pagamento in pagamentos:
+        chave = CHAVE_TOTAIS_CLASSIFICACAO.get(classificacoes.get(pagamento.forma_pagamento_id))
+        if chave:
+            deltas[chave] = deltas.get(chave, 0) + pagamento.valor
+    return deltas
+
+def _recalcular_totais_caixa(caixa):
+    """Regrava a linha de caixa_totais a partir dos registros do caixa"""
+    totais = _agregar_totais_caixas([caixa])[caixa.id]
+    linha = db.session.get(CaixaTotais, caixa.id)
+    if linha is None:
+        linha = CaixaTotais(caixa_id=caixa.id)
+        db.session.add(linha)
+    for campo in CAMPOS_TOTAIS_CAIXA:
+        setattr(linha, campo, totais[campo])
+    return linha
+
+def _aplicar_delta_totais(caixa_id, **deltas):
+    """Soma os valores de um novo movimento à linha de caixa_totais.
+
+    O UPDATE é relativo (coluna = coluna + delta), então inserções simultâneas
+    no mesmo caixa não perdem atualização. Se o caixa ainda não tem linha, ela
+    é criada a partir dos registros (que já incluem o movimento pendente).
+    """
+    valores = {getattr(CaixaTotais, campo): getattr(CaixaTotais, campo) + valor
+               for campo, valor in deltas.items() if valor}
+    if valores:
+        resultado = db.session.execute(
+            update(CaixaTotais).where(CaixaTotais.caixa_id == caixa_id).values(valores)
+        )
+        if resultado.rowcount:
+            return
+    elif db.session.get(CaixaTotais, caixa_id) is not None:
+        return
+    caixa = db.session.get(Caixa, caixa_id)
+    if caixa:
+        _recalcular_totais_caixa(caixa)
+
+def _atualizar_agregados_caixa(caixa_id):
+    """Recalcula os agregados persistidos do caixa após edição ou exclusão administrativa"""
+    caixa = db.session.get(Caixa, caixa_id)
+    if caixa:
+        _recalcular_totais_caixa(caixa)
+        _incrementar_geracao_data(caixa.data)
+        if caixa.status == 'FECHADO':
+            _congelar_totais_caixa(caixa)
+            _gravar_resumo_caixa(caixa)
+
+def _caixas_com_forma_pagamento(forma_id):
+    """Ids dos caixas com pagamentos de venda ou delivery lançados na forma de pagamento"""
+    vendas = db.session.query(Venda.caixa_id).join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id
+    ).filter(PagamentoVenda.forma_pagamento_id == forma_id)
+    deliveries = db.session.query(Delivery.caixa_id).join(PagamentoDelivery, PagamentoDelivery.delivery_id == Delivery.id
+    ).filter(PagamentoDelivery.forma_pagamento_id == forma_id)
+    return [caixa_id for (caixa_id,) in vendas.union(deliveries)]
+
+def _recalcular_totais_caixas(caixa_ids):
+    """Recalcula caixa_totais dos caixas (e recongela os fechados) após reclassificar ou excluir uma forma de pagamento.
+
+    Chamar depois do commit da forma, para o cache de cadastros já trazer a classificação nova.
+    """
+    for caixa_id in caixa_ids:
+        _atualizar_agregados_caixa(caixa_id)
+
+def reconstruir_totais_caixas(corrigir=True):
+    """Recalcula caixa_totais a partir dos registros e retorna as divergências encontradas"""
+    divergencias = []
+    caixas = Caixa.query.order_by(Caixa.id).all()
+    for inicio in range(0, len(caixas), 200):
+        lote = caixas[inicio:inicio + 200]
+        agregados = _agregar_totais_caixas(lote)
+        linhas = {l.caixa_id: l for l in CaixaTotais.query.filter(
+            CaixaTotais.caixa_id.in_([c.id for c in lote]))}
+        for caixa in lote:
+            linha = linhas.get(caixa.id)
+            esperado = agregados[caixa.id]
+            if linha is None:
+                divergencias.append((caixa.id, None, None, None))
+                if corrigir:
+                    linha = CaixaTotais(caixa_id=caixa.id)
+                    db.session.add(linha)
+            else:
+                for campo in CAMPOS_TOTAIS_CAIXA:
+                    atual = getattr(linha, campo) or 0
+                    if abs(atual - esperado[campo]) > 0.01:
+                        divergencias.append((caixa.id, campo, atual, esperado[campo]))
+            if corrigir:
+                for campo in CAMPOS_TOTAIS_CAIXA:
+                    setattr(linha, campo, esperado[campo])
+    if corrigir:
+        db.session.commit()
+    return divergencias
+
 def calcular_totais_delivery(caixa):
-    """Calcula totais específicos do delivery"""
+    """Calcula totais específicos do delivery (uma consulta agrupada por motoboy)"""
     totais = {
         'total_delivery': 0,
         'total_taxas': 0,
@@ -3092,16 +4794,19 @@ def calcular_totais_delivery(caixa):
         'motoboys': {}
     }
     
-    for delivery in caixa.deliveries:
-        totais['total_delivery'] += delivery.total + delivery.taxa_entrega
-        totais['total_taxas'] += delivery.taxa_entrega
-        totais['quantidade_pedidos'] += 1
-        
-        if delivery.motoboy:
-            nome = delivery.motoboy.nome
-            if nome not in totais['motoboys']:
-                totais['motoboys'][nome] = 0
-            totais['motoboys'][nome] += delivery.taxa_entrega
+    nomes_motoboys = cadastros()['nomes_motoboys']
+    linhas = db.session.query(
+        Delivery.motoboy_id, func.count(Delivery.id),
+        func.coalesce(func.sum(Delivery.total), 0), func.coalesce(func.sum(Delivery.taxa_entrega), 0)
+    ).filter(Delivery.caixa_id == caixa.id).group_by(Delivery.motoboy_id)
+    for motoboy_id, quantidade, total, taxas in linhas:
+        totais['total_delivery'] += total + taxas
+        totais['total_taxas'] += taxas
+        totais['quantidade_pedidos'] += quantidade
+        
+        nome = nomes_motoboys.get(motoboy_id)
+        if nome:
+            totais['motoboys'][nome] = totais['motoboys'].get(nome, 0) + taxas
     
     return totais
 
@@ -3110,15 +4815,290 @@ def calcular_totais_fechamento(caixa):
     totais = calcular_totais_caixa(caixa)
     
     # Adicionar informações extras para fechamento
-    totais['despesas_fixas'] = sum(d.valor for d in caixa.despesas if d.tipo == 'FIXA')
-    totais['despesas_variaveis'] = sum(d.valor for d in caixa.despesas if d.tipo == 'VARIAVEL')
-    totais['despesas_saidas'] = sum(d.valor for d in caixa.despesas if d.tipo == 'SAIDA')
+    por_tipo = dict(db.session.query(Despesa.tipo, func.sum(Despesa.valor))
+                    .filter(Despesa.caixa_id == caixa.id).group_by(Despesa.tipo).all())
+    totais['despesas_fixas'] = por_tipo.get('FIXA') or 0
+    totais['despesas_variaveis'] = por_tipo.get('VARIAVEL') or 0
+    totais['despesas_saidas'] = por_tipo.get('SAIDA') or 0
     totais['saldo_final'] = totais['saldo_atual']
     
     return totais
 
-def calcular_metricas_dashboard(caixas):
-    """Calcula métricas para o dashboard - CORRIGIDO"""
+# Formato do snapshot; incrementar quando calcular_totais_fechamento mudar de chaves
+VERSAO_SNAPSHOT_TOTAIS = 1
+
+def _congelar_totais_caixa(caixa, totais=None):
+    """Grava no caixa os totais de fechamento (JSON + sha256 + versão do formato)"""
+    if totais is None:
+        totais = calcular_totais_fechamento(caixa)
+    conteudo = json.dumps(totais, sort_keys=True)
+    caixa.totais_snapshot = conteudo
+    caixa.totais_snapshot_hash = hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+    caixa.totais_snapshot_versao = VERSAO_SNAPSHOT_TOTAIS
+
+def _descongelar_totais_caixa(caixa):
+    """Descarta o snapshot (caixa reaberto volta a ser calculado ao vivo)"""
+    caixa.totais_snapshot = None
+    caixa.totais_snapshot_hash = None
+    caixa.totais_snapshot_versao = None
+
+def totais_caixa_fechamento(caixa):
+    """Totais de fechamento do caixa: snapshot se fechado e íntegro, senão calculados"""
+    conteudo = caixa.totais_snapshot
+    if (caixa.status == 'FECHADO' and conteudo
+            and caixa.totais_snapshot_versao == VERSAO_SNAPSHOT_TOTAIS
+            and caixa.totais_snapshot_hash == hashlib.sha256(conteudo.encode('utf-8')).hexdigest()):
+        return json.loads(conteudo)
+    return calcular_totais_fechamento(caixa)
+
+def _normalizar_turno(turno):
+    """Agrupa o nome do turno em MANHÃ, TARDE ou NOITE"""
+    if not turno:
+        return 'MANHÃ'
+    t = str(turno).upper()
+    if 'MANH' in t:
+        return 'MANHÃ'
+    if 'TARDE' in t:
+        return 'TARDE'
+    if 'NOITE' in t:
+        return 'NOITE'
+    return 'MANHÃ'
+
+def _parcial_vazio():
+    """Estrutura dos agregados de um caixa usada pelas métricas do dashboard"""
+    return {
+        'vendas_tipo': {},          # tipo -> [total, quantidade]
+        'delivery_total': 0,
+        'delivery_count': 0,
+        'notas_fiscais': 0,
+        'formas_pagamento': {},     # forma_pagamento_id -> valor
+        'despesas_tipo': {},        # FIXA/VARIAVEL/SAIDA -> valor
+        'despesas_categoria': {},   # categoria_id -> valor
+        'sangrias': 0,
+        'motoboys': {},             # motoboy_id -> [taxas, quantidade]
+    }
+
+def _agregar_movimentos_caixas(caixa_ids):
+    """Agrega os movimentos de vários caixas em uma única passada de consultas GROUP BY.
+
+    O número de consultas é fixo (seis), independente de quantos caixas, vendas
+    ou pagamentos existam no período. Retorna {caixa_id: parcial}.
+    """
+    parciais = {caixa_id: _parcial_vazio() for caixa_id in caixa_ids}
+    if not parciais:
+        return parciais
+    caixa_ids = list(parciais.keys())
+    
+    vendas = db.session.query(
+        Venda.caixa_id, Venda.tipo, func.sum(Venda.total), func.count(Venda.id),
+        func.sum(case((Venda.emitiu_nota.is_(True), Venda.total), else_=0))
+    ).filter(Venda.caixa_id.in_(caixa_ids)).group_by(Venda.caixa_id, Venda.tipo)
+    for caixa_id, tipo, total, quantidade, notas in vendas:
+        parcial = parciais[caixa_id]
+        parcial['vendas_tipo'][tipo] = [total or 0, quantidade]
+        parcial['notas_fiscais'] += notas or 0
+    
+    total_delivery = Delivery.total + func.coalesce(Delivery.taxa_entrega, 0)
+    deliveries = db.session.query(
+        Delivery.caixa_id, Delivery.motoboy_id, func.sum(total_delivery), func.count(Delivery.id),
+        func.sum(func.coalesce(Delivery.taxa_entrega, 0)),
+        func.sum(case((Delivery.emitiu_nota.is_(True), total_delivery), else_=0))
+    ).filter(Delivery.caixa_id.in_(caixa_ids)).group_by(Delivery.caixa_id, Delivery.motoboy_id)
+    for caixa_id, motoboy_id, total, quantidade, taxas, notas in deliveries:
+        parcial = parciais[caixa_id]
+        parcial['delivery_total'] += total or 0
+        parcial['delivery_count'] += quantidade
+        parcial['notas_fiscais'] += notas or 0
+        if motoboy_id is not None:
+            parcial['motoboys'][motoboy_id] = [taxas or 0, quantidade]
+    
+    pagamentos_venda = db.session.query(
+        Venda.caixa_id, PagamentoVenda.forma_pagamento_id, func.sum(PagamentoVenda.valor)
+    ).join(PagamentoVenda, PagamentoVenda.venda_id == Venda.id
+    ).filter(Venda.caixa_id.in_(caixa_ids)
+    ).group_by(Venda.caixa_id, PagamentoVenda.forma_pagamento_id)
+    pagamentos_delivery = db.session.query(
+        Delivery.caixa_id, PagamentoDelivery.forma_pagamento_id, func.sum(PagamentoDelivery.valor)
+    ).join(PagamentoDelivery, PagamentoDelivery.delivery_id == Delivery.id
+    ).filter(Delivery.caixa_id.in_(caixa_ids)
+    ).group_by(Delivery.caixa_id, PagamentoDelivery.forma_pagamento_id)
+    for consulta in (pagamentos_venda, pagamentos_delivery):
+        for caixa_id, forma_id, valor in consulta:
+            formas = parciais[caixa_id]['formas_pagamento']
+            formas[forma_id] = formas.get(forma_id, 0) + (valor or 0)
+    
+    despesas = db.session.query(
+        Despesa.caixa_id, Despesa.tipo, Despesa.categoria_id, func.sum(Despesa.valor)
+    ).filter(Despesa.caixa_id.in_(caixa_ids)
+    ).group_by(Despesa.caixa_id, Despesa.tipo, Despesa.categoria_id)
+    for caixa_id, tipo, categoria_id, valor in despesas:
+        parcial = parciais[caixa_id]
+        parcial['despesas_tipo'][tipo] = parcial['despesas_tipo'].get(tipo, 0) + (valor or 0)
+        if categoria_id is not None:
+            categorias = parcial['despesas_categoria']
+            categorias[categoria_id] = categorias.get(categoria_id, 0) + (valor or 0)
+    
+    sangrias = db.session.query(Sangria.caixa_id, func.sum(Sangria.valor)
+    ).filter(Sangria.caixa_id.in_(caixa_ids)).group_by(Sangria.caixa_id)
+    for caixa_id, valor in sangrias:
+        parciais[caixa_id]['sangrias'] += valor or 0
+    
+    return parciais
+
+def _chaves_json(dicionario):
+    """Converte as chaves inteiras (ids) em texto para gravação em coluna JSON"""
+    return {str(chave): valor for chave, valor in dicionario.items()}
+
+def _chaves_int(dicionario):
+    """Inverso de _chaves_json"""
+    return {int(chave): valor for chave, valor in (dicionario or {}).items()}
+
+def _parcial_de_resumo(resumo):
+    """Reconstrói o parcial de agregação (ver _parcial_vazio) a partir do resumo diário"""
+    parcial = _parcial_vazio()
+    parcial['vendas_tipo'] = {tipo: list(valores) for tipo, valores in (resumo.vendas_tipo or {}).items()}
+    parcial['delivery_total'] = resumo.vendas_delivery
+    parcial['delivery_count'] = resumo.delivery_count
+    parcial['notas_fiscais'] = resumo.notas_fiscais
+    parcial['formas_pagamento'] = _chaves_int(resumo.formas_pagamento)
+    parcial['despesas_tipo'] = dict(resumo.despesas_tipo or {})
+    parcial['despesas_categoria'] = _chaves_int(resumo.despesas_categoria)
+    parcial['sangrias'] = resumo.sangrias
+    parcial['motoboys'] = {motoboy_id: list(valores) for motoboy_id, valores in _chaves_int(resumo.motoboys).items()}
+    return parcial
+
+def _classificar_resumo(resumo, classificacoes):
+    """Recalcula as colunas por classificação de pagamento a partir das formas do resumo"""
+    valores = {'dinheiro': 0, 'credito': 0, 'debito': 0, 'pix': 0, 'online': 0, 'contas_assinadas': 0}
+    for forma_id, valor in _chaves_int(resumo.formas_pagamento).items():
+        classificacao = classificacoes.get(forma_id)
+        if classificacao == 'CONTA_ASSINADA':
+            valores['contas_assinadas'] += valor
+        elif classificacao in CHAVE_TOTAIS_CLASSIFICACAO:
+            valores[CHAVE_TOTAIS_CLASSIFICACAO[classificacao]] += valor
+    for campo, valor in valores.items():
+        setattr(resumo, campo, valor)
+
+def _gravar_resumo_caixa(caixa, parcial=None):
+    """Grava (ou regrava) o resumo diário de um caixa fechado"""
+    if parcial is None:
+        parcial = _agregar_movimentos_caixas([caixa.id])[caixa.id]
+    resumo = ResumoDiario.query.filter_by(caixa_id=caixa.id).first()
+    if resumo is None:
+        resumo = ResumoDiario(caixa_id=caixa.id)
+        db.session.add(resumo)
+    despesas_tipo = parcial['despesas_tipo']
+    resumo.data = caixa.data
+    resumo.turno = caixa.turno
+    resumo.vendas_loja = sum(total for total, _ in parcial['vendas_tipo'].values())
+    resumo.vendas_count = sum(quantidade for _, quantidade in parcial['vendas_tipo'].values())
+    resumo.vendas_delivery = parcial['delivery_total']
+    resumo.delivery_count = parcial['delivery_count']
+    resumo.notas_fiscais = parcial['notas_fiscais']
+    resumo.taxas_entrega = sum(taxas for taxas, _ in parcial['motoboys'].values())
+    resumo.despesas = sum(despesas_tipo.values())
+    resumo.despesas_fixas = despesas_tipo.get('FIXA', 0)
+    resumo.despesas_variaveis = despesas_tipo.get('VARIAVEL', 0)
+    resumo.despesas_saidas = despesas_tipo.get('SAIDA', 0)
+    resumo.sangrias = parcial['sangrias']
+    resumo.vendas_tipo = dict(parcial['vendas_tipo'])
+    resumo.formas_pagamento = _chaves_json(parcial['formas_pagamento'])
+    resumo.despesas_tipo = dict(despesas_tipo)
+    resumo.despesas_categoria = _chaves_json(parcial['despesas_categoria'])
+    resumo.motoboys = _chaves_json(parcial['motoboys'])
+    resumo.atualizado_em = datetime.utcnow()
+    _classificar_resumo(resumo, mapa_classificacao_formas())
+    return resumo
+
+def _remover_resumo_caixa(caixa_id):
+    """Remove o resumo diário (caixa reaberto ou excluído volta a ser calculado ao vivo)"""
+    ResumoDiario.query.filter_by(caixa_id=caixa_id).delete()
+
+def _reclassificar_resumos():
+    """Reaplica a classificação das formas de pagamento em todos os resumos gravados"""
+    classificacoes = mapa_classificacao_formas()
+    for resumo in ResumoDiario.query.all():
+        _classificar_resumo(resumo, classificacoes)
+
+def reconstruir_resumos_diarios():
+    """Regrava o resumo diário e o snapshot de totais dos caixas fechados; retorna quantos foram gravados"""
+    fechados = Caixa.query.filter_by(status='FECHADO').order_by(Caixa.id).all()
+    for inicio in range(0, len(fechados), 200):
+        lote = fechados[inicio:inicio + 200]
+        parciais = _agregar_movimentos_caixas([c.id for c in lote])
+        for caixa in lote:
+            _congelar_totais_caixa(caixa)
+            _gravar_resumo_caixa(caixa, parciais[caixa.id])
+        db.session.commit()
+    return len(fechados)
+
+def consolidar_periodo_caixas(data_inicio, data_fim):
+    """Totais de vendas, despesas e sangrias por (data, turno) no período.
+
+    Caixas fechados são somados a partir de resumo_diario e os demais a partir
+    de caixa_totais, cada um em uma consulta agrupada; só caixas antigos sem
+    nenhuma das duas linhas são agregados a partir dos registros.
+    Retorna {(data, turno): {caixas, abertos, fechados, vendas, despesas, sangrias}}.
+    """
+    consolidado = {}
+    
+    def linha(dia, turno):
+        return consolidado.setdefault((dia, turno), {
+            'caixas': 0, 'abertos': 0, 'fechados': 0, 'vendas': 0, 'despesas': 0, 'sangrias': 0})
+    
+    no_periodo = Caixa.data.between(data_inicio, data_fim)
+    contagem = db.session.query(
+        Caixa.data, Caixa.turno, func.count(Caixa.id),
+        func.sum(case((Caixa.status == 'ABERTO', 1), else_=0)),
+        func.sum(case((Caixa.status == 'FECHADO', 1), else_=0))
+    ).filter(no_periodo).group_by(Caixa.data, Caixa.turno)
+    for dia, turno, quantidade, abertos, fechados in contagem:
+        item = linha(dia, turno)
+        item['caixas'] = quantidade
+        item['abertos'] = abertos or 0
+        item['fechados'] = fechados or 0
+    
+    resumos = db.session.query(
+        ResumoDiario.data, ResumoDiario.turno,
+        func.sum(ResumoDiario.vendas_loja + ResumoDiario.vendas_delivery),
+        func.sum(ResumoDiario.despesas), func.sum(ResumoDiario.sangrias)
+    ).filter(ResumoDiario.data.between(data_inicio, data_fim)
+    ).group_by(ResumoDiario.data, ResumoDiario.turno)
+    
+    sem_resumo = ~db.exists().where(ResumoDiario.caixa_id == Caixa.id)
+    ao_vivo = db.session.query(
+        Caixa.data, Caixa.turno,
+        func.sum(CaixaTotais.vendas_loja + CaixaTotais.vendas_delivery),
+        func.sum(CaixaTotais.despesas), func.sum(CaixaTotais.sangrias)
+    ).join(CaixaTotais, CaixaTotais.caixa_id == Caixa.id
+    ).filter(no_periodo, sem_resumo).group_by(Caixa.data, Caixa.turno)
+    
+    for consulta in (resumos, ao_vivo):
+        for dia, turno, vendas, despesas, sangrias in consulta:
+            item = linha(dia, turno)
+            item['vendas'] += vendas or 0
+            item['despesas'] += despesas or 0
+            item['sangrias'] += sangrias or 0
+    
+    antigos = {caixa.id: caixa for caixa in Caixa.query.filter(
+        no_periodo, sem_resumo,
+        ~db.exists().where(CaixaTotais.caixa_id == Caixa.id)
+    )}
+    for caixa_id, totais in _agregar_totais_caixas(list(antigos.values())).items():
+        caixa = antigos[caixa_id]
+        item = linha(caixa.data, caixa.turno)
+        item['vendas'] += totais['total_vendas']
+        item['despesas'] += totais['despesas']
+        item['sangrias'] += totais['sangrias']
+    
+    return consolidado
+
+def calcular_metricas_periodo(caixas):
+    """Calcula as métricas do dashboard e as métricas avançadas em uma única passada.
+
+    Retorna (metricas, metricas_avancadas) com as mesmas chaves usadas pelo
+    template do dashboard.
+    """
     metricas = {
         'total_receitas': 0,
         'total_despesas': 0,
@@ -3131,57 +5111,7 @@ def calcular_metricas_dashboard(caixas):
         'vendas_count': 0,
         'delivery_count': 0
     }
-    
-    for caixa in caixas:
-        totais = calcular_totais_caixa(caixa)
-        metricas['total_receitas'] += totais.get('total_vendas', 0)
-        metricas['total_despesas'] += totais.get('despesas', 0)
-        
-        # Contar transações
-        metricas['vendas_count'] += len(caixa.vendas)
-        metricas['delivery_count'] += len(caixa.deliveries)
-        metricas['total_transacoes'] = metricas['vendas_count'] + metricas['delivery_count']
-        
-        # Formas de pagamento
-        # Vendas
-        for venda in caixa.vendas:
-            for pagamento in venda.pagamentos:
-                if not pagamento.forma_pagamento:
-                    continue
-                forma = pagamento.forma_pagamento.nome
-                metricas['formas_pagamento'][forma] = metricas['formas_pagamento'].get(forma, 0) + pagamento.valor
-            
-            # Tipos de venda
-            metricas['tipos_venda'][venda.tipo] += venda.total
-        
-        # Deliveries
-        for delivery in caixa.deliveries:
-            for pagamento in delivery.pagamentos:
-                if not pagamento.forma_pagamento:
-                    continue
-                forma = pagamento.forma_pagamento.nome
-                metricas['formas_pagamento'][forma] = metricas['formas_pagamento'].get(forma, 0) + pagamento.valor
-            
-            metricas['tipos_venda']['DELIVERY'] += delivery.total + delivery.taxa_entrega
-        
-        # Despesas por categoria
-        for despesa in caixa.despesas:
-            if despesa.categoria:
-                cat = despesa.categoria.nome
-                metricas['despesas_categoria'][cat] = metricas['despesas_categoria'].get(cat, 0) + despesa.valor
-    
-    metricas['saldo_liquido'] = metricas['total_receitas'] - metricas['total_despesas']
-    metricas['ticket_medio'] = metricas['total_receitas'] / metricas['total_transacoes'] if metricas['total_transacoes'] > 0 else 0
-    try:
-        metricas['ticket_medio'] = round(float(metricas['ticket_medio']), 2)
-    except Exception:
-        metricas['ticket_medio'] = 0
-    
-    return metricas
-
-def calcular_metricas_avancadas(caixas):
-    """Calcula métricas avançadas para dashboard - CORRIGIDO"""
-    metricas = {
+    avancadas = {
         'vendas_por_turno': {'MANHÃ': 0, 'TARDE': 0, 'NOITE': 0},
         'transacoes_por_turno': {'MANHÃ': 0, 'TARDE': 0, 'NOITE': 0},
         'motoboys_taxas': {},
@@ -3205,122 +5135,119 @@ def calcular_metricas_avancadas(caixas):
         'vendas_delivery_count': 0
     }
     
+    # Caixas fechados vêm do resumo diário; os demais são agregados ao vivo
+    fechados = [caixa.id for caixa in caixas if caixa.status == 'FECHADO']
+    parciais = {}
+    if fechados:
+        for resumo in ResumoDiario.query.filter(ResumoDiario.caixa_id.in_(fechados)):
+            parciais[resumo.caixa_id] = _parcial_de_resumo(resumo)
+    parciais.update(_agregar_movimentos_caixas([caixa.id for caixa in caixas if caixa.id not in parciais]))
+    
+    # Nomes para exibição (formas/categorias/motoboys removidos do cadastro são ignorados)
+    referencia = cadastros()
+    classificacoes = referencia['classificacao_formas']
+    nomes_formas = referencia['nomes_formas']
+    nomes_categorias = referencia['nomes_categorias']
+    nomes_motoboys = referencia['nomes_motoboys']
+    
     total_vendas_mesa = 0
-    count_vendas_mesa = 0
-    total_vendas_balcao = 0
-    count_vendas_balcao = 0
     total_vendas_delivery = 0
-    count_vendas_delivery = 0
-
-    def normalizar_turno(turno):
-        if not turno:
-            return 'MANHÃ'
-        t = str(turno).upper()
-        if 'MANH' in t:
-            return 'MANHÃ'
-        if 'TARDE' in t:
-            return 'TARDE'
-        if 'NOITE' in t:
-            return 'NOITE'
-        return 'MANHÃ'
     
     for caixa in caixas:
-        turno = normalizar_turno(caixa.turno)
+        parcial = parciais[caixa.id]
+        turno = _normalizar_turno(caixa.turno)
         dia_str = caixa.data.strftime('%d/%m')
-        
-        # Inicializar dia se não existe
-        if dia_str not in metricas['vendas_por_dia']:
-            metricas['vendas_por_dia'][dia_str] = 0
-        if dia_str not in metricas['despesas_por_dia']:
-            metricas['despesas_por_dia'][dia_str] = 0
-        
-        # Vendas
-        for venda in caixa.vendas:
-            metricas['vendas_por_turno'][turno] += venda.total
-            metricas['transacoes_por_turno'][turno] += 1
-            metricas['vendas_por_dia'][dia_str] += venda.total
-            
-            if venda.emitiu_nota:
-                metricas['total_notas_fiscais'] += venda.total
-            
-            # Contar por tipo
-            if venda.tipo == 'MESA':
-                total_vendas_mesa += venda.total
-                count_vendas_mesa += 1
-                metricas['vendas_mesa_count'] += 1
-            elif venda.tipo == 'BALCAO':
-                total_vendas_balcao += venda.total
-                count_vendas_balcao += 1
-                metricas['vendas_balcao_count'] += 1
-            
-            # Contar contas assinadas
-            for pagamento in venda.pagamentos:
-                if not pagamento.forma_pagamento:
-                    continue
-                if 'ASSINADA' in pagamento.forma_pagamento.nome.upper() or 'CONTA' in pagamento.forma_pagamento.nome.upper():
-                    metricas['contas_assinadas'] += pagamento.valor
+        avancadas['vendas_por_dia'].setdefault(dia_str, 0)
+        avancadas['despesas_por_dia'].setdefault(dia_str, 0)
+        
+        # Vendas por tipo
+        vendas_total = 0
+        vendas_count = 0
+        for tipo, (total, quantidade) in parcial['vendas_tipo'].items():
+            vendas_total += total
+            vendas_count += quantidade
+            metricas['tipos_venda'][tipo] = metricas['tipos_venda'].get(tipo, 0) + total
+            if tipo == 'MESA':
+                total_vendas_mesa += total
+                avancadas['vendas_mesa_count'] += quantidade
+            elif tipo == 'BALCAO':
+                avancadas['vendas_balcao_count'] += quantidade
         
         # Delivery
-        for delivery in caixa.deliveries:
-            total = delivery.total + delivery.taxa_entrega
-            metricas['vendas_por_turno'][turno] += total
-            metricas['transacoes_por_turno'][turno] += 1
-            metricas['vendas_por_dia'][dia_str] += total
-            metricas['vendas_delivery_count'] += 1
-            
-            if delivery.emitiu_nota:
-                metricas['total_notas_fiscais'] += total
-            
-            # Ticket médio delivery
-            total_vendas_delivery += total
-            count_vendas_delivery += 1
-            
-            # Taxas por motoboy
-            if delivery.motoboy:
-                nome = delivery.motoboy.nome
-                if nome not in metricas['motoboys_taxas']:
-                    metricas['motoboys_taxas'][nome] = {'total': 0, 'quantidade': 0}
-                metricas['motoboys_taxas'][nome]['total'] += delivery.taxa_entrega
-                metricas['motoboys_taxas'][nome]['quantidade'] += 1
-            
-            # Contar contas assinadas em delivery
-            for pagamento in delivery.pagamentos:
-                if not pagamento.forma_pagamento:
-                    continue
-                if 'ASSINADA' in pagamento.forma_pagamento.nome.upper() or 'CONTA' in pagamento.forma_pagamento.nome.upper():
-                    metricas['contas_assinadas'] += pagamento.valor
-        
-        # Despesas por tipo
-        for despesa in caixa.despesas:
-            if despesa.tipo in metricas['despesas_por_tipo']:
-                metricas['despesas_por_tipo'][despesa.tipo] += despesa.valor
+        delivery_total = parcial['delivery_total']
+        delivery_count = parcial['delivery_count']
+        metricas['tipos_venda']['DELIVERY'] += delivery_total
+        total_vendas_delivery += delivery_total
+        avancadas['vendas_delivery_count'] += delivery_count
+        for motoboy_id, (taxas, quantidade) in parcial['motoboys'].items():
+            nome = nomes_motoboys.get(motoboy_id)
+            if nome is None:
+                continue
+            motoboy = avancadas['motoboys_taxas'].setdefault(nome, {'total': 0, 'quantidade': 0})
+            motoboy['total'] += taxas
+            motoboy['quantidade'] += quantidade
+        
+        receita = vendas_total + delivery_total
+        metricas['total_receitas'] += receita
+        metricas['vendas_count'] += vendas_count
+        metricas['delivery_count'] += delivery_count
+        avancadas['vendas_por_turno'][turno] += receita
+        avancadas['transacoes_por_turno'][turno] += vendas_count + delivery_count
+        avancadas['vendas_por_dia'][dia_str] += receita
+        avancadas['total_notas_fiscais'] += parcial['notas_fiscais']
         
-        # Sangrias
-        for sangria in caixa.sangrias:
-            metricas['total_sangrias'] += sangria.valor
+        # Formas de pagamento
+        for forma_id, valor in parcial['formas_pagamento'].items():
+            nome = nomes_formas.get(forma_id)
+            if nome is None:
+                continue
+            metricas['formas_pagamento'][nome] = metricas['formas_pagamento'].get(nome, 0) + valor
+            if classificacoes.get(forma_id) == 'CONTA_ASSINADA':
+                avancadas['contas_assinadas'] += valor
+        
+        # Despesas
+        for tipo, valor in parcial['despesas_tipo'].items():
+            metricas['total_despesas'] += valor
+            if tipo in avancadas['despesas_por_tipo']:
+                avancadas['despesas_por_tipo'][tipo] += valor
+        for categoria_id, valor in parcial['despesas_categoria'].items():
+            nome = nomes_categorias.get(categoria_id)
+            if nome is not None:
+                metricas['despesas_categoria'][nome] = metricas['despesas_categoria'].get(nome, 0) + valor
+        
+        avancadas['total_sangrias'] += parcial['sangrias']
     
-    # Calcular melhor e pior dia
-    if metricas['vendas_por_dia']:
-        for dia, valor in metricas['vendas_por_dia'].items():
-            if valor > metricas['melhor_dia']['valor']:
-                metricas['melhor_dia'] = {'dia': dia, 'valor': valor}
-            if valor < metricas['pior_dia']['valor']:
-                metricas['pior_dia'] = {'dia': dia, 'valor': valor}
+    # Métricas gerais
+    metricas['total_transacoes'] = metricas['vendas_count'] + metricas['delivery_count']
+    metricas['saldo_liquido'] = metricas['total_receitas'] - metricas['total_despesas']
+    metricas['ticket_medio'] = metricas['total_receitas'] / metricas['total_transacoes'] if metricas['total_transacoes'] > 0 else 0
+    try:
+        metricas['ticket_medio'] = round(float(metricas['ticket_medio']), 2)
+    except Exception:
+        metricas['ticket_medio'] = 0
     
-    # Calcular tickets médios
-    metricas['ticket_medio_mesa'] = total_vendas_mesa / count_vendas_mesa if count_vendas_mesa > 0 else 0
-    metricas['ticket_medio_delivery'] = total_vendas_delivery / count_vendas_delivery if count_vendas_delivery > 0 else 0
+    # Melhor e pior dia
+    for dia, valor in avancadas['vendas_por_dia'].items():
+        if valor > avancadas['melhor_dia']['valor']:
+            avancadas['melhor_dia'] = {'dia': dia, 'valor': valor}
+        if valor < avancadas['pior_dia']['valor']:
+            avancadas['pior_dia'] = {'dia': dia, 'valor': valor}
     
-    # Calcular métricas financeiras
-    total_receitas = sum(metricas['vendas_por_turno'].values())
-    total_despesas = sum(metricas['despesas_por_tipo'].values())
+    # Tickets médios
+    count_mesa = avancadas['vendas_mesa_count']
+    count_delivery = avancadas['vendas_delivery_count']
+    avancadas['ticket_medio_mesa'] = total_vendas_mesa / count_mesa if count_mesa > 0 else 0
+    avancadas['ticket_medio_delivery'] = total_vendas_delivery / count_delivery if count_delivery > 0 else 0
     
-    metricas['custo_operacional'] = total_despesas
-    metricas['margem_lucro'] = ((total_receitas - total_despesas) / total_receitas * 100) if total_receitas > 0 else 0
-    metricas['lucratividade'] = total_receitas - total_despesas
-    metricas['percentual_notas'] = (metricas['total_notas_fiscais'] / total_receitas * 100) if total_receitas > 0 else 0
+    # Métricas financeiras
+    total_receitas = sum(avancadas['vendas_por_turno'].values())
+    total_despesas = sum(avancadas['despesas_por_tipo'].values())
+    avancadas['custo_operacional'] = total_despesas
+    avancadas['margem_lucro'] = ((total_receitas - total_despesas) / total_receitas * 100) if total_receitas > 0 else 0
+    avancadas['lucratividade'] = total_receitas - total_despesas
+    avancadas['percentual_notas'] = (avancadas['total_notas_fiscais'] / total_receitas * 100) if total_receitas > 0 else 0
     
-    return metricas
+    return metricas, avancadas
 
 # ==================== INITIALIZE DATABASE ====================
 
@@ -3385,7 +5312,7 @@ def init_db():
             'Vale Refeição', 'Vale Alimentação', 'Cortesia'
         ]
         for forma in formas:
-            db.session.add(FormaPagamento(nome=forma))
+            db.session.add(FormaPagamento(nome=forma, classificacao=_classificar_forma_pagamento(forma)))
         
         # Criar bandeiras padrão
         bandeiras = [
@@ -3430,6 +5357,7 @@ def init_db():
         for nome in motoboys:
             db.session.add(Motoboy(nome=nome, taxa_padrao=5.00))
         
+        _invalidar_cadastros()
         db.session.commit()
         print("✅ Banco de dados inicializado com sucesso!")
 
@@ -3523,19 +5451,9 @@ def ver_chaves():
 # ==================== RUN ====================
 
 if __name__ == '__main__':
+    # Execução local: aplica as migrações antes de subir o servidor de desenvolvimento
+    executar_migracoes()
     with app.app_context():
-        db.create_all()
-        
-        # Correção automática: Adicionar coluna acesso_relatorios se não existir
-        try:
-            from sqlalchemy import text
-            with db.engine.connect() as conn:
-                conn.execute(text('ALTER TABLE usuario ADD COLUMN acesso_relatorios BOOLEAN DEFAULT 0'))
-                conn.commit()
-            print("✅ Coluna 'acesso_relatorios' adicionada automaticamente!")
-        except Exception:
-            pass  # Coluna já existe ou erro ao adicionar
-
         # Criar admin se não existir
         if not Usuario.query.filter_by(perfil='ADMIN').first():
             from werkzeug.security import generate_password_hash
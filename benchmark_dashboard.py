@@ -0,0 +1,352 @@
+"""Benchmark das métricas do dashboard em um mês sintético.
+
+Compara o par anterior (calcular_metricas_dashboard + calcular_metricas_avancadas,
+que percorriam caixa.vendas/pagamentos/deliveries duas vezes) com o motor único
+calcular_metricas_periodo. Usa um banco SQLite temporário; o banco da aplicação
+não é tocado.
+
+Uso: python benchmark_dashboard.py [--vendas-por-turno 150] [--dias 30] [--repeticoes 3]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+_BANCO = os.path.join(tempfile.mkdtemp(prefix='benchmark_caixa_'), 'benchmark.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + _BANCO
+
+from sqlalchemy import event  # noqa: E402
+
+from app import (  # noqa: E402
+    app, db, init_db, Caixa, Venda, PagamentoVenda, Delivery, PagamentoDelivery,
+    Despesa, Sangria, FormaPagamento, CategoriaDespesa, Motoboy, Usuario,
+    calcular_totais_caixa, calcular_metricas_periodo, mapa_classificacao_formas,
+    reconstruir_totais_caixas,
+)
+
+TURNOS = ['MANHÃ', 'TARDE', 'NOITE']
+
+
+def metricas_dashboard_anterior(caixas):
+    """Versão anterior de calcular_metricas_dashboard (percorre o grafo ORM)"""
+    metricas = {
+        'total_receitas': 0,
+        'total_despesas': 0,
+        'saldo_liquido': 0,
+        'ticket_medio': 0,
+        'total_transacoes': 0,
+        'formas_pagamento': {},
+        'tipos_venda': {'MESA': 0, 'BALCAO': 0, 'DELIVERY': 0},
+        'despesas_categoria': {},
+        'vendas_count': 0,
+        'delivery_count': 0
+    }
+    
+    for caixa in caixas:
+        totais = calcular_totais_caixa(caixa)
+        metricas['total_receitas'] += totais.get('total_vendas', 0)
+        metricas['total_despesas'] += totais.get('despesas', 0)
+        
+        # Contar transações
+        metricas['vendas_count'] += len(caixa.vendas)
+        metricas['delivery_count'] += len(caixa.deliveries)
+        metricas['total_transacoes'] = metricas['vendas_count'] + metricas['delivery_count']
+        
+        # Formas de pagamento
+        # Vendas
+        for venda in caixa.vendas:
+            for pagamento in venda.pagamentos:
+                if not pagamento.forma_pagamento:
+                    continue
+                forma = pagamento.forma_pagamento.nome
+                metricas['formas_pagamento'][forma] = metricas['formas_pagamento'].get(forma, 0) + pagamento.valor
+            
+            # Tipos de venda
+            metricas['tipos_venda'][venda.tipo] += venda.total
+        
+        # Deliveries
+        for delivery in caixa.deliveries:
+            for pagamento in delivery.pagamentos:
+                if not pagamento.forma_pagamento:
+                    continue
+                forma = pagamento.forma_pagamento.nome
+                metricas['formas_pagamento'][forma] = metricas['formas_pagamento'].get(forma, 0) + pagamento.valor
+            
+            metricas['tipos_venda']['DELIVERY'] += delivery.total + delivery.taxa_entrega
+        
+        # Despesas por categoria
+        for despesa in caixa.despesas:
+            if despesa.categoria:
+                cat = despesa.categoria.nome
+                metricas['despesas_categoria'][cat] = metricas['despesas_categoria'].get(cat, 0) + despesa.valor
+    
+    metricas['saldo_liquido'] = metricas['total_receitas'] - metricas['total_despesas']
+    metricas['ticket_medio'] = metricas['total_receitas'] / metricas['total_transacoes'] if metricas['total_transacoes'] > 0 else 0
+    try:
+        metricas['ticket_medio'] = round(float(metricas['ticket_medio']), 2)
+    except Exception:
+        metricas['ticket_medio'] = 0
+    
+    return metricas
+
+def metricas_avancadas_anterior(caixas):
+    """Versão anterior de calcular_metricas_avancadas (segunda passada no grafo ORM)"""
+    metricas = {
+        'vendas_por_turno': {'MANHÃ': 0, 'TARDE': 0, 'NOITE': 0},
+        'transacoes_por_turno': {'MANHÃ': 0, 'TARDE': 0, 'NOITE': 0},
+        'motoboys_taxas': {},
+        'despesas_por_tipo': {'FIXA': 0, 'VARIAVEL': 0, 'SAIDA': 0},
+        'contas_assinadas': 0,
+        'total_sangrias': 0,
+        'margem_lucro': 0,
+        'custo_operacional': 0,
+        'lucratividade': 0,
+        'vendas_por_dia': {},
+        'despesas_por_dia': {},
+        'melhor_dia': {'dia': '-', 'valor': 0},
+        'pior_dia': {'dia': '-', 'valor': 99999999},
+        'total_notas_fiscais': 0,
+        'percentual_notas': 0,
+        'ticket_medio_mesa': 0,
+        'ticket_medio_delivery': 0,
+        'total_produtos_vendidos': 0,
+        'vendas_mesa_count': 0,
+        'vendas_balcao_count': 0,
+        'vendas_delivery_count': 0
+    }
+    
+    total_vendas_mesa = 0
+    count_vendas_mesa = 0
+    total_vendas_balcao = 0
+    count_vendas_balcao = 0
+    total_vendas_delivery = 0
+    count_vendas_delivery = 0
+
+    def normalizar_turno(turno):
+        if not turno:
+            return 'MANHÃ'
+        t = str(turno).upper()
+        if 'MANH' in t:
+            return 'MANHÃ'
+        if 'TARDE' in t:
+            return 'TARDE'
+        if 'NOITE' in t:
+            return 'NOITE'
+        return 'MANHÃ'
+    
+    classificacoes = mapa_classificacao_formas()
+    
+    for caixa in caixas:
+        turno = normalizar_turno(caixa.turno)
+        dia_str = caixa.data.strftime('%d/%m')
+        
+        # Inicializar dia se não existe
+        if dia_str not in metricas['vendas_por_dia']:
+            metricas['vendas_por_dia'][dia_str] = 0
+        if dia_str not in metricas['despesas_por_dia']:
+            metricas['despesas_por_dia'][dia_str] = 0
+        
+        # Vendas
+        for venda in caixa.vendas:
+            metricas['vendas_por_turno'][turno] += venda.total
+            metricas['transacoes_por_turno'][turno] += 1
+            metricas['vendas_por_dia'][dia_str] += venda.total
+            
+            if venda.emitiu_nota:
+                metricas['total_notas_fiscais'] += venda.total
+            
+            # Contar por tipo
+            if venda.tipo == 'MESA':
+                total_vendas_mesa += venda.total
+                count_vendas_mesa += 1
+                metricas['vendas_mesa_count'] += 1
+            elif venda.tipo == 'BALCAO':
+                total_vendas_balcao += venda.total
+                count_vendas_balcao += 1
+                metricas['vendas_balcao_count'] += 1
+            
+            # Contar contas assinadas
+            for pagamento in venda.pagamentos:
+                if classificacoes.get(pagamento.forma_pagamento_id) == 'CONTA_ASSINADA':
+                    metricas['contas_assinadas'] += pagamento.valor
+        
+        # Delivery
+        for delivery in caixa.deliveries:
+            total = delivery.total + delivery.taxa_entrega
+            metricas['vendas_por_turno'][turno] += total
+            metricas['transacoes_por_turno'][turno] += 1
+            metricas['vendas_por_dia'][dia_str] += total
+            metricas['vendas_delivery_count'] += 1
+            
+            if delivery.emitiu_nota:
+                metricas['total_notas_fiscais'] += total
+            
+            # Ticket médio delivery
+            total_vendas_delivery += total
+            count_vendas_delivery += 1
+            
+            # Taxas por motoboy
+            if delivery.motoboy:
+                nome = delivery.motoboy.nome
+                if nome not in metricas['motoboys_taxas']:
+                    metricas['motoboys_taxas'][nome] = {'total': 0, 'quantidade': 0}
+                metricas['motoboys_taxas'][nome]['total'] += delivery.taxa_entrega
+                metricas['motoboys_taxas'][nome]['quantidade'] += 1
+            
+            # Contar contas assinadas em delivery
+            for pagamento in delivery.pagamentos:
+                if classificacoes.get(pagamento.forma_pagamento_id) == 'CONTA_ASSINADA':
+                    metricas['contas_assinadas'] += pagamento.valor
+        
+        # Despesas por tipo
+        for despesa in caixa.despesas:
+            if despesa.tipo in metricas['despesas_por_tipo']:
+                metricas['despesas_por_tipo'][despesa.tipo] += despesa.valor
+        
+        # Sangrias
+        for sangria in caixa.sangrias:
+            metricas['total_sangrias'] += sangria.valor
+    
+    # Calcular melhor e pior dia
+    if metricas['vendas_por_dia']:
+        for dia, valor in metricas['vendas_por_dia'].items():
+            if valor > metricas['melhor_dia']['valor']:
+                metricas['melhor_dia'] = {'dia': dia, 'valor': valor}
+            if valor < metricas['pior_dia']['valor']:
+                metricas['pior_dia'] = {'dia': dia, 'valor': valor}
+    
+    # Calcular tickets médios
+    metricas['ticket_medio_mesa'] = total_vendas_mesa / count_vendas_mesa if count_vendas_mesa > 0 else 0
+    metricas['ticket_medio_delivery'] = total_vendas_delivery / count_vendas_delivery if count_vendas_delivery > 0 else 0
+    
+    # Calcular métricas financeiras
+    total_receitas = sum(metricas['vendas_por_turno'].values())
+    total_despesas = sum(metricas['despesas_por_tipo'].values())
+    
+    metricas['custo_operacional'] = total_despesas
+    metricas['margem_lucro'] = ((total_receitas - total_despesas) / total_receitas * 100) if total_receitas > 0 else 0
+    metricas['lucratividade'] = total_receitas - total_despesas
+    metricas['percentual_notas'] = (metricas['total_notas_fiscais'] / total_receitas * 100) if total_receitas > 0 else 0
+    
+    return metricas
+
+
+def popular_mes(dias, vendas_por_turno):
+    """Cria um mês de caixas com vendas, deliveries, despesas e sangrias"""
+    random.seed(42)
+    formas = [f.id for f in FormaPagamento.query.all()]
+    categorias = [(c.id, c.tipo) for c in CategoriaDespesa.query.all()]
+    motoboys = [m.id for m in Motoboy.query.all()]
+    operador = Usuario.query.first()
+    inicio = date.today().replace(day=1)
+
+    for d in range(dias):
+        dia = inicio + timedelta(days=d)
+        for turno in TURNOS:
+            caixa = Caixa(data=dia, turno=turno, operador_id=operador.id, saldo_inicial=100, status='FECHADO')
+            db.session.add(caixa)
+            db.session.flush()
+            hora = datetime.combine(dia, datetime.min.time())
+            for _ in range(vendas_por_turno):
+                total = round(random.uniform(10, 200), 2)
+                venda = Venda(caixa_id=caixa.id, tipo=random.choice(['MESA', 'BALCAO']), numero=random.randint(1, 30),
+                              total=total, emitiu_nota=random.random() < 0.3, data_hora=hora)
+                db.session.add(venda)
+                db.session.flush()
+                parte = round(total * random.choice([1, 0.5]), 2)
+                db.session.add(PagamentoVenda(venda_id=venda.id, forma_pagamento_id=random.choice(formas), valor=parte))
+                if parte < total:
+                    db.session.add(PagamentoVenda(venda_id=venda.id, forma_pagamento_id=random.choice(formas),
+                                                  valor=round(total - parte, 2)))
+            for _ in range(vendas_por_turno // 5):
+                total = round(random.uniform(20, 120), 2)
+                delivery = Delivery(caixa_id=caixa.id, cliente='Cliente', total=total, taxa_entrega=5,
+                                    motoboy_id=random.choice(motoboys), emitiu_nota=random.random() < 0.3, data_hora=hora)
+                db.session.add(delivery)
+                db.session.flush()
+                db.session.add(PagamentoDelivery(delivery_id=delivery.id, forma_pagamento_id=random.choice(formas),
+                                                 valor=total + 5))
+            for _ in range(5):
+                categoria_id, tipo = random.choice(categorias)
+                db.session.add(Despesa(caixa_id=caixa.id, tipo=tipo, categoria_id=categoria_id, descricao='Despesa',
+                                       valor=round(random.uniform(5, 80), 2), data_hora=hora))
+            for _ in range(2):
+                db.session.add(Sangria(caixa_id=caixa.id, valor=50, motivo='Sangria', data_hora=hora))
+        db.session.commit()
+    reconstruir_totais_caixas()
+
+
+def medir(funcao, repeticoes):
+    """Executa a função com a sessão limpa e retorna (resultado, segundos, consultas) da melhor rodada"""
+    melhor = None
+    for _ in range(repeticoes):
+        db.session.expunge_all()
+        caixas = Caixa.query.all()
+        consultas = [0]
+
+        def contar(*args):
+            consultas[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        inicio = time.perf_counter()
+        resultado = funcao(caixas)
+        duracao = time.perf_counter() - inicio
+        event.remove(db.engine, 'before_cursor_execute', contar)
+        if melhor is None or duracao < melhor[1]:
+            melhor = (resultado, duracao, consultas[0])
+    return melhor
+
+
+def comparar(a, b, caminho=''):
+    """Lista as diferenças entre dois resultados (tolerância de centavos nos valores)"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        diferencas = []
+        for chave in set(a) | set(b):
+            diferencas += comparar(a.get(chave), b.get(chave), f'{caminho}.{chave}')
+        return diferencas
+    if isinstance(a, tuple) and isinstance(b, tuple) and len(a) == len(b):
+        diferencas = []
+        for indice, (x, y) in enumerate(zip(a, b)):
+            diferencas += comparar(x, y, f'{caminho}[{indice}]')
+        return diferencas
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return [] if abs(a - b) <= 0.01 else [f'{caminho}: {a} != {b}']
+    return [] if a == b else [f'{caminho}: {a!r} != {b!r}']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark das métricas do dashboard')
+    parser.add_argument('--dias', type=int, default=30)
+    parser.add_argument('--vendas-por-turno', type=int, default=150)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        init_db()
+        print(f'Gerando {args.dias} dias x {len(TURNOS)} turnos x {args.vendas_por_turno} vendas em {_BANCO} ...')
+        popular_mes(args.dias, args.vendas_por_turno)
+
+        def anterior(caixas):
+            return metricas_dashboard_anterior(caixas), metricas_avancadas_anterior(caixas)
+
+        resultado_anterior, tempo_anterior, consultas_anterior = medir(anterior, args.repeticoes)
+        resultado_novo, tempo_novo, consultas_novo = medir(calcular_metricas_periodo, args.repeticoes)
+
+        diferencas = comparar(resultado_anterior, resultado_novo)
+        print(f"{'':<28}{'tempo (s)':>12}{'consultas':>12}")
+        print(f"{'par anterior':<28}{tempo_anterior:>12.3f}{consultas_anterior:>12}")
+        print(f"{'calcular_metricas_periodo':<28}{tempo_novo:>12.3f}{consultas_novo:>12}")
+        print(f'Ganho: {tempo_anterior / tempo_novo:.1f}x')
+        if diferencas:
+            print('ATENÇÃO: resultados diferentes:')
+            for diferenca in diferencas[:20]:
+                print('  ' + diferenca)
+            raise SystemExit(1)
+        print('Resultados idênticos.')
+
+
+if __name__ == '__main__':
+    main()
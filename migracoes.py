@@ -0,0 +1,26 @@
+import sys
+
+from app import app, db, executar_migracoes, SchemaVersion, MIGRACOES
+
+
+def main():
+    if '--status' in sys.argv:
+        with app.app_context():
+            SchemaVersion.__table__.create(db.engine, checkfirst=True)
+            aplicadas = {v.versao: v for v in SchemaVersion.query.order_by(SchemaVersion.versao)}
+        for versao, descricao, _ in MIGRACOES:
+            registro = aplicadas.get(versao)
+            situacao = registro.aplicada_em.strftime('%d/%m/%Y %H:%M') if registro else 'pendente'
+            print(f"{versao:>3}  {situacao:<16}  {descricao}")
+        return
+
+    try:
+        novas = executar_migracoes()
+    except Exception as e:
+        print(f"❌ Falha ao migrar o banco: {e}")
+        sys.exit(1)
+    print(f"Migrações aplicadas: {', '.join(map(str, novas)) if novas else 'nenhuma (banco atualizado)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import sys
+
+from app import app, reconstruir_totais_caixas, reconstruir_resumos_diarios
+
+
+def main():
+    corrigir = '--verificar' not in sys.argv
+    with app.app_context():
+        divergencias = reconstruir_totais_caixas(corrigir=corrigir)
+        resumos = reconstruir_resumos_diarios() if corrigir else None
+
+    sem_linha = [d for d in divergencias if d[1] is None]
+    campos = [d for d in divergencias if d[1] is not None]
+
+    for caixa_id, campo, atual, esperado in campos:
+        print(f"Caixa #{caixa_id} - {campo}: gravado {atual:.2f}, registros {esperado:.2f}")
+    if sem_linha:
+        print(f"Caixas sem totais gravados: {len(sem_linha)}")
+
+    acao = 'corrigidas' if corrigir else 'encontradas (nada foi alterado)'
+    print(f"Recalculo concluído. Divergências {acao}: {len(campos)}; caixas sem linha: {len(sem_linha)}")
+    if resumos is not None:
+        print(f"Caixas fechados regravados (resumo diário e snapshot): {resumos}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from app import app, db, FormaPagamento, BandeiraCartao, CategoriaDespesa
+from app import (app, db, FormaPagamento, BandeiraCartao, CategoriaDespesa, _classificar_forma_pagamento,
+                 _invalidar_cadastros)
 
 
 FORMAS_PAGAMENTO = [
@@ -47,7 +48,7 @@ def main():
 
         for nome in FORMAS_PAGAMENTO:
             if not FormaPagamento.query.filter_by(nome=nome).first():
-                db.session.add(FormaPagamento(nome=nome))
+                db.session.add(FormaPagamento(nome=nome, classificacao=_classificar_forma_pagamento(nome)))
                 adicionados += 1
 
         for nome in BandeIRAS:
@@ -60,6 +61,8 @@ def main():
                 db.session.add(CategoriaDespesa(nome=nome, tipo=tipo))
                 adicionados += 1
 
+        if adicionados:
+            _invalidar_cadastros()
         db.session.commit()
         print(f"Seed concluído. Itens adicionados: {adicionados}")
 
@@ -0,0 +1,108 @@
+import sys
+from datetime import date
+
+from app import (app, db, excluir_caixas, _sql_por_rota, _sql_por_rota_lock, SQL_INSTRUMENTACAO,
+                 Caixa, Venda, PagamentoVenda, Delivery, PagamentoDelivery, Despesa, Sangria, Suprimento,
+                 Usuario, FormaPagamento, BandeiraCartao, Motoboy, CategoriaDespesa)
+
+
+# Telas que percorrem o caixa inteiro (perfil full_caixa de opcoes_carregamento_caixa)
+ROTAS = [
+    ('admin_visualizar_caixa', '/admin/caixa/{id}/visualizar'),
+    ('exportar_excel_real', '/exportar/excel-real/{id}'),
+    ('exportar_excel_caixa', '/exportar/excel/{id}'),
+]
+ETAPAS = (5, 50)   # movimentos de cada tipo no caixa em cada medição
+DATA_VERIFICACAO = date(1900, 1, 1)
+
+
+def adicionar_movimentos(caixa_id, quantidade, referencias):
+    """Acrescenta vendas, deliveries e despesas (com pagamentos) alternando os cadastros usados"""
+    formas, bandeiras, motoboys, categorias = referencias
+    for i in range(quantidade):
+        forma = formas[i % len(formas)]
+        venda = Venda(caixa_id=caixa_id, tipo='MESA', numero=i + 1, total=10)
+        venda.pagamentos.append(PagamentoVenda(forma_pagamento_id=forma, valor=10,
+                                               bandeira_id=bandeiras[i % len(bandeiras)] if bandeiras else None))
+        delivery = Delivery(caixa_id=caixa_id, cliente='Verificação', total=10, taxa_entrega=5,
+                            motoboy_id=motoboys[i % len(motoboys)] if motoboys else None)
+        delivery.pagamentos.append(PagamentoDelivery(forma_pagamento_id=forma, valor=15))
+        despesa = Despesa(caixa_id=caixa_id, tipo='VARIAVEL', descricao='Verificação', valor=1,
+                          categoria_id=categorias[i % len(categorias)] if categorias else None,
+                          forma_pagamento_id=forma)
+        db.session.add_all([venda, delivery, despesa,
+                            Sangria(caixa_id=caixa_id, valor=1, motivo='VERIFICACAO'),
+                            Suprimento(caixa_id=caixa_id, valor=1, motivo='VERIFICACAO')])
+    db.session.commit()
+
+
+def consultas_da_rota(cliente, endpoint, url):
+    """Consultas SQL de uma requisição, pelas estatísticas por rota da instrumentação"""
+    with _sql_por_rota_lock:
+        antes = dict(_sql_por_rota.get(endpoint, {'requisicoes': 0, 'consultas': 0}))
+    resposta = cliente.get(url)
+    if resposta.status_code != 200:
+        raise RuntimeError(f'{url} retornou {resposta.status_code}')
+    with _sql_por_rota_lock:
+        depois = _sql_por_rota[endpoint]
+        if depois['requisicoes'] != antes['requisicoes'] + 1:
+            raise RuntimeError(f'{endpoint} não foi medido')
+        return depois['consultas'] - antes['consultas']
+
+
+def main():
+    if not SQL_INSTRUMENTACAO:
+        print("FALHOU a instrumentação SQL está desligada (SQL_INSTRUMENTACAO=0)")
+        sys.exit(1)
+
+    with app.app_context():
+        admin = Usuario.query.filter(Usuario.perfil.in_(['ADMIN', 'MASTER']), Usuario.ativo == True).first()
+        formas = [id_ for (id_,) in db.session.query(FormaPagamento.id)]
+        if not admin or not formas:
+            print("FALHOU o banco precisa de um usuário ADMIN e de formas de pagamento (rode python migracoes.py)")
+            sys.exit(1)
+        referencias = (
+            formas,
+            [id_ for (id_,) in db.session.query(BandeiraCartao.id)],
+            [id_ for (id_,) in db.session.query(Motoboy.id)],
+            [id_ for (id_,) in db.session.query(CategoriaDespesa.id)],
+        )
+        excluir_caixas(Caixa.data == DATA_VERIFICACAO)
+        caixa = Caixa(data=DATA_VERIFICACAO, turno='VERIFICACAO', operador_id=admin.id, status='FECHADO')
+        db.session.add(caixa)
+        db.session.commit()
+        caixa_id, admin_id = caixa.id, admin.id
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = admin_id
+
+    medicoes = {}
+    try:
+        movimentos = 0
+        for etapa in ETAPAS:
+            with app.app_context():
+                adicionar_movimentos(caixa_id, etapa - movimentos, referencias)
+            movimentos = etapa
+            for endpoint, url in ROTAS:
+                medicoes.setdefault(endpoint, []).append(consultas_da_rota(cliente, endpoint, url.format(id=caixa_id)))
+    finally:
+        with app.app_context():
+            excluir_caixas(Caixa.id == caixa_id)
+            db.session.commit()
+
+    falhas = 0
+    for endpoint, consultas in medicoes.items():
+        detalhe = ' -> '.join(f'{n} ({etapa} de cada)' for n, etapa in zip(consultas, ETAPAS))
+        if consultas[-1] > consultas[0]:
+            falhas += 1
+            print(f"FALHOU {endpoint}: consultas crescem com os movimentos: {detalhe}")
+        else:
+            print(f"OK     {endpoint}: {detalhe}")
+
+    print(f"Verificação concluída: {len(medicoes) - falhas}/{len(medicoes)} rotas com número de consultas constante")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import threading
+
+from app import app, db, movimentar_estoque, Produto, MovimentacaoEstoque
+
+
+THREADS = 8
+MOVIMENTACOES_POR_THREAD = 25
+ESTOQUE_INICIAL = 20
+CODIGO = '__verificar_estoque__'
+
+
+def trabalhador(numero, contagem, trava):
+    """Uma em cada quatro threads dá entrada e as outras tentam saídas, sempre do mesmo produto"""
+    tipo = 'ENTRADA' if numero % 4 == 0 else 'SAIDA'
+    with app.app_context():
+        produto_id = db.session.query(Produto.id).filter_by(codigo=CODIGO).scalar()
+        for _ in range(MOVIMENTACOES_POR_THREAD):
+            try:
+                movimentar_estoque(produto_id, tipo, 1, motivo='VERIFICACAO')
+                db.session.commit()
+                chave = tipo
+            except ValueError:
+                db.session.rollback()
+                chave = 'recusadas'
+            except Exception as e:
+                db.session.rollback()
+                chave = 'erros'
+                print(f"Erro na thread {numero}: {e}")
+            with trava:
+                contagem[chave] += 1
+
+
+def main():
+    with app.app_context():
+        produto = Produto.query.filter_by(codigo=CODIGO).first()
+        if produto:
+            MovimentacaoEstoque.query.filter_by(produto_id=produto.id).delete()
+            db.session.delete(produto)
+        # Saldo inicial baixo e mais saídas que entradas: o estoque acaba e a checagem de saldo é disputada
+        produto = Produto(codigo=CODIGO, nome='Verificação de concorrência', quantidade=ESTOQUE_INICIAL)
+        db.session.add(produto)
+        db.session.commit()
+        produto_id = produto.id
+
+    contagem = {'ENTRADA': 0, 'SAIDA': 0, 'recusadas': 0, 'erros': 0}
+    trava = threading.Lock()
+    threads = [threading.Thread(target=trabalhador, args=(numero, contagem, trava)) for numero in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        final = db.session.get(Produto, produto_id).quantidade
+        registradas = MovimentacaoEstoque.query.filter_by(produto_id=produto_id).count()
+        MovimentacaoEstoque.query.filter_by(produto_id=produto_id).delete()
+        db.session.delete(db.session.get(Produto, produto_id))
+        db.session.commit()
+        banco = db.engine.dialect.name
+
+    esperado = ESTOQUE_INICIAL + contagem['ENTRADA'] - contagem['SAIDA']
+    print(f"Banco: {banco} | threads: {THREADS} x {MOVIMENTACOES_POR_THREAD} movimentações")
+    print(f"Entradas: {contagem['ENTRADA']} | saídas: {contagem['SAIDA']} | recusadas por saldo: {contagem['recusadas']} | "
+          f"erros: {contagem['erros']}")
+    print(f"Quantidade final: {final} (esperada {esperado}) | movimentações registradas: {registradas}")
+
+    falhas = []
+    if contagem['erros']:
+        falhas.append('houve erros nas threads')
+    if final != esperado:
+        falhas.append('quantidade final não bate com as movimentações aceitas (atualização perdida)')
+    if final < 0:
+        falhas.append('estoque ficou negativo')
+    if registradas != contagem['ENTRADA'] + contagem['SAIDA']:
+        falhas.append('movimentações registradas não batem com as aceitas')
+    for falha in falhas:
+        print(f"FALHOU {falha}")
+    if not falhas:
+        print("OK movimentações simultâneas sem perda de atualização")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import sys
+from datetime import date
+
+from sqlalchemy import text
+
+from app import (app, db, criar_indices, Caixa, Venda, PagamentoVenda, Delivery, PagamentoDelivery,
+                 Despesa, Sangria, Suprimento, MovimentacaoEstoque)
+
+
+# (descrição, índice esperado, consulta) - as consultas quentes do PDV, login e dashboard.
+# Quando mais de um índice serve (mesmo prefixo), o esperado é uma tupla com as opções
+CONSULTAS = [
+    ('Vendas do caixa', 'ix_venda_caixa_data_hora',
+     lambda: Venda.query.filter_by(caixa_id=1).order_by(Venda.data_hora.desc())),
+    ('Deliveries do caixa', 'ix_delivery_caixa_data_hora',
+     lambda: Delivery.query.filter_by(caixa_id=1).order_by(Delivery.data_hora.desc())),
+    ('Despesas do caixa', 'ix_despesa_caixa_data_hora',
+     lambda: Despesa.query.filter_by(caixa_id=1).order_by(Despesa.data_hora.desc())),
+    ('Sangrias do caixa', 'ix_sangria_caixa_data_hora',
+     lambda: Sangria.query.filter_by(caixa_id=1).order_by(Sangria.data_hora.desc())),
+    ('Suprimentos do caixa', 'ix_suprimento_caixa_data_hora',
+     lambda: Suprimento.query.filter_by(caixa_id=1).order_by(Suprimento.data_hora.desc())),
+    ('Login: caixa do turno', 'ix_caixa_data_turno_status',
+     lambda: Caixa.query.filter_by(data=date.today(), turno='MANHÃ', status='ABERTO')),
+    ('Dashboard: caixas do período', ('ix_caixa_data_turno_status', 'ix_caixa_data_hora_abertura'),
+     lambda: Caixa.query.filter(Caixa.data >= date.today().replace(day=1), Caixa.data <= date.today())),
+    ('Listagem de caixas (paginação por chave)', 'ix_caixa_data_hora_abertura',
+     lambda: Caixa.query.filter(Caixa.data <= date.today()).order_by(
+         Caixa.data.desc(), Caixa.hora_abertura.desc(), Caixa.id.desc()).limit(21)),
+    ('Pagamentos da venda', 'ix_pagamento_venda_venda_id',
+     lambda: PagamentoVenda.query.filter_by(venda_id=1)),
+    ('Pagamentos do delivery', 'ix_pagamento_delivery_delivery_id',
+     lambda: PagamentoDelivery.query.filter_by(delivery_id=1)),
+    ('Movimentações do produto', 'ix_movimentacao_estoque_produto_data_hora',
+     lambda: MovimentacaoEstoque.query.filter_by(produto_id=1).order_by(MovimentacaoEstoque.data_hora.desc())),
+]
+
+
+def plano_execucao(consulta):
+    """Texto do EXPLAIN da consulta no banco configurado"""
+    sql = str(consulta.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    sqlite = db.engine.dialect.name == 'sqlite'
+    with db.engine.connect() as conn:
+        if not sqlite:
+            # Tabelas pequenas levam o PostgreSQL a preferir seq scan. Sem ele o plano prova só que o
+            # índice serve à consulta, não que será o escolhido com os dados reais (ver aviso em main)
+            conn.execute(text('SET enable_seqscan = off'))
+        linhas = conn.execute(text(('EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN ') + sql))
+        return '\n'.join(' '.join(str(coluna) for coluna in linha) for linha in linhas)
+
+
+def main():
+    criar = '--criar' in sys.argv
+    with app.app_context():
+        if criar:
+            criados = criar_indices()
+            print(f"Índices criados: {', '.join(criados) if criados else 'nenhum'}")
+
+        postgres = db.engine.dialect.name == 'postgresql'
+        falhas = 0
+        for descricao, indices, consulta in CONSULTAS:
+            plano = plano_execucao(consulta())
+            indices = (indices,) if isinstance(indices, str) else indices
+            usado = next((indice for indice in indices if indice in plano), None)
+            if usado:
+                print(f"OK     {descricao}: {usado}")
+            else:
+                falhas += 1
+                print(f"FALHOU {descricao}: esperado {' ou '.join(indices)}")
+                print('       ' + plano.replace('\n', '\n       '))
+
+    print(f"Verificação concluída: {len(CONSULTAS) - falhas}/{len(CONSULTAS)} consultas com índice utilizável")
+    if postgres:
+        print("Atenção: os planos foram gerados com enable_seqscan = off. Isso mostra que cada índice serve à "
+              "consulta, não que o PostgreSQL o escolhe com o volume e as estatísticas reais; para isso rode "
+              "EXPLAIN ANALYZE no banco de produção.")
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import sys
+
+from sqlalchemy import event
+
+from app import app, db, DB_POOLER
+
+
+REQUISICOES = 50
+
+
+def main():
+    with app.app_context():
+        engine = db.engine
+    pool = engine.pool
+    print(f"Banco: {engine.dialect.name} | pool: {type(pool).__name__} | {pool.status()}")
+
+    conexoes_abertas = []
+    conexoes_usadas = []
+    event.listen(engine, 'connect', lambda dbapi_conn, registro: conexoes_abertas.append(id(dbapi_conn)))
+    event.listen(engine, 'checkout', lambda dbapi_conn, registro, proxy: conexoes_usadas.append(id(dbapi_conn)))
+
+    # Login com usuário inexistente: consulta a tabela usuario e não grava nada
+    cliente = app.test_client()
+    for _ in range(REQUISICOES):
+        resposta = cliente.post('/login', data={'operador': '__verificar_pool__', 'senha': 'x'})
+        if resposta.status_code >= 500:
+            print(f"FALHOU requisição retornou {resposta.status_code}")
+            sys.exit(1)
+
+    distintas = len(set(conexoes_usadas))
+    print(f"Requisições: {REQUISICOES} | checkouts: {len(conexoes_usadas)} | "
+          f"conexões abertas: {len(conexoes_abertas)} | conexões distintas usadas: {distintas}")
+
+    if DB_POOLER == 'transaction':
+        # Sem pool local: cada checkout abre conexão e o reaproveitamento fica a cargo do pooler
+        print("Modo pooler (DB_POOLER=transaction): reaproveitamento feito pelo PgBouncer")
+        sys.exit(0)
+
+    if len(conexoes_usadas) < REQUISICOES:
+        print("FALHOU as requisições não passaram pelo banco")
+        sys.exit(1)
+    if len(conexoes_abertas) > 2 or distintas > 2:
+        print("FALHOU conexões não estão sendo reaproveitadas entre requisições")
+        sys.exit(1)
+    print("OK conexões reaproveitadas pelo pool")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()